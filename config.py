@@ -11,25 +11,56 @@ EMAIL_CONFIG = {
     "folder_name": "12306"  # 存放12306邮件的文件夹
 }
 
+# 需要同步的邮箱账号列表，每项格式同 EMAIL_CONFIG，可选 "provider" 指定 EMAIL_PROVIDERS 中的服务商
+EMAIL_ACCOUNTS = [EMAIL_CONFIG]
+
 # 乘客姓名过滤（可选）
 PASSENGER_FILTER = "温阳光"  # 只处理指定乘客的车票信息，设为None则不过滤
 
 # 数据库配置
 DATABASE_CONFIG = {
-    "db_path": "ticket/tickets.db"  # 数据库文件路径
+    "db_path": "ticket/tickets.db",  # 数据库文件路径
+    "journal_mode": "WAL",  # WAL模式下后台写入不会阻塞接口读取
+    "synchronous": "NORMAL",  # WAL模式下NORMAL即可保证数据库不损坏
+    "cache_size": -20000,  # 页缓存大小，负数表示KB，即约20MB
+    "mmap_size": 268435456,  # 内存映射读取的最大字节数（256MB）
+    "busy_timeout": 5000,  # 数据库被锁定时的等待时间（毫秒）
+    "query_cache_size": 128,  # 进程内缓存的查询结果数量，数据变化后自动失效，设为0则不缓存
+    "query_cache_max_rows": 50000,  # 查询缓存中所有结果的总行数上限，超过上限的单个结果不缓存
 }
 
 # 服务器配置
 SERVER_CONFIG = {
     "host": "0.0.0.0",
     "port": 8888,
-    "debug": False
+    "debug": False,
+    "cache_control": "no-cache",  # 车票接口的 Cache-Control，no-cache 表示浏览器每次都带 ETag 向服务端确认
+    "response_cache_size": 64,  # 进程内缓存的序列化响应数量，数据版本变化后自动失效
+    "response_cache_max_bytes": 67108864,  # 响应缓存的总字节数上限（64MB），超过上限的单个响应不缓存
+    "db_workers": 4,  # 接口查询数据库的线程数，查询在线程池中执行，不阻塞其他请求
 }
 
 # 邮件处理配置
 MAIL_CONFIG = {
-    "auto_refresh_interval": 3600,  # 自动刷新间隔（秒）
+    "auto_refresh_interval": 3600,  # 自动刷新间隔（秒），设为0则只在手动触发时同步
+    "auto_refresh_jitter": 0.1,  # 自动刷新等待时间的随机抖动比例
+    "retry_base_delay": 60,  # 同步失败后首次重试的等待时间（秒），之后按指数退避
     "max_emails_per_fetch": 100,  # 每次最多处理的邮件数量
+    "max_connections": 8,  # 多账号并发同步时的最大IMAP连接数
+}
+
+# 邮件拉取配置
+MAIL_FETCH_CONFIG = {
+    "days_back": 30,  # 只拉取最近30天的邮件，设为None则拉取所有邮件
+    "max_emails": 100,  # 最多处理100封邮件，设为None则不限制
+    "fetch_all": False,  # 是否忽略days_back拉取全部邮件
+    "incremental": True,  # 是否基于UIDVALIDITY/UID增量同步，只拉取上次同步之后的新邮件
+    "batch_size": 200,  # 每次 UID FETCH 请求批量获取的邮件数量
+    "header_prefilter": True,  # 先只拉取邮件主题，仅下载车票通知邮件的正文
+    "dedup": True,  # 记录已处理邮件的 Message-ID 和内容哈希，未变化的邮件再次同步时不再解析
+    "html_extractor": "builtin",  # HTML正文提取方式：builtin 使用内置 html.parser，bs4 使用 BeautifulSoup
+    "backfill_workers": None,  # 全量回填 (python -m tools.backfill) 的解析进程数，设为None则使用CPU核数
+    "backfill_queue_size": 8,  # 全量回填各阶段之间最多缓存的批次数
 }
 
 # 支持的邮箱服务商配置
@@ -37,22 +68,26 @@ EMAIL_PROVIDERS = {
     "163": {
         "imap_host": "imap.163.com",
         "smtp_host": "smtp.163.com",
-        "port": 993
+        "port": 993,
+        "max_connections": 2  # 该服务商允许的最大并发IMAP连接数
     },
     "qq": {
         "imap_host": "imap.qq.com",
         "smtp_host": "smtp.qq.com",
-        "port": 993
+        "port": 993,
+        "max_connections": 2
     },
     "gmail": {
         "imap_host": "imap.gmail.com",
         "smtp_host": "smtp.gmail.com",
-        "port": 993
+        "port": 993,
+        "max_connections": 4
     },
     "outlook": {
         "imap_host": "outlook.office365.com",
         "smtp_host": "smtp.office365.com",
-        "port": 993
+        "port": 993,
+        "max_connections": 4
     }
 }
 
@@ -1,15 +1,29 @@
 # -*- coding: utf-8 -*-
 from typing import Optional
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import csv
+import io
+import json
 import logging
-from ticket.models import TicketDB
-from tools.mail import main as mail_main
+from ticket.models import TicketDB, TICKET_COLUMNS, init_db, query_cache, close_connections
+from ticket.cache import QueryCache
+from tools.async_mail import AsyncMailPool
+from tools.scheduler import IngestionScheduler
 from config import SERVER_CONFIG, LOGGING_CONFIG
 import os
 
+# orjson 为可选依赖，安装后用于序列化车票接口的响应
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # 配置日志
 logging.basicConfig(
     level=getattr(logging, LOGGING_CONFIG["level"]),
@@ -21,10 +35,147 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 多邮箱账号同步池和后台同步调度器
+mail_pool = AsyncMailPool()
+scheduler = IngestionScheduler(mail_pool)
+
+# 数据库查询和响应序列化都是阻塞操作，放到有界线程池中执行，事件循环只负责调度；
+# 每个线程复用自己的数据库连接，见 ticket.models.get_connection
+def _new_db_executor():
+    return ThreadPoolExecutor(max_workers=SERVER_CONFIG.get("db_workers", 4), thread_name_prefix="db")
+
+db_executor = _new_db_executor()
+
+def _call_with_db(func):
+    # 接口响应由 response_cache 缓存序列化结果，不再经过 query_cache，同一结果只在内存中保留一份
+    db = TicketDB(use_query_cache=False)
+    try:
+        return func(db)
+    finally:
+        db.close()
+
+async def run_db(func):
+    """
+    在数据库线程池中执行 func(db)
+    :param func: 接收 TicketDB 对象的函数
+    :return: func 的返回值
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, _call_with_db, func)
+
+# 按数据版本缓存序列化后的响应，数据版本变化后旧的缓存自然失效；按响应总字节数限制内存占用，超过上限的单个响应不缓存
+response_cache = QueryCache(SERVER_CONFIG.get("response_cache_size", 64),
+                            SERVER_CONFIG.get("response_cache_max_bytes", 64 * 1024 * 1024), len)
+
+def render_json(content):
+    """
+    序列化响应内容为 bytes，不经过 jsonable_encoder；安装了 orjson 时使用 orjson，
+    否则使用标准库 json，两者输出一致，格式与 FastAPI 默认的 JSONResponse 相同
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def etag_matches(if_none_match, etag):
+    """
+    判断请求头 If-None-Match 是否包含当前 ETag，按弱比较处理 W/ 前缀
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+async def conditional_response(request, build):
+    """
+    按数据版本返回响应：客户端的 ETag 与当前版本一致时返回 304，
+    否则优先使用进程内缓存的序列化结果，缓存未命中时才在数据库线程池中调用 build 查询并序列化
+    :param request: 请求对象
+    :param build: 接收 TicketDB 对象的函数，返回响应内容
+    :return: Response
+    """
+    version = await run_db(lambda db: db.get_data_version())
+    if version is None:
+        body = await run_db(lambda db: render_json(build(db)))
+        return Response(content=body, media_type="application/json")
+
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": SERVER_CONFIG.get("cache_control", "no-cache")}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    # 响应缓存只在事件循环线程中读写
+    key = (request.url.path, request.url.query)
+    body = response_cache.get(key, version)
+    if body is None:
+        body = await run_db(lambda db: render_json(build(db)))
+        response_cache.set(key, version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# 导出格式及其 Content-Type
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def render_ndjson(batches):
+    """
+    把逐批读取的车票转换为 NDJSON，每行一张车票，每批输出一个数据块
+    """
+    for tickets in batches:
+        yield b"".join(render_json(ticket) + b"\n" for ticket in tickets)
+
+def render_csv(fields, batches):
+    """
+    把逐批读取的车票元组转换为 CSV，第一行为字段名，每批输出一个数据块，布尔字段输出为 1/0
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        chunk = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    writer.writerow(fields)
+    yield flush()
+    for rows in batches:
+        writer.writerows(rows)
+        yield flush()
+
+@asynccontextmanager
+async def lifespan(app):
+    global db_executor
+    # 启动时初始化一次数据库表结构，之后的请求直接复用连接
+    await asyncio.get_running_loop().run_in_executor(db_executor, init_db)
+    # 应用可能在同一进程中多次启动，邮件同步池在每次启动时重新创建线程池和信号量
+    mail_pool.start()
+    scheduler.start()
+    yield
+    await scheduler.stop()
+    executor = db_executor
+    # 换成新的线程池（线程在提交任务时才创建），同一进程中应用可以再次启动，如多次进入 TestClient
+    db_executor = _new_db_executor()
+    await asyncio.get_running_loop().run_in_executor(None, _shutdown_workers, executor)
+
+def _shutdown_workers(executor):
+    # 等待进行中的邮件同步和数据库查询结束后，关闭各线程持有的数据库连接
+    mail_pool.close(wait=True)
+    executor.shutdown(wait=True)
+    close_connections()
+
 app = FastAPI(
     title="12306 车票信息管理系统",
     description="基于邮箱爬取12306车票信息并进行可视化展示的系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加CORS中间件
@@ -44,21 +195,55 @@ async def root():
     return {"message": "12306 车票信息管理系统", "docs": "/docs", "tickets": "/tickets"}
 
 @app.get("/tickets")
-async def get_all_tickets():
+async def get_all_tickets(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    passenger: Optional[str] = None,
+    train_number: Optional[str] = None,
+    status: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+):
     """
-    获取所有车票信息
+    获取车票信息，按出发时间倒序，支持分页、字段筛选和条件过滤
+    :param limit: 每页数量，不传时返回全部车票
+    :param cursor: 上一页返回的 next_cursor
+    :param fields: 需要返回的字段，逗号分隔
+    :param passenger: 乘客姓名
+    :param train_number: 车次
+    :param status: 车票状态 normal / waiting / refunded
+    :param start_date: 开始日期 (YYYY-MM-DD)
+    :param end_date: 结束日期 (YYYY-MM-DD)
     """
-    try:
-        db = TicketDB()
-        tickets = db.get_all_tickets()
-        db.close()
+    def build(db):
+        tickets, next_cursor = db.query_tickets(
+            limit=limit,
+            cursor=cursor,
+            fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None,
+            passenger_name=passenger,
+            train_number=train_number,
+            status=status,
+            start_date=start_date,
+            end_date=end_date
+        )
         
         logger.info(f"成功获取 {len(tickets)} 张车票信息")
         
         return {
             "total": len(tickets),
-            "tickets": tickets
+            "tickets": tickets,
+            "next_cursor": next_cursor
         }
+
+    try:
+        return await conditional_response(request, build)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
     except Exception as e:
         logger.error(f"获取车票信息失败: {e}")
         raise HTTPException(
@@ -67,18 +252,19 @@ async def get_all_tickets():
         )
 
 @app.get("/tickets/stats")
-async def get_ticket_statistics():
+async def get_ticket_statistics(request: Request):
     """
     获取车票统计信息
     """
-    try:
-        db = TicketDB()
+    def build(db):
         stats = db.get_statistics()
-        db.close()
         
         logger.info("成功获取车票统计信息")
         
         return stats
+
+    try:
+        return await conditional_response(request, build)
     except Exception as e:
         logger.error(f"获取统计信息失败: {e}")
         raise HTTPException(
@@ -87,16 +273,14 @@ async def get_ticket_statistics():
         )
 
 @app.get("/tickets/range")
-async def get_tickets_by_date_range(start_date: str, end_date: str):
+async def get_tickets_by_date_range(request: Request, start_date: str, end_date: str):
     """
     根据日期范围获取车票信息
     :param start_date: 开始日期 (YYYY-MM-DD)
     :param end_date: 结束日期 (YYYY-MM-DD)
     """
-    try:
-        db = TicketDB()
+    def build(db):
         tickets = db.get_tickets_by_date_range(start_date, end_date)
-        db.close()
         
         logger.info(f"成功获取 {start_date} 到 {end_date} 的车票信息，共 {len(tickets)} 张")
         
@@ -106,6 +290,14 @@ async def get_tickets_by_date_range(start_date: str, end_date: str):
             "total": len(tickets),
             "tickets": tickets
         }
+
+    try:
+        return await conditional_response(request, build)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"日期格式错误，应为 YYYY-MM-DD: {str(e)}"
+        )
     except Exception as e:
         logger.error(f"获取日期范围车票信息失败: {e}")
         raise HTTPException(
@@ -113,35 +305,115 @@ async def get_tickets_by_date_range(start_date: str, end_date: str):
             detail=f"获取日期范围车票信息失败: {str(e)}"
         )
 
+@app.get("/tickets/export")
+async def export_tickets(
+    export_format: str = Query("ndjson", alias="format"),
+    fields: Optional[str] = None,
+    passenger: Optional[str] = None,
+    train_number: Optional[str] = None,
+    status: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+):
+    """
+    流式导出车票，按出发时间倒序，边从数据库分批读取边发送，内存占用与车票总数无关
+    :param export_format: 导出格式 ndjson 或 csv
+    :param fields: 需要导出的字段，逗号分隔
+    :param passenger: 乘客姓名
+    :param train_number: 车次
+    :param status: 车票状态 normal / waiting / refunded
+    :param start_date: 开始日期 (YYYY-MM-DD)
+    :param end_date: 结束日期 (YYYY-MM-DD)
+    """
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的导出格式: {export_format}，可选 {', '.join(EXPORT_MEDIA_TYPES)}"
+        )
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else list(TICKET_COLUMNS)
+    try:
+        # 生成器使用自己的数据库连接，由 StreamingResponse 在线程池中逐批迭代
+        batches = await run_db(lambda db: db.iter_tickets(
+            fields=field_list,
+            passenger_name=passenger,
+            train_number=train_number,
+            status=status,
+            start_date=start_date,
+            end_date=end_date,
+            as_dict=export_format == "ndjson"
+        ))
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"导出车票信息失败: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"导出车票信息失败: {str(e)}"
+        )
+
+    logger.info(f"开始导出车票信息，格式: {export_format}")
+    content = render_ndjson(batches) if export_format == "ndjson" else render_csv(field_list, batches)
+    return StreamingResponse(
+        content,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="tickets.{export_format}"'}
+    )
+
 @app.get("/update_ticket")
 async def update_ticket():
     """
-    手动更新车票信息（从邮箱读取）
+    手动更新车票信息（从邮箱读取），提交后台同步任务并立即返回任务ID
     """
     try:
-        logger.info("开始手动更新车票信息")
-        mail_main()
-        logger.info("车票信息更新完成")
+        job = scheduler.trigger("manual")
+        logger.info(f"已提交车票信息更新任务: {job['job_id']}")
         
         return {
-            "message": "Ticket updated successfully",
-            "status": "success"
+            "message": "Ticket update queued",
+            "status": job["status"],
+            "job_id": job["job_id"]
         }
     except Exception as e:
-        logger.error(f"更新车票信息失败: {e}")
+        logger.error(f"提交更新任务失败: {e}")
         raise HTTPException(
             status_code=500,
-            detail=f"更新车票信息失败: {str(e)}"
+            detail=f"提交更新任务失败: {str(e)}"
         )
 
+@app.get("/update_ticket/{job_id}")
+async def get_update_job(job_id: str):
+    """
+    查询车票信息更新任务的状态
+    :param job_id: 任务ID
+    """
+    job = scheduler.get_job(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"更新任务不存在: {job_id}"
+        )
+    return job
+
+@app.get("/cache/stats")
+async def get_cache_statistics():
+    """
+    查询缓存和响应缓存的命中统计
+    """
+    return {
+        "query_cache": query_cache.stats(),
+        "response_cache": response_cache.stats()
+    }
+
 @app.get("/health")
 async def health_check():
     """
     健康检查接口
     """
     try:
-        db = TicketDB()
-        db.close()
+        await run_db(lambda db: None)
         return {
             "status": "healthy",
             "database": "connected",
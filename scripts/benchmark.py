@@ -0,0 +1,832 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+12306 车票信息管理系统性能基准脚本
+
+用法:
+    python scripts/benchmark.py fetch --messages 2000 --latency 0.002
+    python scripts/benchmark.py prefilter --messages 2000 --ticket-every 10
+    python scripts/benchmark.py upsert --rows 5000
+    python scripts/benchmark.py range --rows 50000
+    python scripts/benchmark.py parser --corpus 2000
+    python scripts/benchmark.py clean --sizes 2000,8000,32000
+    python scripts/benchmark.py decode --messages 500
+    python scripts/benchmark.py html --messages 500
+    python scripts/benchmark.py backfill --messages 100000 --workers 1,2,4
+    python scripts/benchmark.py stream --messages 5000
+    python scripts/benchmark.py import --messages 20000
+    python scripts/benchmark.py dedup --messages 5000
+    python scripts/benchmark.py etag --rows 10000
+    python scripts/benchmark.py serialize --rows 10000,100000
+    python scripts/benchmark.py export --rows 100000
+    python scripts/benchmark.py columnar --rows 100000
+    python scripts/benchmark.py load --rows 10000 --messages 20000
+    python scripts/benchmark.py cache --rows 10000
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.support import (
+    FakeIMAPServer, legacy_clean_text_content, legacy_parse_refund_info, legacy_parse_ticket_info,
+    make_clean_body, make_html_corpus, make_parser_corpus, make_ticket_email, make_ticket_rows
+)
+
+def bench_fetch(args):
+    """
+    对比逐封 FETCH 与批量 FETCH 的吞吐量
+    """
+    from tools import mail
+
+    mail.MAIL_FETCH_CONFIG["days_back"] = None
+    mail.MAIL_FETCH_CONFIG["incremental"] = False
+    messages = {uid: make_ticket_email(uid) for uid in range(1, args.messages + 1)}
+
+    with FakeIMAPServer(messages, latency=args.latency) as server:
+        host, port = server.server_address
+        for batch_size in (1, args.batch_size):
+            mail.MAIL_FETCH_CONFIG["batch_size"] = batch_size
+            reader = mail.MailReader(imap_host=host, imap_port=port, email_user="bench", email_pwd="bench")
+            start = time.perf_counter()
+            emails = reader.read_emails(max_emails=args.messages)
+            elapsed = time.perf_counter() - start
+            print(f"batch_size={batch_size:<5} {len(emails)} 封邮件 {elapsed:.2f}s "
+                  f"{len(emails) / elapsed:.0f} 封/秒")
+
+def bench_prefilter(args):
+    """
+    对比混合文件夹中直接下载全部正文与先筛选邮件头的传输量和耗时
+    """
+    from tools import mail
+
+    mail.MAIL_FETCH_CONFIG["days_back"] = None
+    mail.MAIL_FETCH_CONFIG["incremental"] = False
+    mail.MAIL_FETCH_CONFIG["batch_size"] = args.batch_size
+    messages = {}
+    for uid in range(1, args.messages + 1):
+        if uid % args.ticket_every == 0:
+            messages[uid] = make_ticket_email(uid)
+        else:
+            messages[uid] = make_ticket_email(uid, subject="铁路畅行会员积分通知", padding=args.padding)
+
+    with FakeIMAPServer(messages, latency=args.latency) as server:
+        host, port = server.server_address
+        for prefilter in (False, True):
+            mail.MAIL_FETCH_CONFIG["header_prefilter"] = prefilter
+            server.bytes_sent = 0
+            reader = mail.MailReader(imap_host=host, imap_port=port, email_user="bench", email_pwd="bench")
+            start = time.perf_counter()
+            emails = reader.read_emails(max_emails=args.messages)
+            elapsed = time.perf_counter() - start
+            tickets = sum(1 for email_info in emails if email_info["subject"] in mail.TICKET_SUBJECTS)
+            print(f"header_prefilter={str(prefilter):<5} 车票邮件 {tickets} 封 "
+                  f"传输 {server.bytes_sent / 1024 / 1024:.2f}MB 耗时 {elapsed:.2f}s")
+
+def bench_upsert(args):
+    """
+    对比逐条 add_ticket 与 bulk_upsert_tickets 的写入速度
+    """
+    from ticket.models import TicketDB
+
+    rows = make_ticket_rows(args.rows)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = TicketDB(os.path.join(tmp_dir, "per_row.db"))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for row in rows:
+                db.add_ticket(row)
+        elapsed = time.perf_counter() - start
+        print(f"add_ticket           {len(rows)} 行 {elapsed:.2f}s {len(rows) / elapsed:.0f} 行/秒")
+
+        db = TicketDB(os.path.join(tmp_dir, "bulk.db"))
+        start = time.perf_counter()
+        written = db.bulk_upsert_tickets(rows, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        print(f"bulk_upsert_tickets  {written} 行 {elapsed:.2f}s {written / elapsed:.0f} 行/秒")
+
+# 需要走索引的查询及其应使用的索引
+def bench_range(args):
+    """
+    测量日期范围查询耗时，执行计划是否使用索引见 tests/test_models.py
+    """
+    from ticket.models import TicketDB, query_cache
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = TicketDB(os.path.join(tmp_dir, "range.db"))
+        db.bulk_upsert_tickets(make_ticket_rows(args.rows))
+        db.conn.execute("ANALYZE")
+        # 只测量数据库查询，不经过查询缓存
+        query_cache.max_size = 0
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            tickets = db.get_tickets_by_date_range("2021-01-01", "2021-01-31")
+        elapsed = time.perf_counter() - start
+        print(f"get_tickets_by_date_range {len(tickets)} 张车票 平均 {elapsed / args.repeat * 1000:.2f}ms")
+
+def bench_parser(args):
+    """
+    对比解析器与原始实现的每秒解析次数，解析结果的对照校验见 tests/test_ticket_parser.py
+    """
+    from ticket.ticket_parser import parse_ticket_info, parse_ticket_infos, parse_refund_info
+
+    corpus = make_parser_corpus(args.corpus)
+    for name, func in (("legacy_parse_ticket_info", legacy_parse_ticket_info),
+                       ("parse_ticket_info", parse_ticket_info),
+                       ("parse_ticket_infos", parse_ticket_infos),
+                       ("legacy_parse_refund_info", legacy_parse_refund_info),
+                       ("parse_refund_info", parse_refund_info)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for text in corpus:
+                func(text)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<26} {len(corpus) * args.repeat / elapsed:.0f} 次/秒")
+
+def bench_clean(args):
+    """
+    对比不同正文长度下清理文本的耗时，新实现的每字符耗时应基本不随长度变化
+    """
+    from ticket.ticket_parser import clean_text_content
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        body = make_clean_body(size)
+        line = f"{size:>9} 字符"
+        funcs = [("clean_text_content", clean_text_content)]
+        if size <= args.legacy_max:
+            funcs.insert(0, ("legacy", legacy_clean_text_content))
+        for name, func in funcs:
+            repeat = max(1, args.repeat * 1000 // size)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func(body)
+            elapsed = (time.perf_counter() - start) / repeat
+            line += f"  {name} {elapsed * 1000:.3f}ms ({elapsed / size * 1e9:.1f}ns/字符)"
+        print(line)
+
+def bench_decode(args):
+    """
+    对比每个正文部分都用 chardet 检测编码与优先使用声明编码的解码耗时
+    """
+    import email
+    from collections import Counter
+    import chardet
+    from tools.mail import decode_payload
+
+    parts = []
+    for index in range(args.messages):
+        raw = make_ticket_email(index, padding=args.padding, charset="gbk" if index % 2 else "utf-8")
+        part = email.message_from_bytes(raw)
+        parts.append((part.get_payload(decode=True), part.get_content_charset()))
+
+    start = time.perf_counter()
+    legacy = [payload.decode(chardet.detect(payload)["encoding"], errors="ignore") for payload, _ in parts]
+    legacy_elapsed = time.perf_counter() - start
+
+    stats = Counter()
+    start = time.perf_counter()
+    decoded = [decode_payload(payload, charset, stats) for payload, charset in parts]
+    elapsed = time.perf_counter() - start
+
+    print(f"chardet 检测        {len(parts)} 个正文 {legacy_elapsed:.3f}s {len(parts) / legacy_elapsed:.0f} 个/秒")
+    print(f"decode_payload      {len(parts)} 个正文 {elapsed:.3f}s {len(parts) / elapsed:.0f} 个/秒")
+    print(f"解码路径: {dict(stats)}")
+
+def bench_html(args):
+    """
+    对比 BeautifulSoup 与内置 html.parser 提取器的耗时，两者结果的对照校验见 tests/test_mail.py
+    """
+    from tools.mail import remove_html_tags_and_whitespace
+
+    corpus = make_html_corpus(args.messages, args.padding)
+    for extractor in ("bs4", "builtin"):
+        start = time.perf_counter()
+        for html in corpus:
+            remove_html_tags_and_whitespace(html, extractor)
+        elapsed = time.perf_counter() - start
+        print(f"{extractor:<8} {len(corpus)} 封 {elapsed:.3f}s {len(corpus) / elapsed:.0f} 封/秒")
+
+def bench_backfill(args):
+    """
+    对比串行读取解析与不同进程数的流水线回填的吞吐量
+    """
+    from tools import mail
+    from tools.backfill import backfill_account
+    from ticket.models import TicketDB
+
+    mail.MAIL_FETCH_CONFIG["header_prefilter"] = False
+    mail.MAIL_FETCH_CONFIG["incremental"] = False
+    mail.MAIL_FETCH_CONFIG["batch_size"] = args.batch_size
+    messages = {uid: make_ticket_email(uid) for uid in range(1, args.messages + 1)}
+
+    with FakeIMAPServer(messages) as server, tempfile.TemporaryDirectory() as tmp_dir:
+        host, port = server.server_address
+        account = {"imap_host": host, "imap_port": port, "email_user": "bench", "email_pwd": "bench"}
+
+        db = TicketDB(os.path.join(tmp_dir, "serial.db"))
+        reader = mail.MailReader(**account)
+        start = time.perf_counter()
+        reader.connect()
+        reader.login()
+        reader.select_folder()
+        emails = [reader.parse_message(msg) for _, msg in reader.fetch_emails_batch(reader.search_emails(fetch_all=True))]
+        stats = mail.process_ticket_emails(emails, db)
+        elapsed = time.perf_counter() - start
+        reader.imap_client.logout()
+        db.close()
+        print(f"串行         {len(emails)} 封 车票 {stats['tickets_added']} {elapsed:.2f}s {len(emails) / elapsed:.0f} 封/秒")
+
+        for workers in (int(workers) for workers in args.workers.split(",")):
+            stats = backfill_account(account, workers=workers, batch_size=args.batch_size,
+                                     db_name=os.path.join(tmp_dir, f"backfill-{workers}.db"))
+            print(f"workers={workers:<4} {stats['messages']} 封 车票 {stats['tickets_added']} "
+                  f"{stats['elapsed']:.2f}s {stats['messages_per_second']:.0f} 封/秒")
+
+def bench_stream(args):
+    """
+    对比先读取全部邮件再处理与边读取边处理的内存峰值和首次写入数据库的时间
+    """
+    import tracemalloc
+    from tools import mail
+    from ticket.models import TicketDB
+
+    mail.MAIL_FETCH_CONFIG["days_back"] = None
+    mail.MAIL_FETCH_CONFIG["incremental"] = False
+    mail.MAIL_FETCH_CONFIG["header_prefilter"] = False
+    mail.MAIL_FETCH_CONFIG["batch_size"] = args.batch_size
+    messages = {uid: make_ticket_email(uid, padding=args.padding) for uid in range(1, args.messages + 1)}
+
+    with FakeIMAPServer(messages) as server, tempfile.TemporaryDirectory() as tmp_dir:
+        host, port = server.server_address
+        for mode in ("list", "stream"):
+            db = TicketDB(os.path.join(tmp_dir, f"{mode}.db"))
+            first_write = []
+            bulk_upsert_tickets = db.bulk_upsert_tickets
+
+            def timed_upsert(tickets, **kwargs):
+                if tickets and not first_write:
+                    first_write.append(time.perf_counter())
+                return bulk_upsert_tickets(tickets, **kwargs)
+
+            db.bulk_upsert_tickets = timed_upsert
+            reader = mail.MailReader(imap_host=host, imap_port=port, email_user="bench", email_pwd="bench")
+            tracemalloc.start()
+            start = time.perf_counter()
+            if mode == "list":
+                emails = reader.read_emails(max_emails=args.messages)
+            else:
+                emails = reader.iter_emails(max_emails=args.messages)
+            stats = mail.process_ticket_emails(emails, db)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            db.close()
+            del emails
+            print(f"{mode:<7} 车票 {stats['tickets_added']} 耗时 {elapsed:.2f}s 内存峰值 {peak / 1024 / 1024:.1f}MB "
+                  f"首次写入 {first_write[0] - start:.2f}s")
+
+def bench_import(args):
+    """
+    生成 mbox、Maildir 和 .eml 三种格式的本地邮件，测量离线导入的吞吐量
+    """
+    from tools.importer import import_messages
+    from ticket.models import TicketDB
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mbox_path = os.path.join(tmp_dir, "12306.mbox")
+        maildir_path = os.path.join(tmp_dir, "Maildir")
+        eml_path = os.path.join(tmp_dir, "eml")
+        for directory in (os.path.join(maildir_path, "cur"), os.path.join(maildir_path, "new"), eml_path):
+            os.makedirs(directory)
+
+        with open(mbox_path, "wb") as mbox:
+            for uid in range(1, args.messages + 1):
+                if uid % args.ticket_every == 0:
+                    raw = make_ticket_email(uid)
+                else:
+                    raw = make_ticket_email(uid, subject="铁路畅行会员积分通知", padding=args.padding)
+                mbox.write(b"From 12306@rails.com.cn Wed Jan 10 10:00:00 2024\n" + raw.replace(b"\r\n", b"\n") + b"\n")
+                with open(os.path.join(maildir_path, "cur", f"{uid}.bench:2,S"), "wb") as f:
+                    f.write(raw)
+                with open(os.path.join(eml_path, f"{uid}.eml"), "wb") as f:
+                    f.write(raw)
+
+        for name, path in (("mbox", mbox_path), ("Maildir", maildir_path), (".eml", eml_path)):
+            db = TicketDB(os.path.join(tmp_dir, f"{name}.db"))
+            stats = import_messages([path], db)
+            db.close()
+            print(f"{name:<8} {stats['messages']} 封 车票通知 {stats['ticket_messages']} 新增车票 {stats['tickets_added']} "
+                  f"{stats['elapsed']:.2f}s {stats['messages_per_second']:.0f} 封/秒 {stats['mb_per_second']:.1f}MB/秒")
+
+def bench_dedup(args):
+    """
+    对同一邮箱连续全量同步两次，对比开启和关闭已处理邮件台账时第二次同步的耗时
+    """
+    from tools import mail
+    from ticket.models import TicketDB
+
+    mail.MAIL_FETCH_CONFIG["days_back"] = None
+    mail.MAIL_FETCH_CONFIG["incremental"] = False
+    mail.MAIL_FETCH_CONFIG["header_prefilter"] = False
+    mail.MAIL_FETCH_CONFIG["max_emails"] = args.messages
+    messages = {uid: make_ticket_email(uid, padding=args.padding) for uid in range(1, args.messages + 1)}
+
+    with FakeIMAPServer(messages) as server, tempfile.TemporaryDirectory() as tmp_dir:
+        host, port = server.server_address
+        account = {"imap_host": host, "imap_port": port, "email_user": "bench", "email_pwd": "bench"}
+        for dedup in (False, True):
+            mail.MAIL_FETCH_CONFIG["dedup"] = dedup
+            db = TicketDB(os.path.join(tmp_dir, f"dedup-{dedup}.db"))
+            for run in ("首次", "再次"):
+                start = time.perf_counter()
+                stats = mail.sync_account(account, db)
+                elapsed = time.perf_counter() - start
+                db.cursor.execute("SELECT COUNT(*), MAX(updated_at) FROM tickets")
+                count, updated_at = db.cursor.fetchone()
+                print(f"dedup={str(dedup):<5} {run} 解析 {stats['total_processed']} 跳过 {stats['skipped_unchanged']} "
+                      f"车票 {count} 最后更新 {updated_at} {elapsed:.2f}s")
+            db.close()
+
+def bench_etag(args):
+    """
+    对比车票接口重新查询序列化、命中响应缓存和 304 Not Modified 三种情况的耗时和传输量
+    """
+    import config
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config.DATABASE_CONFIG["db_path"] = os.path.join(tmp_dir, "etag.db")
+        config.LOGGING_CONFIG["file"] = os.path.join(tmp_dir, "etag.log")
+        from fastapi.testclient import TestClient
+        import main as app_main
+        from ticket.models import TicketDB
+
+        def clear_caches():
+            app_main.response_cache.invalidate()
+
+        TicketDB().bulk_upsert_tickets(make_ticket_rows(args.rows))
+        with TestClient(app_main.app) as client:
+            for path in ("/tickets", "/tickets?limit=500", "/tickets/stats"):
+                etag = client.get(path).headers["etag"]
+                cases = (
+                    ("重新查询", {}, clear_caches),
+                    ("缓存命中", {}, None),
+                    ("304", {"If-None-Match": etag}, None),
+                )
+                for name, headers, before in cases:
+                    elapsed = 0
+                    for _ in range(args.repeat):
+                        if before:
+                            before()
+                        start = time.perf_counter()
+                        response = client.get(path, headers=headers)
+                        elapsed += time.perf_counter() - start
+                    print(f"{path:<20} {name:<6} {response.status_code} {len(response.content):>9} 字节 "
+                          f"平均 {elapsed / args.repeat * 1000:.2f}ms")
+
+def bench_serialize(args):
+    """
+    对比 jsonable_encoder + json、标准库 json 和 orjson 序列化全部车票的耗时，并测量 /tickets 缓存未命中时的延迟
+    """
+    import json
+    import config
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config.LOGGING_CONFIG["file"] = os.path.join(tmp_dir, "serialize.log")
+        from fastapi.encoders import jsonable_encoder
+        from fastapi.responses import JSONResponse
+        from fastapi.testclient import TestClient
+        import main as app_main
+        from ticket.models import TicketDB
+
+        if app_main.orjson is None:
+            print("未安装 orjson，只测量标准库 json")
+        for count in (int(count) for count in args.rows.split(",")):
+            db_path = os.path.join(tmp_dir, f"serialize-{count}.db")
+            config.DATABASE_CONFIG["db_path"] = db_path
+            db = TicketDB(db_path)
+            db.bulk_upsert_tickets(make_ticket_rows(count))
+
+            start = time.perf_counter()
+            tickets, next_cursor = db.query_tickets()
+            query_elapsed = time.perf_counter() - start
+            payload = {"total": len(tickets), "tickets": tickets, "next_cursor": next_cursor}
+            print(f"{count} 行 query_tickets {query_elapsed * 1000:.1f}ms")
+
+            encoders = [
+                ("jsonable_encoder+json", lambda: JSONResponse(jsonable_encoder(payload)).body),
+                ("json", lambda: json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None,
+                                            separators=(",", ":")).encode("utf-8")),
+            ]
+            if app_main.orjson is not None:
+                encoders.append(("orjson", lambda: app_main.orjson.dumps(payload)))
+            for name, encode in encoders:
+                start = time.perf_counter()
+                body = encode()
+                elapsed = time.perf_counter() - start
+                print(f"{count} 行 {name:<22} {elapsed * 1000:8.1f}ms {len(body)} 字节")
+
+            with TestClient(app_main.app) as client:
+                elapsed = 0
+                for _ in range(args.repeat):
+                    app_main.response_cache.invalidate()
+                    start = time.perf_counter()
+                    response = client.get("/tickets")
+                    elapsed += time.perf_counter() - start
+                print(f"{count} 行 GET /tickets（缓存未命中） 平均 {elapsed / args.repeat * 1000:.1f}ms "
+                      f"{len(response.content)} 字节")
+            db.close()
+
+def asgi_get(app, path, query=""):
+    """
+    直接调用 ASGI 应用发送 GET 请求，响应体只统计长度不保存，用于测量接口本身的内存占用
+    :return: dict 包含 status 和 bytes
+    """
+    import asyncio
+
+    async def run():
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": [], "client": ("127.0.0.1", 12306), "server": ("benchmark", 80),
+        }
+        result = {"status": None, "bytes": 0}
+        finished = asyncio.Event()
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                result["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                result["bytes"] += len(message.get("body", b""))
+
+        await app(scope, receive, send)
+        finished.set()
+        return result
+
+    return asyncio.run(run())
+
+def bench_export(args):
+    """
+    对比 /tickets 一次性返回全部车票与 /tickets/export 流式导出的耗时和内存峰值
+    """
+    import tracemalloc
+    import config
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config.DATABASE_CONFIG["db_path"] = os.path.join(tmp_dir, "export.db")
+        config.LOGGING_CONFIG["file"] = os.path.join(tmp_dir, "export.log")
+        import main as app_main
+        from ticket.models import TicketDB
+
+        TicketDB().bulk_upsert_tickets(make_ticket_rows(args.rows))
+        cases = (
+            ("/tickets", "", "GET /tickets"),
+            ("/tickets/export", "format=ndjson", "export ndjson"),
+            ("/tickets/export", "format=csv", "export csv"),
+        )
+        for path, query, name in cases:
+            app_main.response_cache.invalidate()
+            start = time.perf_counter()
+            result = asgi_get(app_main.app, path, query)
+            elapsed = time.perf_counter() - start
+
+            app_main.response_cache.invalidate()
+            tracemalloc.start()
+            asgi_get(app_main.app, path, query)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name:<14} {result['status']} {result['bytes'] / 1024 / 1024:7.1f}MB "
+                  f"耗时 {elapsed:.2f}s 内存峰值 {peak / 1024 / 1024:.1f}MB")
+
+def bench_columnar(args):
+    """
+    测量按月分区导出 Parquet/Arrow/CSV 的耗时和文件大小，并与解析 /tickets JSON 对比读取全部车票的耗时
+    """
+    import json
+    from ticket import export
+    from ticket.models import TicketDB
+
+    def directory_size(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = TicketDB(os.path.join(tmp_dir, "columnar.db"))
+        rows = make_ticket_rows(args.rows)
+        # 把出发时间均匀分布到 args.months 个月中，每个分区的车票数量接近实际使用
+        step = timedelta(days=30.4 * args.months) / len(rows)
+        for index, row in enumerate(rows):
+            row["departure_time"] = datetime(2020, 1, 1, 8, 0) + step * index
+        db.bulk_upsert_tickets(rows)
+        del rows
+
+        tickets, _ = db.query_tickets()
+        body = json.dumps({"tickets": tickets}, ensure_ascii=False).encode("utf-8")
+        del tickets
+        start = time.perf_counter()
+        rows = len(json.loads(body)["tickets"])
+        print(f"json     {len(body) / 1024 / 1024:7.1f}MB 读取 {rows} 行 {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        formats = ["csv"] if export.pa is None else ["parquet", "arrow", "csv"]
+        for export_format in formats:
+            output_dir = os.path.join(tmp_dir, export_format)
+            result = export.export_columnar(output_dir, export_format, db)
+            line = (f"{export_format:<8} {directory_size(output_dir) / 1024 / 1024:7.1f}MB "
+                    f"导出 {result['rows']} 行 {result['partitions']} 个分区 {result['elapsed']:.2f}s")
+            if export_format != "csv":
+                import pyarrow.dataset as ds
+                start = time.perf_counter()
+                table = ds.dataset(output_dir, format="parquet" if export_format == "parquet" else "ipc",
+                                   partitioning="hive").to_table()
+                line += f" 读取 {table.num_rows} 行 {(time.perf_counter() - start) * 1000:.1f}ms"
+            print(line)
+        db.close()
+
+def serve_app(db_path, log_path, imap_host, imap_port, port, max_emails):
+    """
+    在子进程中启动 API 服务，邮箱指向 FakeIMAPServer，只响应手动触发的同步
+    """
+    import config
+
+    config.DATABASE_CONFIG["db_path"] = db_path
+    config.LOGGING_CONFIG["file"] = log_path
+    config.EMAIL_CONFIG.update({"imap_host": imap_host, "imap_port": imap_port,
+                                "email_user": "bench", "email_pwd": "bench"})
+    config.MAIL_CONFIG["auto_refresh_interval"] = 0
+    config.MAIL_FETCH_CONFIG.update({"days_back": None, "incremental": False, "max_emails": max_emails,
+                                     "header_prefilter": False})
+    import uvicorn
+    import main as app_main
+
+    logging.disable(logging.INFO)
+    uvicorn.run(app_main.app, host="127.0.0.1", port=port, log_level="warning")
+
+def http_get(conn, path):
+    """
+    发送 GET 请求并读完响应
+    :return: tuple (状态码, 响应内容)
+    """
+    conn.request("GET", path)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def bench_load(args):
+    """
+    测量空闲和邮件同步进行中两种情况下 /health 和 /tickets/stats 的延迟分布，
+    同时有若干客户端持续请求完整的 /tickets 列表
+    """
+    import json
+    import socket
+    from ticket.models import TicketDB
+
+    messages = {uid: make_ticket_email(uid) for uid in range(1, args.messages + 1)}
+    with FakeIMAPServer(messages, latency=args.latency) as server, tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "load.db")
+        db = TicketDB(db_path)
+        db.bulk_upsert_tickets(make_ticket_rows(args.rows))
+        db.close()
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        imap_host, imap_port = server.server_address
+        process = multiprocessing.get_context("spawn").Process(
+            target=serve_app, args=(db_path, os.path.join(tmp_dir, "load.log"), imap_host, imap_port, port, args.messages),
+            daemon=True
+        )
+        process.start()
+        try:
+            deadline = time.time() + 30
+            while True:
+                try:
+                    if http_get(http.client.HTTPConnection("127.0.0.1", port), "/health")[0] == 200:
+                        break
+                except OSError:
+                    pass
+                if time.time() > deadline:
+                    raise RuntimeError("API 服务启动超时")
+                time.sleep(0.1)
+
+            def run_phase(name, until):
+                stop = threading.Event()
+                latencies = {"/health": [], "/tickets/stats": []}
+                list_count = [0]
+
+                def poll_tickets():
+                    conn = http.client.HTTPConnection("127.0.0.1", port)
+                    while not stop.is_set():
+                        http_get(conn, "/tickets")
+                        list_count[0] += 1
+
+                def probe():
+                    conn = http.client.HTTPConnection("127.0.0.1", port)
+                    while not stop.is_set():
+                        for path, values in latencies.items():
+                            start = time.perf_counter()
+                            http_get(conn, path)
+                            values.append(time.perf_counter() - start)
+                        time.sleep(args.interval)
+
+                threads = [threading.Thread(target=poll_tickets, daemon=True) for _ in range(args.clients)]
+                threads.append(threading.Thread(target=probe, daemon=True))
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                until()
+                stop.set()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                for path, values in latencies.items():
+                    print(f"{name} {path:<15} 请求 {len(values):>5} p50 {percentile(values, 0.5) * 1000:7.1f}ms "
+                          f"p99 {percentile(values, 0.99) * 1000:7.1f}ms max {max(values) * 1000:7.1f}ms")
+                print(f"{name} /tickets 完整列表 {list_count[0] / elapsed:.1f} 次/秒，持续 {elapsed:.1f}s")
+
+            def wait_for_sync():
+                conn = http.client.HTTPConnection("127.0.0.1", port)
+                job_id = json.loads(http_get(conn, "/update_ticket")[1])["job_id"]
+                while True:
+                    job = json.loads(http_get(conn, f"/update_ticket/{job_id}")[1])
+                    if job["status"] in ("success", "failed"):
+                        break
+                    time.sleep(0.2)
+                stats = ((job.get("result") or [{}])[0]).get("stats") or {}
+                print(f"同步任务 {job['status']} - 邮件 {stats.get('total_processed')} 新增车票 {stats.get('tickets_added')}")
+
+            run_phase("空闲  ", lambda: time.sleep(args.duration))
+            run_phase("同步中", wait_for_sync)
+        finally:
+            process.terminate()
+            process.join()
+
+def bench_cache(args):
+    """
+    对比 TicketDB 读取方法关闭和开启查询缓存时的耗时
+    """
+    from ticket import models
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = models.TicketDB(os.path.join(tmp_dir, "cache.db"))
+        rows = make_ticket_rows(args.rows)
+        db.bulk_upsert_tickets(rows)
+        days = sorted(row["departure_time"].strftime("%Y-%m-%d") for row in rows)
+        queries = (
+            ("get_all_tickets", db.get_all_tickets),
+            ("get_tickets_by_date_range", lambda: db.get_tickets_by_date_range(days[0], days[len(days) // 10])),
+            ("query_tickets(limit=50)", lambda: db.query_tickets(limit=50)),
+            ("get_statistics", db.get_statistics),
+        )
+        max_size = models.query_cache.max_size
+        for name, query in queries:
+            timings = []
+            for size in (0, max_size):
+                models.query_cache.max_size = size
+                query()
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    query()
+                timings.append((time.perf_counter() - start) / args.repeat * 1000)
+            print(f"{name:<28} 不缓存 {timings[0]:8.3f}ms 缓存命中 {timings[1]:8.3f}ms")
+
+        # 写入后缓存失效，下一次读取重新查询
+        db.refund_ticket(rows[0]["order_id"], 5.0)
+        start = time.perf_counter()
+        db.get_all_tickets()
+        print(f"写入后首次读取 get_all_tickets {(time.perf_counter() - start) * 1000:.3f}ms")
+        print(models.query_cache.stats())
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="12306 车票信息管理系统性能基准")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = subparsers.add_parser("fetch", help="IMAP 逐封/批量 FETCH 吞吐量")
+    fetch_parser.add_argument("--messages", type=int, default=2000, help="模拟邮件数量")
+    fetch_parser.add_argument("--batch-size", type=int, default=200, help="批量 FETCH 的批次大小")
+    fetch_parser.add_argument("--latency", type=float, default=0.002, help="每条命令模拟的往返延迟（秒）")
+    fetch_parser.set_defaults(func=bench_fetch)
+
+    prefilter_parser = subparsers.add_parser("prefilter", help="邮件头预筛选的传输量和耗时")
+    prefilter_parser.add_argument("--messages", type=int, default=2000, help="模拟邮件数量")
+    prefilter_parser.add_argument("--ticket-every", type=int, default=10, help="每隔多少封邮件出现一封车票通知")
+    prefilter_parser.add_argument("--padding", type=int, default=20000, help="非车票邮件正文的附加长度")
+    prefilter_parser.add_argument("--batch-size", type=int, default=200, help="批量 FETCH 的批次大小")
+    prefilter_parser.add_argument("--latency", type=float, default=0.002, help="每条命令模拟的往返延迟（秒）")
+    prefilter_parser.set_defaults(func=bench_prefilter)
+
+    upsert_parser = subparsers.add_parser("upsert", help="逐条写入与批量写入的速度")
+    upsert_parser.add_argument("--rows", type=int, default=5000, help="写入的车票记录数量")
+    upsert_parser.add_argument("--batch-size", type=int, default=500, help="每个事务写入的记录数")
+    upsert_parser.set_defaults(func=bench_upsert)
+
+    range_parser = subparsers.add_parser("range", help="日期范围查询的耗时")
+    range_parser.add_argument("--rows", type=int, default=50000, help="车票记录数量")
+    range_parser.add_argument("--repeat", type=int, default=100, help="查询重复次数")
+    range_parser.set_defaults(func=bench_range)
+
+    parser_parser = subparsers.add_parser("parser", help="车票解析器每秒解析次数")
+    parser_parser.add_argument("--corpus", type=int, default=2000, help="语料数量")
+    parser_parser.add_argument("--repeat", type=int, default=5, help="测速时语料重复次数")
+    parser_parser.set_defaults(func=bench_parser)
+
+    clean_parser = subparsers.add_parser("clean", help="邮件正文清理在不同长度下的耗时")
+    clean_parser.add_argument("--sizes", default="2000,8000,32000,128000,1024000", help="逗号分隔的正文长度（字符）")
+    clean_parser.add_argument("--legacy-max", type=int, default=32000, help="原始实现只测到该长度，更长时耗时过久")
+    clean_parser.add_argument("--repeat", type=int, default=200, help="每千字符的重复次数")
+    clean_parser.set_defaults(func=bench_clean)
+
+    decode_parser = subparsers.add_parser("decode", help="邮件正文解码耗时")
+    decode_parser.add_argument("--messages", type=int, default=500, help="模拟邮件数量，一半为 GBK 编码")
+    decode_parser.add_argument("--padding", type=int, default=2000, help="正文的附加长度")
+    decode_parser.set_defaults(func=bench_decode)
+
+    html_parser = subparsers.add_parser("html", help="HTML正文文本提取的耗时")
+    html_parser.add_argument("--messages", type=int, default=500, help="模拟邮件数量")
+    html_parser.add_argument("--padding", type=int, default=2000, help="正文的附加长度")
+    html_parser.set_defaults(func=bench_html)
+
+    backfill_parser = subparsers.add_parser("backfill", help="串行处理与多进程流水线回填的吞吐量")
+    backfill_parser.add_argument("--messages", type=int, default=20000, help="模拟邮件数量")
+    backfill_parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="逗号分隔的解析进程数")
+    backfill_parser.add_argument("--batch-size", type=int, default=200, help="每批邮件数量")
+    backfill_parser.set_defaults(func=bench_backfill)
+
+    stream_parser = subparsers.add_parser("stream", help="先读取全部邮件与边读取边处理的内存峰值")
+    stream_parser.add_argument("--messages", type=int, default=5000, help="模拟邮件数量")
+    stream_parser.add_argument("--padding", type=int, default=5000, help="正文的附加长度")
+    stream_parser.add_argument("--batch-size", type=int, default=200, help="每批邮件数量")
+    stream_parser.set_defaults(func=bench_stream)
+
+    import_parser = subparsers.add_parser("import", help="mbox/Maildir/.eml 离线导入的吞吐量")
+    import_parser.add_argument("--messages", type=int, default=20000, help="模拟邮件数量")
+    import_parser.add_argument("--ticket-every", type=int, default=10, help="每隔多少封邮件出现一封车票通知")
+    import_parser.add_argument("--padding", type=int, default=2000, help="非车票邮件正文的附加长度")
+    import_parser.set_defaults(func=bench_import)
+
+    dedup_parser = subparsers.add_parser("dedup", help="重复同步时跳过已处理邮件的效果")
+    dedup_parser.add_argument("--messages", type=int, default=5000, help="模拟邮件数量")
+    dedup_parser.add_argument("--padding", type=int, default=2000, help="正文的附加长度")
+    dedup_parser.set_defaults(func=bench_dedup)
+
+    etag_parser = subparsers.add_parser("etag", help="车票接口的 ETag/304 和响应缓存效果")
+    etag_parser.add_argument("--rows", type=int, default=10000, help="车票记录数量")
+    etag_parser.add_argument("--repeat", type=int, default=20, help="每种情况的请求次数")
+    etag_parser.set_defaults(func=bench_etag)
+
+    serialize_parser = subparsers.add_parser("serialize", help="车票接口 JSON 序列化的耗时")
+    serialize_parser.add_argument("--rows", default="10000,100000", help="逗号分隔的车票记录数量")
+    serialize_parser.add_argument("--repeat", type=int, default=3, help="接口请求次数")
+    serialize_parser.set_defaults(func=bench_serialize)
+
+    export_parser = subparsers.add_parser("export", help="一次性返回与流式导出的耗时和内存峰值")
+    export_parser.add_argument("--rows", type=int, default=100000, help="车票记录数量")
+    export_parser.set_defaults(func=bench_export)
+
+    columnar_parser = subparsers.add_parser("columnar", help="按月分区的列式导出和读取耗时")
+    columnar_parser.add_argument("--rows", type=int, default=100000, help="车票记录数量")
+    columnar_parser.add_argument("--months", type=int, default=36, help="车票出发时间分布的月份数")
+    columnar_parser.set_defaults(func=bench_columnar)
+
+    load_parser = subparsers.add_parser("load", help="邮件同步进行中 /health 和 /tickets/stats 的延迟分布")
+    load_parser.add_argument("--rows", type=int, default=10000, help="预先写入的车票记录数量")
+    load_parser.add_argument("--messages", type=int, default=20000, help="同步的邮件数量")
+    load_parser.add_argument("--latency", type=float, default=0.0, help="IMAP 每条命令的模拟延迟（秒）")
+    load_parser.add_argument("--clients", type=int, default=2, help="持续请求 /tickets 的客户端数量")
+    load_parser.add_argument("--interval", type=float, default=0.02, help="探测请求之间的间隔（秒）")
+    load_parser.add_argument("--duration", type=float, default=10, help="空闲阶段的持续时间（秒）")
+    load_parser.set_defaults(func=bench_load)
+
+    cache_parser = subparsers.add_parser("cache", help="查询缓存命中与直接查询数据库的耗时")
+    cache_parser.add_argument("--rows", type=int, default=10000, help="车票记录数量")
+    cache_parser.add_argument("--repeat", type=int, default=20, help="每种查询的重复次数")
+    cache_parser.set_defaults(func=bench_cache)
+
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import pytest
+import config
+
+# 测试不读写仓库中的数据库和日志文件
+_tmp_dir = tempfile.mkdtemp(prefix="ticket-tests-")
+config.DATABASE_CONFIG["db_path"] = os.path.join(_tmp_dir, "tickets.db")
+config.LOGGING_CONFIG["file"] = os.path.join(_tmp_dir, "ticket_manager.log")
+
+@pytest.fixture
+def db(tmp_path):
+    from ticket.models import TicketDB
+
+    db = TicketDB(str(tmp_path / "tickets.db"))
+    yield db
+    db.close()
+
+@pytest.fixture
+def mail_config(monkeypatch):
+    """
+    全量读取模拟邮箱中的邮件，每批10封
+    """
+    for key, value in {"days_back": None, "incremental": True, "header_prefilter": False,
+                       "max_emails": None, "batch_size": 10, "dedup": True}.items():
+        monkeypatch.setitem(config.MAIL_FETCH_CONFIG, key, value)
+    return config.MAIL_FETCH_CONFIG
+
+@pytest.fixture
+def config_db(tmp_path, monkeypatch):
+    """
+    不传入数据库路径的 TicketDB（如接口和调度器）使用本测试独立的数据库
+    """
+    db_path = str(tmp_path / "config-tickets.db")
+    monkeypatch.setitem(config.DATABASE_CONFIG, "db_path", db_path)
+    return db_path
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+测试和性能基准共用的模拟数据：12306通知邮件、车票记录、最小IMAP服务器，
+以及解析器对照用的原始实现和语料
+"""
+
+import re
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+from email.header import Header
+from email.mime.text import MIMEText
+
+SUBJECTS = [
+    "网上购票系统-用户支付通知",
+    "网上购票系统-候补订单兑现成功通知",
+    "网上购票系统-用户退票通知",
+]
+
+def make_ticket_email(index, subject=None, padding=0, charset="utf-8"):
+    """
+    生成一封模拟的12306通知邮件
+    :param index: 邮件序号，用于生成订单号
+    :param subject: 邮件主题，默认为支付通知
+    :param padding: 追加到正文末尾的无关内容长度，用于模拟较大的邮件
+    :param charset: 正文编码
+    :return: bytes 原始邮件内容
+    """
+    subject = subject or SUBJECTS[0]
+    html = (
+        "<html><body><p>尊敬的 温阳光 女士/先生：</p>"
+        f"<p>您好！您于2024年01月10日在中国铁路客户服务中心网站(12306.cn)成功购买了1张车票，"
+        f"订单号码E{index:09d}，车票信息如下：</p>"
+        "<p>1.温阳光，2024年01月15日08:30开，北京南―上海虹桥，G1次列车，08车12A号，二等座，成人票，"
+        "票价553.5元，检票口A12。</p>"
+        "<p>温馨提示：请携带购票时所使用的有效身份证件原件到车站乘车。</p>"
+        f"<p>{'铁路畅行会员积分活动说明。' * (padding // 13)}</p>"
+        "</body></html>"
+    )
+    msg = MIMEText(html, "html", charset)
+    msg["Subject"] = Header(subject, "utf-8")
+    msg["From"] = "12306@rails.com.cn"
+    msg["Date"] = "Wed, 10 Jan 2024 10:00:00 +0800"
+    msg["Message-ID"] = f"<{index}@rails.com.cn>"
+    return msg.as_bytes()
+
+def make_ticket_rows(count):
+    """
+    生成模拟的车票记录
+    :param count: 记录数量
+    :return: list 车票信息字典列表
+    """
+    start = datetime(2020, 1, 1, 8, 0)
+    trains = ["G1次列车", "G7次列车", "D301次列车", "K528次列车", "Z19次列车"]
+    seat_types = ["二等座", "一等座", "硬卧", "软卧", "无座"]
+    routes = [("北京南", "上海虹桥"), ("上海虹桥", "杭州东"), ("广州南", "深圳北"), ("成都东", "重庆北")]
+    rows = []
+    for index in range(count):
+        departure_station, arrival_station = routes[index % len(routes)]
+        rows.append({
+            "order_id": f"E{index:09d}",
+            "passenger_name": "温阳光" if index % 3 else "张三",
+            "departure_time": start + timedelta(hours=7 * index),
+            "departure_station": departure_station,
+            "arrival_station": arrival_station,
+            "train_number": trains[index % len(trains)],
+            "carriage_number": f"{index % 16 + 1:02d}车",
+            "seat_number": f"{index % 20 + 1}A号",
+            "seat_type": seat_types[index % len(seat_types)],
+            "price": float(100 + index % 500),
+            "is_waiting": index % 7 == 0,
+        })
+    return rows
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+    """
+    只实现 MailReader 用到的命令的最小IMAP服务器
+    """
+    disable_nagle_algorithm = True
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+
+    def handle(self):
+        server = self.server
+        self.send("* OK [CAPABILITY IMAP4rev1] Fake IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode().rstrip("\r\n").split(" ", 2)
+            tag, command = parts[0], parts[1].upper()
+            args = parts[2] if len(parts) > 2 else ""
+            if server.latency:
+                time.sleep(server.latency)
+
+            if command == "CAPABILITY":
+                self.send("* CAPABILITY IMAP4rev1\r\n")
+            elif command == "ID":
+                self.send("* ID NIL\r\n")
+            elif command == "SELECT":
+                self.send(f"* {len(server.messages)} EXISTS\r\n")
+                self.send(f"* OK [UIDVALIDITY {server.uidvalidity}] UIDs valid\r\n")
+            elif command == "UID":
+                sub_command, _, sub_args = args.partition(" ")
+                if sub_command.upper() == "SEARCH":
+                    self.uid_search(sub_args)
+                elif sub_command.upper() == "FETCH":
+                    if server.fail_uids & parse_message_set(sub_args.partition(" ")[0]):
+                        self.send(f"{tag} NO UID FETCH failed\r\n")
+                        continue
+                    self.uid_fetch(sub_args)
+            elif command == "LOGOUT":
+                self.send("* BYE\r\n")
+                self.send(f"{tag} OK LOGOUT completed\r\n")
+                return
+            self.send(f"{tag} OK {command} completed\r\n")
+
+    def uid_search(self, criteria):
+        uids = sorted(self.server.messages)
+        match = re.search(r"UID (\d+):\*", criteria)
+        if match:
+            low = int(match.group(1))
+            uids = [uid for uid in uids if uid >= low] or uids[-1:]
+        self.send("* SEARCH " + " ".join(str(uid) for uid in uids) + "\r\n")
+
+    def uid_fetch(self, args):
+        message_set, _, items = args.partition(" ")
+        header_fields = re.search(r"BODY\.PEEK\[HEADER\.FIELDS \(([^)]*)\)\]", items)
+        for seq, uid in enumerate(sorted(parse_message_set(message_set)), start=1):
+            raw = self.server.messages.get(uid)
+            if raw is None:
+                continue
+            if header_fields:
+                item = f"BODY[HEADER.FIELDS ({header_fields.group(1)})]"
+                data = extract_header_fields(raw, header_fields.group(1).split())
+            else:
+                item, data = "RFC822", raw
+            self.server.bytes_sent += len(data)
+            self.send(f"* {seq} FETCH (UID {uid} {item} {{{len(data)}}}\r\n".encode() + data + b")\r\n")
+
+def extract_header_fields(raw, fields):
+    header_block = raw.split(b"\n\n", 1)[0]
+    wanted = tuple(field.lower().encode() + b":" for field in fields)
+    lines, keep = [], False
+    for line in header_block.split(b"\n"):
+        if line[:1] in (b" ", b"\t"):
+            if keep:
+                lines.append(line)
+            continue
+        keep = line.lower().startswith(wanted)
+        if keep:
+            lines.append(line)
+    return b"\r\n".join(line.rstrip(b"\r") for line in lines) + b"\r\n\r\n"
+
+def parse_message_set(message_set):
+    uids = set()
+    for item in message_set.split(","):
+        low, _, high = item.partition(":")
+        uids.update(range(int(low), int(high or low) + 1))
+    return uids
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages, latency=0.0, uidvalidity=1, fail_uids=()):
+        """
+        :param messages: dict UID -> 原始邮件字节
+        :param latency: 每条命令模拟的网络往返延迟（秒）
+        :param uidvalidity: 文件夹的UIDVALIDITY
+        :param fail_uids: 包含这些UID的 UID FETCH 请求返回 NO
+        """
+        super().__init__(("127.0.0.1", 0), FakeIMAPHandler)
+        self.messages = messages
+        self.latency = latency
+        self.uidvalidity = uidvalidity
+        self.fail_uids = set(fail_uids)
+        self.bytes_sent = 0
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+QUERY_PLAN_CHECKS = [
+    ("日期范围查询",
+     "SELECT * FROM tickets WHERE departure_time >= ? AND departure_time < ? ORDER BY departure_time DESC",
+     ("2021-01-01", "2021-02-01"), "idx_tickets_departure_time"),
+    ("分页游标查询",
+     "SELECT * FROM tickets WHERE departure_time <= ? "
+     "AND (departure_time, order_id, passenger_name, seat_number) < (?, ?, ?, ?) "
+     "ORDER BY departure_time DESC, order_id DESC, passenger_name DESC, seat_number DESC LIMIT 101",
+     ("2021-01-01", "2021-01-01", "E000000100", "张三", "12A号"), "idx_tickets_departure_time"),
+    ("全部车票排序",
+     "SELECT * FROM tickets ORDER BY departure_time DESC",
+     (), "idx_tickets_departure_time"),
+    ("乘客日期范围查询",
+     "SELECT * FROM tickets WHERE passenger_name = ? AND departure_time >= ? AND departure_time < ?",
+     ("张三", "2021-01-01", "2021-02-01"), "idx_tickets_passenger_departure"),
+    ("退票统计",
+     "SELECT COUNT(*) FROM tickets WHERE is_refunded = 1",
+     (), "idx_tickets_refunded"),
+    ("候补统计",
+     "SELECT COUNT(*) FROM tickets WHERE is_waiting = 1 AND is_refunded = 0",
+     (), "idx_tickets_waiting"),
+]
+
+def legacy_parse_ticket_info(text):
+    """
+    逐字段 re.search 的原始解析实现，作为解析结果的对照基准
+    """
+    patterns = {
+        'order_id': r'订单号码([A-Z0-9]+)',
+        'passenger_name': r'车票信息如下:\d+\.([^,]+)',
+        'departure_time': r'(\d{4}年\d{2}月\d{2}日\d{2}:\d{2})开',
+        'route': r'开,([^-]+)-([^,]+),',
+        'train_number': r'([A-Z0-9]+次列车)',
+        'carriage_number': r'(\d+车)',
+        'seat_number': r'(\d+[A-Z]号|\d+号|无座)',
+        'seat_type': r'(无座|硬座|硬卧|软卧|二等座|一等座|二等卧)',
+        'price': r'票价(\d+\.?\d*)元',
+    }
+    result = {}
+    for field in ('order_id', 'passenger_name'):
+        match = re.search(patterns[field], text)
+        if match:
+            result[field] = match.group(1)
+    match = re.search(patterns['departure_time'], text)
+    if match:
+        result['departure_time'] = datetime.strptime(match.group(1), '%Y年%m月%d日%H:%M')
+    match = re.search(patterns['route'], text)
+    if match:
+        result['departure_station'] = match.group(1)
+        result['arrival_station'] = match.group(2)
+    for field in ('train_number', 'carriage_number'):
+        match = re.search(patterns[field], text)
+        if match:
+            result[field] = match.group(1)
+    for field in ('seat_number', 'seat_type'):
+        match = re.search(patterns[field], text)
+        result[field] = match.group(1) if match else ''
+    match = re.search(patterns['price'], text)
+    result['price'] = float(match.group(1)) if match else 0.0
+    return result
+
+def legacy_parse_refund_info(text):
+    """
+    逐字段 re.search 的原始退票解析实现，作为解析结果的对照基准
+    """
+    result = {}
+    match = re.search(r'订单号码([A-Z0-9]+)', text)
+    if match:
+        result['order_id'] = match.group(1)
+    match = re.search(r'票价(\d+\.?\d*)元', text)
+    result['price'] = float(match.group(1)) if match else 0.0
+    match = re.search(r'应退票款(\d+\.?\d*)元', text)
+    result['refund_amount'] = float(match.group(1)) if match else 0.0
+    result['service_fee'] = result['price'] - result['refund_amount']
+    return result
+
+def legacy_clean_text_content(text):
+    """
+    多次 split/replace 加按姓名截取的原始清理实现，作为清理结果和耗时的对照基准
+    """
+    for keyword in ["温馨提示", "为了确保", "按购票时所使用在线支付工具的有关规定"]:
+        if keyword in text:
+            text = text.split(keyword)[0]
+    if "订单号码" in text:
+        text = "订单号码" + text.split("订单号码")[1]
+    for old, new in {"，": ",", "：": ":", "。": ".", "―": "-"}.items():
+        text = text.replace(old, new)
+    text = text.replace(" ", "")
+    match = re.search(r"(.*温阳光.*?票价[\d\.]+元)", text)
+    if match:
+        text = match.group(0)
+    return text
+
+def make_clean_body(size, passenger="张三"):
+    """
+    生成去掉HTML标签后的邮件正文，车票信息之后追加无关内容直到达到指定长度
+    :param size: 正文长度（字符）
+    :param passenger: 乘客姓名
+    :return: str 正文
+    """
+    head = (f"尊敬的 {passenger} 女士/先生： 您好！您于2024年01月10日在中国铁路客户服务中心网站(12306.cn)"
+            f"成功购买了1张车票，订单号码E000000001，车票信息如下： 1.{passenger}，2024年01月15日08:30开，"
+            "北京南―上海虹桥，G1次列车，08车12A号，二等座，成人票，票价553.5元，检票口A12。 ")
+    tail = " 温馨提示：请携带购票时所使用的有效身份证件原件到车站乘车。"
+    filler = "铁路畅行会员积分活动说明， 详情请登录12306。 "
+    padding = max(0, size - len(head) - len(tail))
+    return head + (filler * (padding // len(filler) + 1))[:padding] + tail
+
+def make_parser_corpus(count, seed=12306):
+    """
+    生成解析器对照语料，覆盖常见格式和缺字段、无座、多乘客等情况
+    :param count: 语料数量
+    :param seed: 随机种子
+    :return: list 已清理的邮件文本
+    """
+    import random
+
+    rng = random.Random(seed)
+    names = ["温阳光", "张三", "李四"]
+    routes = [("北京南", "上海虹桥"), ("广州南", "深圳北"), ("成都东", "重庆北")]
+    seats = [("08车12A号", "二等座"), ("03车05F号", "一等座"), ("12车013号", "硬卧"), ("05车无座", "无座"),
+             ("09车088号", "硬座"), ("", "软卧")]
+    corpus = []
+    for index in range(count):
+        lines = []
+        for number in range(1, rng.choice([1, 1, 1, 2, 3]) + 1):
+            name = rng.choice(names)
+            departure_station, arrival_station = rng.choice(routes)
+            seat, seat_type = rng.choice(seats)
+            train = rng.choice(["G1", "D301", "K528", "1461", "Z19"])
+            price = rng.choice(["553.5", "60", "1024.0", "88.8"])
+            line = (f"{number}.{name},2024年{rng.randint(1, 12):02d}月{rng.randint(1, 28):02d}日"
+                    f"{rng.randint(0, 23):02d}:{rng.choice(['00', '30', '45'])}开,"
+                    f"{departure_station}-{arrival_station},{train}次列车,{seat},{seat_type},成人票")
+            if rng.random() > 0.05:
+                line += f",票价{price}元"
+            if rng.random() < 0.3:
+                line += f",应退票款{float(price) - 5:.1f}元"
+            lines.append(line + ".")
+        prefix = f"订单号码E{index:09d},"
+        if rng.random() < 0.5:
+            prefix += f"{lines[0][2:5]}您好!您于2024年01月10日在中国铁路客户服务中心网站(12306.cn)成功购买了{len(lines)}张车票,"
+        text = prefix + "车票信息如下:" + "".join(lines)
+        if rng.random() < 0.05:
+            text = text.replace("订单号码", "订单")
+        corpus.append(text)
+    corpus.append("")
+    corpus.append("与车票无关的邮件内容,票价不详")
+    return corpus
+
+def make_html_corpus(count, padding):
+    """
+    生成HTML正文对照语料，包含样式、脚本、注释和实体等常见结构
+    :param count: 语料数量
+    :param padding: 正文的附加长度
+    :return: list HTML字符串
+    """
+    import email
+
+    corpus = []
+    for index in range(count):
+        part = email.message_from_bytes(make_ticket_email(index, padding=padding))
+        html = part.get_payload(decode=True).decode("utf-8")
+        if index % 3 == 0:
+            html = html.replace("<body>", "<head><style>p { color: #333; }</style>"
+                                "<script>if (a < b && c > d) { track(); }</script></head><body>")
+        if index % 3 == 1:
+            html = html.replace("</p>", "</p><!-- 12306 -->\n<br/>&nbsp;&amp;&#x4e2d;\t", 2)
+        corpus.append(html)
+    return corpus
+
+def imap_account(server):
+    """
+    指向模拟IMAP服务器的邮箱账号配置
+    """
+    host, port = server.server_address
+    return {"imap_host": host, "imap_port": port, "email_user": "test", "email_pwd": "test"}
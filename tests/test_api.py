@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+import main
+from tests.support import FakeIMAPServer, imap_account, make_ticket_email, make_ticket_rows
+
+def test_render_json_matches_jsonable_encoder(db):
+    db.bulk_upsert_tickets(make_ticket_rows(500))
+    tickets, next_cursor = db.query_tickets()
+    payload = {"total": len(tickets), "tickets": tickets, "next_cursor": next_cursor}
+    expected = JSONResponse(jsonable_encoder(payload)).body
+    assert main.render_json(payload) == expected
+    assert json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8") == expected
+
+def test_app_can_restart():
+    for _ in range(2):
+        with TestClient(main.app) as client:
+            assert client.get("/health").status_code == 200
+
+def test_api_reads_bypass_query_cache():
+    from ticket.models import query_cache
+
+    query_cache.invalidate()
+    with TestClient(main.app) as client:
+        for path in ("/tickets", "/tickets/stats"):
+            assert client.get(path).status_code == 200
+    # 接口响应只缓存在 response_cache 中
+    assert query_cache.stats()["size"] == 0
+    assert main.response_cache.stats()["size"] >= 2
+
+def test_sync_jobs_run_after_app_restart(monkeypatch, mail_config, config_db):
+    from tools import async_mail
+
+    messages = {uid: make_ticket_email(uid) for uid in range(1, 6)}
+    with FakeIMAPServer(messages) as server:
+        monkeypatch.setattr(async_mail, "EMAIL_ACCOUNTS", [imap_account(server)])
+        for _ in range(2):
+            with TestClient(main.app) as client:
+                job_id = client.get("/update_ticket").json()["job_id"]
+                deadline = time.monotonic() + 30
+                job = client.get(f"/update_ticket/{job_id}").json()
+                while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    job = client.get(f"/update_ticket/{job_id}").json()
+                assert job["status"] == "success", job
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import threading
+from tools import backfill
+from tools.backfill import BackfillPipeline
+from tests.support import FakeIMAPServer, imap_account, make_ticket_email
+
+def test_failed_fetch_batch_keeps_sync_position(db, mail_config):
+    messages = {uid: make_ticket_email(uid) for uid in range(1, 31)}
+    with FakeIMAPServer(messages, fail_uids={15}) as server:
+        stats = BackfillPipeline(imap_account(server), workers=1, db_name=db.db_path).run()
+    assert stats["tickets_added"] == 20
+    assert stats["errors"] == 10
+    # 同步位置停在获取失败的批次之前
+    assert db.get_sync_state("test", "12306")["last_uid"] == 10
+
+def test_writer_failure_stops_pipeline(db, mail_config, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(backfill, "write_ticket_records", fail)
+    messages = {uid: make_ticket_email(uid) for uid in range(1, 101)}
+    pipeline = BackfillPipeline(workers=1, batch_size=1, queue_size=1, db_name=db.db_path)
+    with FakeIMAPServer(messages) as server:
+        pipeline.account = imap_account(server)
+        # 写入线程失败后读取线程不再阻塞在已满的队列上
+        runner = threading.Thread(target=pipeline.run, daemon=True)
+        runner.start()
+        runner.join(timeout=60)
+    assert not runner.is_alive()
+    assert isinstance(pipeline.writer_error, RuntimeError)
+    assert db.get_sync_state("test", "12306") is None
+
+def test_failed_ticket_writes_keep_sync_position(db, mail_config, monkeypatch):
+    from ticket import models
+    monkeypatch.setattr(models, "UPSERT_TICKET_SQL", "INSERT INTO missing_table VALUES (?)")
+    messages = {uid: make_ticket_email(uid) for uid in range(1, 31)}
+    pipeline = BackfillPipeline(workers=1, db_name=db.db_path)
+    with FakeIMAPServer(messages) as server:
+        pipeline.account = imap_account(server)
+        stats = pipeline.run()
+    assert stats["write_failures"] == 30
+    assert isinstance(pipeline.writer_error, RuntimeError)
+    assert db.get_sync_state("test", "12306") is None
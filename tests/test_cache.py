@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from ticket.cache import QueryCache, MISSING
+
+def test_weight_bound_evicts_least_recently_used():
+    cache = QueryCache(max_size=10, max_weight=5, weigh=len)
+    cache.set("a", 1, [1, 2])
+    cache.set("b", 1, [1, 2])
+    cache.get("a", 1)
+    cache.set("c", 1, [1, 2])
+    assert cache.get("b", 1, MISSING) is MISSING
+    assert cache.get("a", 1) == [1, 2]
+    assert cache.weight == 4
+
+    # 重复写入同一个键时不重复计算权重
+    cache.set("a", 2, [1])
+    assert cache.weight == 3
+
+def test_oversized_result_is_not_cached():
+    cache = QueryCache(max_size=10, max_weight=5, weigh=len)
+    cache.set("a", 1, [1])
+    cache.set("big", 1, list(range(6)))
+    assert cache.get("big", 1, MISSING) is MISSING
+    assert cache.get("a", 1) == [1]
+    assert cache.stats()["oversized"] == 1
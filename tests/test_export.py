@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import os
+from ticket.export import export_columnar
+from tests.support import make_ticket_rows
+
+def test_export_replaces_stale_partitions(db, tmp_path):
+    db.bulk_upsert_tickets(make_ticket_rows(300))
+    output_dir = str(tmp_path / "exports")
+    os.makedirs(output_dir)
+    # 输出目录中原有的其他文件不受导出影响
+    with open(os.path.join(output_dir, "notes.txt"), "w") as f:
+        f.write("keep")
+
+    result = export_columnar(output_dir, "csv", db)
+    assert sorted(os.listdir(output_dir)) == ["month=2020-01", "month=2020-02", "month=2020-03", "notes.txt"]
+    assert result["rows"] == 300
+
+    # 缩小日期范围重新导出，上次导出的其他月份分区不会残留，临时目录已清理
+    result = export_columnar(output_dir, "csv", db, end_date="2020-01-31")
+    assert sorted(os.listdir(output_dir)) == ["month=2020-01", "notes.txt"]
+    assert result["files"] == [os.path.join(output_dir, "month=2020-01", "part-0.csv")]
+    with open(result["files"][0], encoding="utf-8") as f:
+        assert len(f.readlines()) > 1
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import email
+from collections import Counter
+import pytest
+from tools.mail import (
+    decode_payload, process_ticket_emails, remove_html_tags_and_whitespace, sync_account, sync_high_water_mark
+)
+from tests.support import FakeIMAPServer, imap_account, make_html_corpus, make_ticket_email
+
+def test_builtin_html_extractor_matches_bs4():
+    pytest.importorskip("bs4")
+    for html in make_html_corpus(200, padding=200):
+        assert remove_html_tags_and_whitespace(html, "builtin") == remove_html_tags_and_whitespace(html, "bs4")
+
+@pytest.mark.parametrize("charset", ["utf-8", "gbk"])
+def test_decode_payload_uses_declared_charset(charset):
+    part = email.message_from_bytes(make_ticket_email(1, padding=500, charset=charset))
+    payload = part.get_payload(decode=True)
+    stats = Counter()
+    text = decode_payload(payload, part.get_content_charset(), stats)
+    assert text == payload.decode(charset)
+    assert "订单号码E000000001" in text
+    assert stats == {"charset": 1}
+
+def count_tickets(db):
+    db.cursor.execute("SELECT COUNT(*) FROM tickets")
+    return db.cursor.fetchone()[0]
+
+def test_failed_fetch_batch_does_not_advance_sync_state(db, mail_config):
+    messages = {uid: make_ticket_email(uid) for uid in range(1, 31)}
+    with FakeIMAPServer(messages, fail_uids={15}) as server:
+        stats = sync_account(imap_account(server), db)
+        assert count_tickets(db) == 20
+        assert stats['errors'] == 10
+        # 同步位置停在失败批次之前
+        assert db.get_sync_state("test", "12306")['last_uid'] == 10
+
+        server.fail_uids.clear()
+        stats = sync_account(imap_account(server), db)
+        assert count_tickets(db) == 30
+        assert stats['errors'] == 0
+        assert db.get_sync_state("test", "12306")['last_uid'] == 30
+
+def test_failed_ticket_writes_do_not_advance_sync_state(db, mail_config, monkeypatch):
+    from ticket import models
+    messages = {uid: make_ticket_email(uid) for uid in range(1, 31)}
+    with FakeIMAPServer(messages) as server:
+        with monkeypatch.context() as patch:
+            patch.setattr(models, "UPSERT_TICKET_SQL", "INSERT INTO missing_table VALUES (?)")
+            stats = sync_account(imap_account(server), db)
+        assert stats['write_failures'] == 30
+        assert count_tickets(db) == 0
+        # 写入失败时不保存同步位置，下次同步重新获取
+        assert db.get_sync_state("test", "12306") is None
+
+        stats = sync_account(imap_account(server), db)
+        assert stats['total_processed'] == 30
+        assert count_tickets(db) == 30
+        assert db.get_sync_state("test", "12306")['last_uid'] == 30
+
+def test_sync_high_water_mark():
+    assert sync_high_water_mark([b"11", b"12", b"13"], [], 10) == 13
+    assert sync_high_water_mark([b"11", b"12", b"13"], [b"12"], 10) == 11
+    assert sync_high_water_mark([b"11", b"12", b"13"], [b"11"], 10) == 10
+
+REFUND_SUBJECT_TEXT = "网上购票系统-用户退票通知"
+PAYMENT_SUBJECT_TEXT = "网上购票系统-用户支付通知"
+
+def passenger_line(number, name, seat, refund=None):
+    line = f"{number}.{name},2024年01月15日08:30开,北京南-上海虹桥,G1次列车,08车{seat}号,二等座,成人票,票价553.5元"
+    if refund is not None:
+        line += f",应退票款{refund}元"
+    return line + "."
+
+def order_email(subject, order_id, lines, fingerprint=None):
+    return {"subject": subject, "content": f"订单号码{order_id},车票信息如下:" + "".join(lines),
+            "fingerprint": fingerprint}
+
+def test_multi_passenger_refund_counts(db, monkeypatch):
+    from tools import mail
+    monkeypatch.setattr(mail, "PASSENGER_FILTER", None)
+    emails = [
+        order_email(PAYMENT_SUBJECT_TEXT, "EA", [passenger_line(1, "张三", "12A"), passenger_line(2, "李四", "12B")]),
+        order_email(REFUND_SUBJECT_TEXT, "EZ", [passenger_line(1, "张三", "01A", 548.5)]),
+        order_email(REFUND_SUBJECT_TEXT, "EA", [passenger_line(1, "张三", "12A", 548.5),
+                                               passenger_line(2, "李四", "12B", 526.0)]),
+    ]
+    stats = process_ticket_emails(emails, db)
+    assert stats["tickets_added"] == 2
+    # 两位乘客各一条退票记录，未知订单的退票计为错误
+    assert stats["refunds_processed"] == 2
+    assert stats["errors"] == 1
+    db.cursor.execute("SELECT passenger_name, is_refunded, service_fee FROM tickets ORDER BY passenger_name")
+    assert sorted(db.cursor.fetchall()) == sorted([("张三", 1, 5.0), ("李四", 1, 27.5)])
+
+def test_ledger_is_per_message_and_resync_keeps_refunds(db, monkeypatch):
+    from tools import mail
+    monkeypatch.setattr(mail, "PASSENGER_FILTER", None)
+    purchase = order_email(PAYMENT_SUBJECT_TEXT, "EA", [passenger_line(1, "张三", "12A")], ("<a@x>", "1"))
+    emails = [
+        purchase,
+        order_email(REFUND_SUBJECT_TEXT, "EZ", [passenger_line(1, "张三", "01A", 548.5)], ("<z@x>", "2")),
+        order_email(REFUND_SUBJECT_TEXT, "EA", [passenger_line(1, "张三", "12A", 548.5)], ("<r@x>", "3")),
+    ]
+    stats = process_ticket_emails(emails, db)
+    assert (stats["tickets_added"], stats["refunds_processed"], stats["errors"]) == (1, 1, 1)
+    # 同一批次中只有退票没有找到车票的邮件不记入台账
+    fingerprints = [email_info["fingerprint"] for email_info in emails]
+    assert db.get_processed_messages(fingerprints) == {("<a@x>", "1"), ("<r@x>", "3")}
+
+    # 重新同步购票邮件不会把已退的车票改回未退
+    process_ticket_emails([dict(purchase, fingerprint=None)], db)
+    db.cursor.execute("SELECT is_refunded, service_fee FROM tickets WHERE order_id = 'EA'")
+    assert db.cursor.fetchone() == (1, 5.0)
+
+def test_refund_of_filtered_out_passenger_is_skipped(db, monkeypatch):
+    from tools import mail
+    monkeypatch.setattr(mail, "PASSENGER_FILTER", "温阳光")
+    emails = [
+        order_email(PAYMENT_SUBJECT_TEXT, "EA", [passenger_line(1, "温阳光", "12A"), passenger_line(2, "张三", "12B")],
+                    ("<a@x>", "1")),
+        order_email(REFUND_SUBJECT_TEXT, "EA", [passenger_line(1, "张三", "12B", 526.0)], ("<r@x>", "2")),
+    ]
+    stats = process_ticket_emails(emails, db)
+    # 只保存目标乘客的车票，另一位乘客的退票跳过，不计为错误，邮件记入台账不再重复处理
+    assert (stats["tickets_added"], stats["refunds_processed"], stats["errors"]) == (1, 0, 0)
+    assert db.get_processed_messages([email_info["fingerprint"] for email_info in emails]) == {
+        ("<a@x>", "1"), ("<r@x>", "2")
+    }
+    db.cursor.execute("SELECT passenger_name, is_refunded FROM tickets")
+    assert db.cursor.fetchall() == [("温阳光", 0)]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import pytest
+from tests.support import QUERY_PLAN_CHECKS, make_ticket_rows
+
+@pytest.mark.parametrize("name, sql, params, index_name", QUERY_PLAN_CHECKS)
+def test_query_plan_uses_index(db, name, sql, params, index_name):
+    db.bulk_upsert_tickets(make_ticket_rows(2000))
+    db.conn.execute("ANALYZE")
+    plan = " | ".join(row[3] for row in db.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+    assert index_name in plan
+
+def make_order(order_id, passengers):
+    return [dict(row, order_id=order_id, passenger_name=name) for row, name in zip(make_ticket_rows(len(passengers)), passengers)]
+
+def test_bulk_refund_counts_refund_records(db):
+    db.bulk_upsert_tickets(make_order("E1", ["张三", "李四", "王五"]))
+    refunds = [
+        {"order_id": "E1", "service_fee": 5.0},
+        {"order_id": "EZ", "service_fee": 5.0},
+    ]
+    # 退整个订单匹配三张车票，只算一条退票记录；未知订单不匹配
+    assert db.refund_tickets(refunds) == [True, False]
+    assert db.bulk_refund(refunds) == 1
+    db.cursor.execute("SELECT COUNT(*) FROM tickets WHERE is_refunded = 1")
+    assert db.cursor.fetchone()[0] == 3
+
+def test_close_connections_closes_every_thread(tmp_path):
+    import sqlite3
+    import threading
+    from ticket.models import close_connections, get_connection
+
+    db_path = str(tmp_path / "threads.db")
+    opened = []
+    ready = threading.Event()
+    done = threading.Event()
+
+    def worker():
+        opened.append(get_connection(db_path))
+        ready.set()
+        done.wait()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    ready.wait()
+    main_conn = get_connection(db_path)
+    close_connections()
+    done.set()
+    thread.join()
+    for conn in opened + [main_conn]:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    # 关闭后再次获取时重新建立连接
+    assert get_connection(db_path).execute("SELECT 1").fetchone() == (1,)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+from tools import async_mail
+from tools.async_mail import AsyncMailPool
+from tools.scheduler import IngestionScheduler
+from tests.support import FakeIMAPServer, imap_account, make_ticket_email
+
+def run_job(accounts, monkeypatch):
+    monkeypatch.setattr(async_mail, "EMAIL_ACCOUNTS", accounts)
+    pool = AsyncMailPool(max_connections=1)
+    scheduler = IngestionScheduler(pool, interval=0, jitter=0, retry_base_delay=60)
+    job = scheduler.trigger()
+    try:
+        asyncio.run(scheduler._execute(job))
+    finally:
+        pool.close()
+    return scheduler, job
+
+def test_unreachable_imap_server_fails_job(monkeypatch, mail_config, config_db):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    account = {"imap_host": "127.0.0.1", "imap_port": port, "email_user": "test", "email_pwd": "test"}
+    scheduler, job = run_job([account], monkeypatch)
+    assert job["status"] == "failed"
+    assert job["result"][0]["status"] == "error"
+    # 失败后按退避时间重试
+    assert scheduler.failures == 1
+    assert scheduler.next_delay() == 60
+
+def test_failed_fetch_batch_fails_job(monkeypatch, mail_config, config_db):
+    messages = {uid: make_ticket_email(uid) for uid in range(1, 31)}
+    with FakeIMAPServer(messages, fail_uids={15}) as server:
+        scheduler, job = run_job([imap_account(server)], monkeypatch)
+        assert job["status"] == "failed"
+        assert job["result"][0]["stats"]["failed_messages"] == 10
+
+        server.fail_uids.clear()
+        scheduler, job = run_job([imap_account(server)], monkeypatch)
+        assert job["status"] == "success"
+        assert scheduler.failures == 0
+
+def test_failed_ticket_writes_fail_job(monkeypatch, mail_config, config_db):
+    from ticket import models
+    messages = {uid: make_ticket_email(uid) for uid in range(1, 11)}
+    with FakeIMAPServer(messages) as server:
+        monkeypatch.setattr(models, "UPSERT_TICKET_SQL", "INSERT INTO missing_table VALUES (?)")
+        scheduler, job = run_job([imap_account(server)], monkeypatch)
+    assert job["status"] == "failed"
+    assert job["result"][0]["stats"]["write_failures"] == 10
+    assert scheduler.failures == 1
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import re
+import pytest
+from ticket.ticket_parser import (
+    clean_text_content, parse_ticket_info, parse_ticket_infos, parse_refund_info, parse_refund_infos
+)
+from tests.support import (
+    legacy_clean_text_content, legacy_parse_refund_info, legacy_parse_ticket_info, make_clean_body, make_parser_corpus
+)
+
+CORPUS = make_parser_corpus(2000)
+
+def test_parse_ticket_info_matches_legacy():
+    mismatches = [text for text in CORPUS if parse_ticket_info(text) != legacy_parse_ticket_info(text)]
+    assert mismatches == []
+
+def test_parse_ticket_infos_one_record_per_passenger():
+    for text in CORPUS:
+        records = parse_ticket_infos(text)
+        trains = re.findall(r"[A-Z0-9]+次列车", text)
+        if len(trains) <= 1:
+            # 单乘客订单与原始实现一致
+            assert records == [legacy_parse_ticket_info(text)], text
+        else:
+            assert [record["train_number"] for record in records] == trains, text
+
+def test_parse_ticket_infos_multi_passenger_order():
+    text = ("订单号码E123456789,车票信息如下:"
+            "1.张三,2024年01月15日08:30开,北京南-上海虹桥,G1次列车,08车12A号,二等座,成人票,票价553.5元."
+            "2.李四,2024年01月15日08:30开,北京南-上海虹桥,G1次列车,08车12B号,二等座,成人票,票价553.5元.")
+    records = parse_ticket_infos(text)
+    assert [(record["order_id"], record["passenger_name"], record["seat_number"]) for record in records] == [
+        ("E123456789", "张三", "12A号"), ("E123456789", "李四", "12B号")
+    ]
+
+def test_parse_refund_info_matches_legacy():
+    for text in CORPUS:
+        legacy = legacy_parse_refund_info(text)
+        refund = parse_refund_info(text)
+        # 退票结果在原始字段之外可能多出乘客姓名
+        assert {key: refund[key] for key in legacy if key in refund} == legacy, text
+
+@pytest.mark.parametrize("size", [500, 2000, 8000, 32000])
+def test_clean_text_content_matches_legacy(size):
+    body = make_clean_body(size)
+    assert clean_text_content(body) == legacy_clean_text_content(body)
+
+def test_parse_refund_infos_multi_passenger_refund():
+    text = ("订单号码E123456789,车票信息如下:"
+            "1.张三,2024年01月15日08:30开,北京南-上海虹桥,G1次列车,08车12A号,二等座,成人票,票价553.5元,应退票款548.5元."
+            "2.李四,2024年01月15日08:30开,北京南-上海虹桥,G1次列车,08车12B号,二等座,成人票,票价553.5元,应退票款526.0元.")
+    refunds = parse_refund_infos(text)
+    assert [(refund["order_id"], refund["passenger_name"], refund["service_fee"]) for refund in refunds] == [
+        ("E123456789", "张三", 5.0), ("E123456789", "李四", 27.5)
+    ]
+
+def test_parse_refund_infos_single_passenger_matches_parse_refund_info():
+    for text in CORPUS:
+        if text.count("次列车") <= 1:
+            assert parse_refund_infos(text) == [parse_refund_info(text)], text
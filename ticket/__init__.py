@@ -3,7 +3,7 @@
 12306 车票信息管理模块
 """
 
-from .models import TicketDB
-from .ticket_parser import parse_ticket_info, parse_refund_info
+from .models import TicketDB, init_db
+from .ticket_parser import parse_ticket_info, parse_ticket_infos, parse_refund_info, parse_refund_infos
 
-__all__ = ['TicketDB', 'parse_ticket_info', 'parse_refund_info'] 
\ No newline at end of file
+__all__ = ['TicketDB', 'init_db', 'parse_ticket_info', 'parse_ticket_infos', 'parse_refund_info', 'parse_refund_infos'] 
\ No newline at end of file
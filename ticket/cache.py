@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+进程内查询缓存
+
+按数据版本缓存结果：每个条目记录写入时的数据版本，读取时版本不一致即视为未命中。
+数据版本由 tickets 表上的触发器在写入事务中更新，其他线程或进程（如命令行回填）提交的写入
+也会让缓存立即失效；本进程写入车票后还会主动清空缓存，尽早释放旧数据占用的内存。
+缓存除了限制条目数，还可以按条目的权重（如结果行数、响应字节数）限制总量，单个超过总量上限的结果不缓存。
+"""
+
+import threading
+from collections import OrderedDict
+
+# 缓存未命中时 get 的默认返回值
+MISSING = object()
+
+class QueryCache:
+    """
+    按数据版本缓存的 LRU 缓存，条目数或总权重超出上限时淘汰最久未使用的条目，可以在多个线程中同时使用
+    """
+    def __init__(self, max_size=128, max_weight=None, weigh=None):
+        """
+        :param max_size: 最多缓存的条目数，为0时不缓存
+        :param max_weight: 所有条目的权重之和上限，为None时只限制条目数
+        :param weigh: 计算条目权重的函数，接收缓存的值，返回非负整数，默认每个条目的权重为1
+        """
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self.weigh = weigh or (lambda value: 1)
+        self.entries = OrderedDict()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # 权重超过 max_weight 而没有缓存的结果数
+        self.oversized = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version, default=None):
+        """
+        读取缓存
+        :param key: 缓存键
+        :param version: 当前数据版本
+        :param default: 未命中时的返回值
+        :return: 缓存的值，不存在或版本不一致时返回 default
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, version, value):
+        """
+        写入缓存
+        :param key: 缓存键
+        :param version: 查询前读取的数据版本
+        :param value: 缓存的值
+        """
+        if self.max_size <= 0:
+            return
+        weight = self.weigh(value)
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.weight -= old[2]
+            if self.max_weight is not None and weight > self.max_weight:
+                self.oversized += 1
+                return
+            self.entries[key] = (version, value, weight)
+            self.weight += weight
+            while len(self.entries) > self.max_size or (self.max_weight is not None and self.weight > self.max_weight):
+                self.weight -= self.entries.popitem(last=False)[1][2]
+
+    def invalidate(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self.entries.clear()
+            self.weight = 0
+            self.invalidations += 1
+
+    def stats(self):
+        """
+        缓存统计信息
+        :return: dict 包含条目数、容量、总权重及上限、命中/未命中次数、命中率、清空次数和超出上限未缓存的结果数
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'weight': self.weight,
+                'max_weight': self.max_weight,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'invalidations': self.invalidations,
+                'oversized': self.oversized
+            }
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+车票数据列式导出
+
+把 tickets 表按出发月份分区导出为 Parquet 或 Arrow IPC 文件，财务报表等分析工具可以直接按列读取，
+Arrow IPC 文件还可以内存映射，不需要再解析 JSON。车站、席别、车次和乘客使用字典编码，
+时间字段为 timestamp 类型。未安装 pyarrow 时回退为同样按月分区的 CSV 文件。
+
+输出目录结构（pyarrow.dataset、pandas、DuckDB 等可以直接按分区读取）:
+    <output>/month=2024-01/part-0.parquet
+    <output>/month=2024-02/part-0.parquet
+
+每次导出先写入输出目录中的临时目录，完成后替换输出目录中的 month=* 分区目录，上次导出留下的其他月份分区
+不会残留，输出目录中的其他文件保持不变。
+
+用法:
+    python -m ticket.export --output exports/tickets --format parquet
+"""
+
+import argparse
+import csv
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from .models import TicketDB, TICKET_COLUMNS, BOOLEAN_COLUMNS, close_connections
+
+# pyarrow 为可选依赖，未安装时只能导出 CSV
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# 重复值较多的字段使用字典编码
+DICTIONARY_COLUMNS = frozenset(['passenger_name', 'departure_station', 'arrival_station', 'train_number', 'seat_type'])
+FLOAT_COLUMNS = frozenset(['price', 'service_fee'])
+# 出发时间为车票上的北京时间，created_at/updated_at 由 SQLite 的 CURRENT_TIMESTAMP 写入，为 UTC 时间
+LOCAL_TIME_COLUMNS = frozenset(['departure_time'])
+UTC_TIME_COLUMNS = frozenset(['created_at', 'updated_at'])
+
+# 导出格式及其文件扩展名
+EXPORT_FORMATS = {
+    'parquet': 'parquet',
+    'arrow': 'arrow',
+    'csv': 'csv',
+}
+
+MONTH_INDEX = TICKET_COLUMNS.index('departure_time')
+# 分区目录名前缀，输出目录中只有这些目录由导出管理
+PARTITION_PREFIX = 'month='
+
+def arrow_schema():
+    """
+    tickets 表对应的 Arrow schema
+    :return: pyarrow.Schema
+    """
+    fields = []
+    for column in TICKET_COLUMNS:
+        if column in DICTIONARY_COLUMNS:
+            column_type = pa.dictionary(pa.int32(), pa.string())
+        elif column in BOOLEAN_COLUMNS:
+            column_type = pa.bool_()
+        elif column in FLOAT_COLUMNS:
+            column_type = pa.float64()
+        elif column in LOCAL_TIME_COLUMNS:
+            column_type = pa.timestamp('s')
+        elif column in UTC_TIME_COLUMNS:
+            column_type = pa.timestamp('s', tz='UTC')
+        else:
+            column_type = pa.string()
+        fields.append(pa.field(column, column_type))
+    return pa.schema(fields)
+
+def parse_timestamp(value):
+    """
+    解析 SQLite 中保存的时间字符串，忽略秒以下的部分
+    :param value: 形如 2024-01-15 08:30:00 的字符串
+    :return: datetime，value 为空时返回None
+    """
+    if value is None:
+        return None
+    return datetime.fromisoformat(value[:19])
+
+def rows_to_table(rows, schema):
+    """
+    把一个分区的车票元组转换为 Arrow 表
+    :param rows: list 按 TICKET_COLUMNS 顺序的车票元组
+    :param schema: arrow_schema() 返回的 schema
+    :return: pyarrow.Table
+    """
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        column = field.name
+        if column in DICTIONARY_COLUMNS:
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        elif column in BOOLEAN_COLUMNS:
+            arrays.append(pa.array([bool(value) for value in values], pa.bool_()))
+        elif column in LOCAL_TIME_COLUMNS or column in UTC_TIME_COLUMNS:
+            arrays.append(pa.array([parse_timestamp(value) for value in values], field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def write_partition(path, rows, export_format, schema=None):
+    """
+    写入一个月份分区，先写入临时文件再替换，读取方不会看到写了一半的文件
+    :param path: 分区文件路径
+    :param rows: list 按 TICKET_COLUMNS 顺序的车票元组
+    :param export_format: parquet / arrow / csv
+    :param schema: arrow_schema() 返回的 schema，导出 CSV 时不需要
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    if export_format == 'csv':
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(TICKET_COLUMNS)
+            writer.writerows(rows)
+    else:
+        table = rows_to_table(rows, schema)
+        if export_format == 'parquet':
+            pq.write_table(table, tmp_path)
+        else:
+            # 不压缩，读取时可以直接内存映射
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def resolve_format(export_format):
+    """
+    确定实际使用的导出格式，需要的库未安装时回退为 CSV
+    :param export_format: auto / parquet / arrow / csv
+    :return: str 实际导出格式
+    """
+    if export_format == 'auto':
+        export_format = 'parquet'
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {export_format}")
+    if export_format == 'parquet' and (pa is None or pq is None):
+        logger.warning("未安装 pyarrow.parquet，改为导出 CSV")
+        return 'csv'
+    if export_format == 'arrow' and pa is None:
+        logger.warning("未安装 pyarrow，改为导出 CSV")
+        return 'csv'
+    return export_format
+
+def replace_partitions(src, dst):
+    """
+    用 src 中的分区目录替换 dst 中的分区目录，dst 中本次没有导出的 month=* 目录删除，其他文件不动
+    :param src: 本次导出的目录，需要与 dst 在同一文件系统上
+    :param dst: 输出目录
+    """
+    new = set(os.listdir(src))
+    # 被替换的旧分区先移到 src 中，最后随临时目录一起删除
+    trash = os.path.join(src, '.old')
+    os.mkdir(trash)
+    for name in os.listdir(dst):
+        path = os.path.join(dst, name)
+        if name.startswith(PARTITION_PREFIX) and os.path.isdir(path):
+            os.rename(path, os.path.join(trash, name))
+    for name in new:
+        os.rename(os.path.join(src, name), os.path.join(dst, name))
+
+def export_columnar(output_dir, export_format='auto', db=None, start_date=None, end_date=None, batch_size=5000):
+    """
+    按出发月份分区导出车票数据；按出发时间顺序逐批读取，同一时间只在内存中保留一个月的车票
+    :param output_dir: 输出目录，导出成功后其中的 month=* 分区替换为本次导出的分区，其他文件不动
+    :param export_format: auto / parquet / arrow / csv，auto 优先使用 Parquet
+    :param db: 数据库对象，未传入时自动创建并在结束后关闭
+    :param start_date: 开始日期 (YYYY-MM-DD)
+    :param end_date: 结束日期 (YYYY-MM-DD)
+    :param batch_size: 每批从数据库读取的车票数量
+    :return: dict 导出结果，包含格式、行数和分区文件列表
+    """
+    export_format = resolve_format(export_format)
+    schema = arrow_schema() if export_format != 'csv' else None
+    own_db = db is None
+    if own_db:
+        db = TicketDB()
+
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    # 临时目录放在输出目录中，完成后可以直接重命名替换；以 . 开头，按分区读取数据集时会被忽略
+    tmp_dir = tempfile.mkdtemp(prefix='.export-', dir=output_dir)
+    partitions = []
+    total_rows = 0
+    month = None
+    rows = []
+
+    def flush():
+        partition = os.path.join(f"{PARTITION_PREFIX}{month}", f"part-0.{EXPORT_FORMATS[export_format]}")
+        write_partition(os.path.join(tmp_dir, partition), rows, export_format, schema)
+        partitions.append(partition)
+
+    try:
+        batches = db.iter_tickets(start_date=start_date, end_date=end_date, as_dict=False, batch_size=batch_size)
+        for batch in batches:
+            for row in batch:
+                row_month = row[MONTH_INDEX][:7]
+                if row_month != month:
+                    if rows:
+                        flush()
+                    month = row_month
+                    rows = []
+                rows.append(row)
+            total_rows += len(batch)
+        if rows:
+            flush()
+        replace_partitions(tmp_dir, output_dir)
+    finally:
+        if own_db:
+            db.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        'format': export_format,
+        'rows': total_rows,
+        'partitions': len(partitions),
+        'files': [os.path.join(output_dir, partition) for partition in partitions],
+        'elapsed': round(time.perf_counter() - start, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="按出发月份分区导出车票数据为 Parquet/Arrow/CSV")
+    parser.add_argument("--output", default="exports/tickets", help="输出目录")
+    parser.add_argument("--format", dest="export_format", default="auto", choices=["auto"] + list(EXPORT_FORMATS),
+                        help="导出格式，auto 优先使用 Parquet，未安装 pyarrow 时导出 CSV")
+    parser.add_argument("--db", default=None, help="数据库文件路径，默认为 DATABASE_CONFIG 中的路径")
+    parser.add_argument("--start-date", default=None, help="开始日期 (YYYY-MM-DD)")
+    parser.add_argument("--end-date", default=None, help="结束日期 (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    db = TicketDB(args.db)
+    try:
+        result = export_columnar(args.output, args.export_format, db, args.start_date, args.end_date)
+    finally:
+        db.close()
+        close_connections()
+    print(f"导出完成 - 格式: {result['format']}, 车票: {result['rows']}, 分区: {result['partitions']}, "
+          f"耗时: {result['elapsed']}s, 输出目录: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,482 @@
 # -*- coding: utf-8 -*-
 import sqlite3
 import os
-from datetime import datetime
+import json
+import base64
+import threading
+from functools import lru_cache
+from datetime import datetime, timedelta
 from config import DATABASE_CONFIG
+from .cache import QueryCache, MISSING
+
+# 每个线程复用自己的数据库连接，避免每次请求都重新建立连接
+_local = threading.local()
+# 各线程的连接字典，close_connections 可以统一关闭所有线程的连接
+_thread_connections = {}
+_connections_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_initialized_paths = set()
+
+def _result_rows(result):
+    # 查询缓存条目的权重为结果中的车票行数，统计信息等非列表结果记为1
+    if isinstance(result, tuple):
+        result = result[0]
+    return len(result) if isinstance(result, list) else 1
+
+# TicketDB 读取方法的进程内缓存，所有连接共享；按结果总行数限制内存占用，超过上限的单个结果不缓存
+query_cache = QueryCache(DATABASE_CONFIG.get("query_cache_size", 128),
+                         DATABASE_CONFIG.get("query_cache_max_rows", 50000), _result_rows)
+
+def _resolve_db_path(db_name=None):
+    return os.path.abspath(db_name or DATABASE_CONFIG["db_path"])
+
+def _open_connection(db_path, check_same_thread=True):
+    """
+    建立新的数据库连接并设置性能相关的 PRAGMA
+    :param db_path: 数据库文件路径
+    :param check_same_thread: 为False时连接可以依次在不同线程中使用
+    :return: sqlite3.Connection
+    """
+    # 确保数据库目录存在
+    db_dir = os.path.dirname(db_path)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, timeout=DATABASE_CONFIG.get("busy_timeout", 5000) / 1000,
+                           check_same_thread=check_same_thread)
+    # WAL 模式下读写互不阻塞，后台同步写入时接口仍可读取
+    conn.execute(f"PRAGMA journal_mode = {DATABASE_CONFIG.get('journal_mode', 'WAL')}")
+    conn.execute(f"PRAGMA synchronous = {DATABASE_CONFIG.get('synchronous', 'NORMAL')}")
+    conn.execute(f"PRAGMA cache_size = {int(DATABASE_CONFIG.get('cache_size', -20000))}")
+    conn.execute(f"PRAGMA mmap_size = {int(DATABASE_CONFIG.get('mmap_size', 268435456))}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+def get_connection(db_name=None):
+    """
+    获取当前线程复用的数据库连接，不存在时自动创建
+    :param db_name: 数据库文件路径
+    :return: sqlite3.Connection
+    """
+    db_path = _resolve_db_path(db_name)
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+        with _connections_lock:
+            _prune_dead_threads()
+            _thread_connections[threading.current_thread()] = connections
+    conn = connections.get(db_path)
+    if conn is None:
+        # 连接只在创建它的线程中使用，允许跨线程只是为了 close_connections 可以在其他线程中关闭它
+        conn = connections[db_path] = _open_connection(db_path, check_same_thread=False)
+    return conn
+
+def _close_all(connections):
+    for conn in connections.values():
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"关闭数据库连接失败: {e}")
+    connections.clear()
+
+def _prune_dead_threads():
+    # 已退出的线程不会再使用它的连接，需持有 _connections_lock 调用
+    for thread in [thread for thread in _thread_connections if not thread.is_alive()]:
+        _close_all(_thread_connections.pop(thread))
+
+def close_connections():
+    """
+    关闭所有线程持有的数据库连接，之后各线程再次访问数据库时重新建立连接
+    调用时其他线程不应正在使用数据库，如应用关闭或命令行工具退出时
+    """
+    with _connections_lock:
+        for connections in _thread_connections.values():
+            _close_all(connections)
+        _prune_dead_threads()
+
+# tickets 表结构，一个订单可包含多位乘客，以 (订单号, 乘客, 座位号) 唯一确定一张车票
+TICKETS_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS {table} (
+    order_id TEXT NOT NULL,
+    passenger_name TEXT NOT NULL,
+    departure_time DATETIME NOT NULL,
+    departure_station TEXT NOT NULL,
+    arrival_station TEXT NOT NULL,
+    train_number TEXT NOT NULL,
+    carriage_number TEXT NOT NULL,
+    seat_number TEXT NOT NULL,
+    seat_type TEXT NOT NULL,
+    price REAL NOT NULL,
+    is_waiting BOOLEAN NOT NULL,
+    is_refunded BOOLEAN NOT NULL DEFAULT 0,
+    is_changed BOOLEAN NOT NULL DEFAULT 0,
+    service_fee REAL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (order_id, passenger_name, seat_number)
+)
+'''
+
+def create_tables(cursor):
+    """
+    创建数据库表结构
+    :param cursor: 数据库游标
+    """
+    cursor.execute(TICKETS_TABLE_SQL.format(table='tickets'))
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS mail_sync_state (
+        account TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        uidvalidity INTEGER NOT NULL,
+        last_uid INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (account, folder)
+    )
+    ''')
+
+# 统计汇总维度及其分组键，row 为 NEW 或 OLD
+AGGREGATE_DIMENSIONS = (
+    ('total', "''"),
+    ('train', '{row}.train_number'),
+    ('seat_type', '{row}.seat_type'),
+    ('month', 'substr({row}.departure_time, 1, 7)'),
+    ('route', "{row}.departure_station || '-' || {row}.arrival_station"),
+    ('train_route', "{row}.train_number || '|' || {row}.departure_station || '-' || {row}.arrival_station"),
+)
+
+def _aggregate_upsert_sql(row, sign):
+    """
+    生成把一行车票的贡献累加到 ticket_aggregates 的语句，sign 为 + 或 -
+    """
+    statements = []
+    for dimension, key in AGGREGATE_DIMENSIONS:
+        key = key.format(row=row)
+        statements.append(f'''
+        INSERT INTO ticket_aggregates (dimension, key, ticket_count, waiting_count, refund_count, total_amount, total_fees)
+        VALUES (
+            '{dimension}', {key},
+            {sign}({row}.is_refunded = 0),
+            {sign}({row}.is_refunded = 0 AND {row}.is_waiting = 1),
+            {sign}({row}.is_refunded = 1),
+            {sign}(CASE WHEN {row}.is_refunded = 0 THEN {row}.price ELSE 0 END),
+            {sign}COALESCE({row}.service_fee, 0)
+        )
+        ON CONFLICT(dimension, key) DO UPDATE SET
+            ticket_count = ticket_count + excluded.ticket_count,
+            waiting_count = waiting_count + excluded.waiting_count,
+            refund_count = refund_count + excluded.refund_count,
+            total_amount = total_amount + excluded.total_amount,
+            total_fees = total_fees + excluded.total_fees;''')
+    return ''.join(statements)
+
+# 汇总表由触发器在写入 tickets 的同一事务中维护，统计接口只需读取汇总表
+AGGREGATE_SCHEMA_SQL = [
+    '''
+    CREATE TABLE IF NOT EXISTS ticket_aggregates (
+        dimension TEXT NOT NULL,
+        key TEXT NOT NULL,
+        ticket_count INTEGER NOT NULL DEFAULT 0,
+        waiting_count INTEGER NOT NULL DEFAULT 0,
+        refund_count INTEGER NOT NULL DEFAULT 0,
+        total_amount REAL NOT NULL DEFAULT 0,
+        total_fees REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, key)
+    )
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tickets_aggregate_insert AFTER INSERT ON tickets
+    BEGIN{_aggregate_upsert_sql('NEW', '+')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tickets_aggregate_delete AFTER DELETE ON tickets
+    BEGIN{_aggregate_upsert_sql('OLD', '-')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tickets_aggregate_update AFTER UPDATE ON tickets
+    BEGIN{_aggregate_upsert_sql('OLD', '-')}{_aggregate_upsert_sql('NEW', '+')}
+    END
+    ''',
+    # 根据已有数据重建汇总
+    'DELETE FROM ticket_aggregates',
+] + [
+    f'''
+    INSERT INTO ticket_aggregates (dimension, key, ticket_count, waiting_count, refund_count, total_amount, total_fees)
+    SELECT '{dimension}', {key.format(row='tickets')},
+        SUM(is_refunded = 0),
+        SUM(is_refunded = 0 AND is_waiting = 1),
+        SUM(is_refunded = 1),
+        SUM(CASE WHEN is_refunded = 0 THEN price ELSE 0 END),
+        SUM(COALESCE(service_fee, 0))
+    FROM tickets
+    GROUP BY 2
+    '''
+    for dimension, key in AGGREGATE_DIMENSIONS
+]
+
+# 数据版本号，tickets 表每次变化都由触发器在同一事务中加一，接口据此生成 ETag、判断响应缓存是否过期；
+# token 在建表时随机生成，数据库重建后旧的 ETag 不会误匹配
+DATA_VERSION_SCHEMA_SQL = [
+    '''
+    CREATE TABLE IF NOT EXISTS data_version (
+        token TEXT NOT NULL DEFAULT (lower(hex(randomblob(8)))),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'INSERT INTO data_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM data_version)',
+] + [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tickets_version_{event.lower()} AFTER {event} ON tickets
+    BEGIN
+        UPDATE data_version SET version = version + 1;
+    END
+    '''
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# 出发时间相关索引，支持按时间排序、按乘客和日期范围查询以及退票/候补统计
+TICKET_INDEX_SQL = [
+    'CREATE INDEX IF NOT EXISTS idx_tickets_departure_time ON tickets(departure_time)',
+    'CREATE INDEX IF NOT EXISTS idx_tickets_passenger_departure ON tickets(passenger_name, departure_time)',
+    'CREATE INDEX IF NOT EXISTS idx_tickets_refunded ON tickets(departure_time) WHERE is_refunded = 1',
+    'CREATE INDEX IF NOT EXISTS idx_tickets_waiting ON tickets(departure_time) WHERE is_waiting = 1',
+]
+
+# 数据库结构迁移，按顺序执行，PRAGMA user_version 记录已执行到第几个迁移
+MIGRATIONS = [
+    # 1: 出发时间相关索引
+    TICKET_INDEX_SQL,
+    # 2: 触发器维护的统计汇总表
+    AGGREGATE_SCHEMA_SQL,
+    # 3: 主键由 order_id 改为 (order_id, passenger_name, seat_number)，SQLite 不能修改主键，
+    # 只能重建表；删除旧表时索引和触发器一并删除，需重新创建并重建汇总
+    [
+        'DROP TABLE IF EXISTS tickets_rebuild',
+        TICKETS_TABLE_SQL.format(table='tickets_rebuild'),
+        'INSERT INTO tickets_rebuild SELECT * FROM tickets',
+        'DROP TABLE tickets',
+        'ALTER TABLE tickets_rebuild RENAME TO tickets',
+    ] + TICKET_INDEX_SQL + AGGREGATE_SCHEMA_SQL,
+    # 4: 已处理邮件台账，按 Message-ID 记录邮件内容哈希，未变化的邮件再次同步时直接跳过
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            message_id TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            processed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    # 5: 触发器维护的数据版本号
+    DATA_VERSION_SCHEMA_SQL,
+]
+
+def migrate(conn):
+    """
+    执行尚未执行的数据库结构迁移
+    :param conn: 数据库连接
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target in range(version + 1, len(MIGRATIONS) + 1):
+        with conn:
+            for sql in MIGRATIONS[target - 1]:
+                conn.execute(sql)
+            conn.execute(f'PRAGMA user_version = {target}')
+
+def date_range_bounds(start_date, end_date):
+    """
+    将闭区间日期范围转换为出发时间的半开区间 [start, end)，以便直接使用 departure_time 索引
+    :param start_date: 开始日期 (YYYY-MM-DD)
+    :param end_date: 结束日期 (YYYY-MM-DD)
+    :return: tuple (下界, 上界)
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+# tickets 表的字段，顺序与建表语句一致
+TICKET_COLUMNS = (
+    'order_id', 'passenger_name', 'departure_time', 'departure_station',
+    'arrival_station', 'train_number', 'carriage_number', 'seat_number',
+    'seat_type', 'price', 'is_waiting', 'is_refunded', 'is_changed',
+    'service_fee', 'created_at', 'updated_at'
+)
+BOOLEAN_COLUMNS = frozenset(['is_waiting', 'is_refunded', 'is_changed'])
+
+@lru_cache(maxsize=64)
+def _build_row_factory(fields):
+    # 字段位置只计算一次；字典推导按字段顺序生成键，布尔字段随后原位覆盖，键的顺序与 fields 一致
+    columns = tuple(enumerate(fields))
+    bool_columns = tuple((index, field) for index, field in columns if field in BOOLEAN_COLUMNS)
+
+    def row_factory(cursor, row):
+        ticket = {field: row[index] for index, field in columns}
+        for index, field in bool_columns:
+            ticket[field] = bool(row[index])
+        return ticket
+    return row_factory
+
+def ticket_row_factory(fields):
+    """
+    生成把查询结果元组转换为车票字典的 row_factory，结果的前 len(fields) 列依次对应 fields，其余列忽略
+    :param fields: 字段列表，必须是 TICKET_COLUMNS 中的字段
+    :return: function (cursor, row) -> dict
+    """
+    fields = tuple(fields)
+    unknown = [field for field in fields if field not in TICKET_COLUMNS]
+    if unknown:
+        raise ValueError(f"未知的字段: {', '.join(unknown)}")
+    return _build_row_factory(fields)
+
+# 车票状态筛选条件，与前端的状态标签一致
+STATUS_CONDITIONS = {
+    'normal': 'is_refunded = 0 AND is_waiting = 0',
+    'waiting': 'is_refunded = 0 AND is_waiting = 1',
+    'refunded': 'is_refunded = 1',
+}
+
+# 分页排序键，前两列之后的乘客和座位号用于区分同一订单中的多张车票
+CURSOR_COLUMNS = ('departure_time', 'order_id', 'passenger_name', 'seat_number')
+
+def encode_cursor(key):
+    """
+    将分页位置编码为不透明的游标字符串
+    :param key: 上一页最后一张车票的排序键，顺序同 CURSOR_COLUMNS
+    :return: str 游标
+    """
+    raw = json.dumps(list(key), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """
+    解析游标字符串
+    :param cursor: encode_cursor 生成的游标
+    :return: tuple 排序键，顺序同 CURSOR_COLUMNS
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+    if not isinstance(key, list) or len(key) != len(CURSOR_COLUMNS):
+        raise ValueError(f"无效的分页游标: {cursor}")
+    return tuple(key)
+
+def build_ticket_filters(passenger_name=None, train_number=None, status=None, start_date=None, end_date=None):
+    """
+    生成车票查询的筛选条件
+    :param passenger_name: 乘客姓名
+    :param train_number: 车次
+    :param status: 车票状态 normal / waiting / refunded
+    :param start_date: 开始日期 (YYYY-MM-DD)
+    :param end_date: 结束日期 (YYYY-MM-DD)
+    :return: tuple (条件列表, 参数列表)
+    """
+    if status is not None and status not in STATUS_CONDITIONS:
+        raise ValueError(f"未知的车票状态: {status}")
+    conditions = []
+    params = []
+    if passenger_name:
+        conditions.append('passenger_name = ?')
+        params.append(passenger_name)
+    if train_number:
+        conditions.append('train_number = ?')
+        params.append(train_number)
+    if status:
+        conditions.append(STATUS_CONDITIONS[status])
+    if start_date or end_date:
+        lower, upper = date_range_bounds(start_date or '1970-01-01', end_date or '9999-12-30')
+        conditions.append('departure_time >= ? AND departure_time < ?')
+        params.extend([lower, upper])
+    return conditions, params
+
+def init_db(db_name=None):
+    """
+    初始化数据库表结构，每个数据库文件在进程内只执行一次
+    :param db_name: 数据库文件路径
+    """
+    db_path = _resolve_db_path(db_name)
+    if db_path in _initialized_paths:
+        return
+    with _schema_lock:
+        if db_path in _initialized_paths:
+            return
+        conn = get_connection(db_path)
+        create_tables(conn.cursor())
+        conn.commit()
+        migrate(conn)
+        _initialized_paths.add(db_path)
+
+# 按 (订单号, 乘客, 座位号) 插入或更新车票记录，内容没有变化时不更新，updated_at 只在数据变化时更新；
+# 退票状态和手续费只由退票邮件设置，重新同步购票邮件时不会把已退的车票改回未退
+TICKET_UPDATE_COLUMNS = (
+    'departure_time', 'departure_station', 'arrival_station', 'train_number',
+    'carriage_number', 'seat_type', 'price', 'is_waiting', 'is_changed'
+)
+UPSERT_TICKET_SQL = f'''
+INSERT INTO tickets (
+    order_id, passenger_name, departure_time, departure_station,
+    arrival_station, train_number, carriage_number, seat_number,
+    seat_type, price, is_waiting, is_refunded, is_changed, service_fee
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(order_id, passenger_name, seat_number) DO UPDATE SET
+    {', '.join(f'{column} = excluded.{column}' for column in TICKET_UPDATE_COLUMNS)},
+    is_refunded = MAX(is_refunded, excluded.is_refunded),
+    service_fee = CASE WHEN excluded.is_refunded THEN excluded.service_fee ELSE service_fee END,
+    updated_at = CURRENT_TIMESTAMP
+WHERE {' OR '.join(f'{column} IS NOT excluded.{column}' for column in TICKET_UPDATE_COLUMNS)}
+    OR (excluded.is_refunded AND (is_refunded = 0 OR service_fee IS NOT excluded.service_fee))
+'''
+
+# 退票邮件中有乘客姓名时只退该乘客的车票，否则退整个订单
+REFUND_TICKET_SQL = '''
+UPDATE tickets
+SET is_refunded = 1, service_fee = ?, updated_at = CURRENT_TIMESTAMP
+WHERE order_id = ? AND (? IS NULL OR passenger_name = ?)
+'''
+
+def _ticket_params(ticket_info):
+    return (
+        ticket_info['order_id'],
+        ticket_info['passenger_name'],
+        ticket_info['departure_time'],
+        ticket_info['departure_station'],
+        ticket_info['arrival_station'],
+        ticket_info['train_number'],
+        ticket_info['carriage_number'],
+        ticket_info['seat_number'],
+        ticket_info['seat_type'],
+        ticket_info['price'],
+        ticket_info.get('is_waiting', False),
+        ticket_info.get('is_refunded', False),
+        ticket_info.get('is_changed', False),
+        ticket_info.get('service_fee', 0.0)
+    )
+
+def _batched(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 class TicketDB:
-    def __init__(self, db_name=None):
-        if db_name is None:
-            db_name = DATABASE_CONFIG["db_path"]
-        
-        # 确保数据库目录存在
-        db_dir = os.path.dirname(db_name)
-        if db_dir and not os.path.exists(db_dir):
-            os.makedirs(db_dir)
-            
-        self.conn = sqlite3.connect(db_name)
+    def __init__(self, db_name=None, use_query_cache=True):
+        """
+        :param db_name: 数据库文件路径，默认为 DATABASE_CONFIG 中的路径
+        :param use_query_cache: 读取方法是否使用 query_cache，调用方自己缓存结果时关闭，避免同一结果缓存两份
+        """
+        init_db(db_name)
+        self.db_path = _resolve_db_path(db_name)
+        self.conn = get_connection(db_name)
         self.cursor = self.conn.cursor()
-        self.create_tables()
+        self.use_query_cache = use_query_cache
     
     def create_tables(self):
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tickets (
-            order_id TEXT PRIMARY KEY,
-            passenger_name TEXT NOT NULL,
-            departure_time DATETIME NOT NULL,
-            departure_station TEXT NOT NULL,
-            arrival_station TEXT NOT NULL,
-            train_number TEXT NOT NULL,
-            carriage_number TEXT NOT NULL,
-            seat_number TEXT NOT NULL,
-            seat_type TEXT NOT NULL,
-            price REAL NOT NULL,
-            is_waiting BOOLEAN NOT NULL,
-            is_refunded BOOLEAN NOT NULL DEFAULT 0,
-            is_changed BOOLEAN NOT NULL DEFAULT 0,
-            service_fee REAL DEFAULT 0,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
+        create_tables(self.cursor)
         self.conn.commit()
     
     def add_ticket(self, ticket_info):
@@ -47,137 +485,245 @@ class TicketDB:
         :param ticket_info: 包含票务信息的字典
         :return: bool 是否操作成功
         """
+        changes = self.conn.total_changes
         try:
-            # 检查是否存在该订单
-            self.cursor.execute('SELECT order_id FROM tickets WHERE order_id = ?', (ticket_info['order_id'],))
+            # 检查是否存在该车票
+            self.cursor.execute(
+                'SELECT order_id FROM tickets WHERE order_id = ? AND passenger_name = ? AND seat_number = ?',
+                (ticket_info['order_id'], ticket_info['passenger_name'], ticket_info['seat_number'])
+            )
             exists = self.cursor.fetchone() is not None
 
-            if exists:
-                # 更新现有记录
-                self.cursor.execute('''
-                UPDATE tickets SET
-                    passenger_name = ?,
-                    departure_time = ?,
-                    departure_station = ?,
-                    arrival_station = ?,
-                    train_number = ?,
-                    carriage_number = ?,
-                    seat_number = ?,
-                    seat_type = ?,
-                    price = ?,
-                    is_waiting = ?,
-                    is_refunded = ?,
-                    is_changed = ?,
-                    service_fee = ?,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE order_id = ?
-                ''', (
-                    ticket_info['passenger_name'],
-                    ticket_info['departure_time'],
-                    ticket_info['departure_station'],
-                    ticket_info['arrival_station'],
-                    ticket_info['train_number'],
-                    ticket_info['carriage_number'],
-                    ticket_info['seat_number'],
-                    ticket_info['seat_type'],
-                    ticket_info['price'],
-                    ticket_info.get('is_waiting', False),
-                    ticket_info.get('is_refunded', False),
-                    ticket_info.get('is_changed', False),
-                    ticket_info.get('service_fee', 0.0),
-                    ticket_info['order_id']
-                ))
-            else:
-                # 插入新记录
-                self.cursor.execute('''
-                INSERT INTO tickets (
-                    order_id, passenger_name, departure_time, departure_station,
-                    arrival_station, train_number, carriage_number, seat_number,
-                    seat_type, price, is_waiting, is_refunded, is_changed, service_fee
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    ticket_info['order_id'],
-                    ticket_info['passenger_name'],
-                    ticket_info['departure_time'],
-                    ticket_info['departure_station'],
-                    ticket_info['arrival_station'],
-                    ticket_info['train_number'],
-                    ticket_info['carriage_number'],
-                    ticket_info['seat_number'],
-                    ticket_info['seat_type'],
-                    ticket_info['price'],
-                    ticket_info.get('is_waiting', False),
-                    ticket_info.get('is_refunded', False),
-                    ticket_info.get('is_changed', False),
-                    ticket_info.get('service_fee', 0.0)
-                ))
-                print(f"添加新订单 {ticket_info['order_id']} 的信息")
+            # 已存在时只有内容变化才会更新，见 UPSERT_TICKET_SQL
+            self.cursor.execute(UPSERT_TICKET_SQL, _ticket_params(ticket_info))
+            if not exists:
+                print(f"添加新订单 {ticket_info['order_id']} {ticket_info['passenger_name']} 的信息")
             
             self.conn.commit()
+            self._invalidate_cache(changes)
             return True
         except sqlite3.Error as e:
             print(f"操作票务记录失败: {e}")
             return False
 
-    def refund_ticket(self, order_id, service_fee):
+    def refund_ticket(self, order_id, service_fee, passenger_name=None):
         """
         更新退票信息
         :param order_id: 订单号
         :param service_fee: 手续费
+        :param passenger_name: 乘客姓名，为None时退整个订单
         :return: bool 是否退票成功
         """
+        changes = self.conn.total_changes
         try:
-            self.cursor.execute('''
-            UPDATE tickets 
-            SET is_refunded = 1, service_fee = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE order_id = ?
-            ''', (service_fee, order_id))
+            self.cursor.execute(REFUND_TICKET_SQL, (service_fee, order_id, passenger_name, passenger_name))
             self.conn.commit()
+            self._invalidate_cache(changes)
             return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             print(f"更新退票信息失败: {e}")
             return False
 
+    def bulk_upsert_tickets(self, tickets, batch_size=500):
+        """
+        批量添加或更新票务记录，每批在一个事务中提交
+        :param tickets: 可迭代的票务信息字典
+        :param batch_size: 每个事务写入的记录数
+        :return: int 成功写入的记录数
+        """
+        written = 0
+        for batch in _batched(tickets, batch_size):
+            changes = self.conn.total_changes
+            try:
+                with self.conn:
+                    self.cursor.executemany(UPSERT_TICKET_SQL, [_ticket_params(ticket) for ticket in batch])
+                written += len(batch)
+            except sqlite3.Error as e:
+                print(f"批量写入票务记录失败: {e}")
+            self._invalidate_cache(changes)
+        return written
+
+    def refund_tickets(self, refunds, batch_size=500):
+        """
+        批量更新退票信息，每批在一个事务中提交
+        :param refunds: 可迭代的退票信息字典，包含 order_id、service_fee 和可选的 passenger_name
+        :param batch_size: 每个事务更新的记录数
+        :return: list 每条退票记录是否匹配到车票，所在事务写入失败的记录为None
+        """
+        matched = []
+        for batch in _batched(refunds, batch_size):
+            changes = self.conn.total_changes
+            results = []
+            try:
+                with self.conn:
+                    # 逐条执行以便得到每条退票记录匹配的行数，退整个订单时一条记录可能对应多张车票
+                    for refund in batch:
+                        self.cursor.execute(
+                            REFUND_TICKET_SQL,
+                            (refund['service_fee'], refund['order_id'],
+                             refund.get('passenger_name'), refund.get('passenger_name'))
+                        )
+                        results.append(self.cursor.rowcount > 0)
+            except sqlite3.Error as e:
+                print(f"批量更新退票信息失败: {e}")
+                results = [None] * len(batch)
+            matched.extend(results)
+            self._invalidate_cache(changes)
+        return matched
+
+    def bulk_refund(self, refunds, batch_size=500):
+        """
+        批量更新退票信息，每批在一个事务中提交
+        :param refunds: 可迭代的退票信息字典，包含 order_id、service_fee 和可选的 passenger_name
+        :param batch_size: 每个事务更新的记录数
+        :return: int 匹配到车票的退票记录数
+        """
+        return sum(1 for matched in self.refund_tickets(refunds, batch_size) if matched)
+
+    def get_processed_messages(self, fingerprints, batch_size=500):
+        """
+        查询台账中已处理且内容未变化的邮件
+        :param fingerprints: 可迭代的 (Message-ID, 内容哈希)
+        :param batch_size: 每条查询语句包含的 Message-ID 数量
+        :return: set 已处理的 (Message-ID, 内容哈希)
+        """
+        fingerprints = set(fingerprints)
+        processed = set()
+        for batch in _batched(sorted(message_id for message_id, _ in fingerprints), batch_size):
+            try:
+                self.cursor.execute(
+                    f"SELECT message_id, content_hash FROM processed_messages "
+                    f"WHERE message_id IN ({', '.join('?' * len(batch))})",
+                    batch
+                )
+                processed.update(row for row in self.cursor.fetchall() if row in fingerprints)
+            except sqlite3.Error as e:
+                print(f"查询已处理邮件失败: {e}")
+        return processed
+
+    def mark_messages_processed(self, fingerprints, batch_size=500):
+        """
+        把邮件记入已处理台账，同一 Message-ID 内容变化时更新哈希
+        :param fingerprints: 可迭代的 (Message-ID, 内容哈希)
+        :param batch_size: 每个事务写入的记录数
+        :return: int 成功写入的记录数
+        """
+        written = 0
+        for batch in _batched(fingerprints, batch_size):
+            try:
+                with self.conn:
+                    self.cursor.executemany('''
+                    INSERT INTO processed_messages (message_id, content_hash) VALUES (?, ?)
+                    ON CONFLICT(message_id) DO UPDATE SET
+                        content_hash = excluded.content_hash,
+                        processed_at = CURRENT_TIMESTAMP
+                    ''', batch)
+                written += len(batch)
+            except sqlite3.Error as e:
+                print(f"写入已处理邮件台账失败: {e}")
+        return written
+
+    def get_data_version(self):
+        """
+        获取数据版本，tickets 表有任何变化时版本都会改变
+        :return: str 数据版本，查询失败时返回None
+        """
+        try:
+            self.cursor.execute('SELECT token, version FROM data_version')
+            row = self.cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"获取数据版本失败: {e}")
+            return None
+        if row is None:
+            return None
+        return f"{row[0]}-{row[1]}"
+
+    def _read_through(self, key, load):
+        """
+        先查询缓存，未命中时调用 load 查询数据库并写入缓存。数据版本在查询前读取，
+        查询期间有新的写入时结果只会比版本新，下次读取时版本不一致会重新查询
+        :param key: 缓存键，与数据库路径一起唯一确定一次查询
+        :param load: 无参函数，查询数据库，失败时抛出 sqlite3.Error
+        :return: 查询结果，在多次调用之间共享，调用方不要修改
+        """
+        version = self.get_data_version() if self.use_query_cache and query_cache.max_size > 0 else None
+        if version is None:
+            return load()
+        key = (self.db_path,) + key
+        result = query_cache.get(key, version, MISSING)
+        if result is MISSING:
+            result = load()
+            query_cache.set(key, version, result)
+        return result
+
+    def _invalidate_cache(self, changes):
+        """
+        本连接在 changes 之后修改过数据时清空查询缓存
+        :param changes: 写入前的 conn.total_changes
+        """
+        if self.conn.total_changes != changes:
+            query_cache.invalidate()
+
+    def get_sync_state(self, account, folder):
+        """
+        获取邮箱文件夹的增量同步状态
+        :param account: 邮箱账号
+        :param folder: 文件夹名称
+        :return: dict 包含 uidvalidity 和 last_uid，不存在时返回None
+        """
+        try:
+            self.cursor.execute('''
+            SELECT uidvalidity, last_uid FROM mail_sync_state
+            WHERE account = ? AND folder = ?
+            ''', (account, folder))
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            return {'uidvalidity': row[0], 'last_uid': row[1]}
+        except sqlite3.Error as e:
+            print(f"获取同步状态失败: {e}")
+            return None
+
+    def save_sync_state(self, account, folder, uidvalidity, last_uid):
+        """
+        保存邮箱文件夹的增量同步状态
+        :param account: 邮箱账号
+        :param folder: 文件夹名称
+        :param uidvalidity: 文件夹的UIDVALIDITY
+        :param last_uid: 已处理的最大UID
+        :return: bool 是否保存成功
+        """
+        try:
+            self.cursor.execute('''
+            INSERT INTO mail_sync_state (account, folder, uidvalidity, last_uid)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(account, folder) DO UPDATE SET
+                uidvalidity = excluded.uidvalidity,
+                last_uid = excluded.last_uid,
+                updated_at = CURRENT_TIMESTAMP
+            ''', (account, folder, uidvalidity, last_uid))
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"保存同步状态失败: {e}")
+            return False
+
     def get_all_tickets(self):
         """
         获取所有车票信息
         :return: list 车票信息列表
         """
-        try:
-            self.cursor.execute('''
+        def load():
+            cursor = self.conn.cursor()
+            cursor.row_factory = ticket_row_factory(TICKET_COLUMNS)
+            cursor.execute('''
             SELECT * FROM tickets 
             ORDER BY departure_time DESC
             ''')
-            
-            tickets = self.cursor.fetchall()
-            
-            if not tickets:
-                return []
-            
-            result = []
-            for row in tickets:
-                ticket = {
-                    'order_id': row[0],
-                    'passenger_name': row[1],
-                    'departure_time': row[2],
-                    'departure_station': row[3],
-                    'arrival_station': row[4],
-                    'train_number': row[5],
-                    'carriage_number': row[6],
-                    'seat_number': row[7],
-                    'seat_type': row[8],
-                    'price': row[9],
-                    'is_waiting': bool(row[10]),
-                    'is_refunded': bool(row[11]),
-                    'is_changed': bool(row[12]),
-                    'service_fee': row[13],
-                    'created_at': row[14],
-                    'updated_at': row[15]
-                }
-                result.append(ticket)
-            
-            return result
-                
+            return cursor.fetchall()
+
+        try:
+            return self._read_through(('all_tickets',), load)
         except sqlite3.Error as e:
             print(f"获取车票信息失败: {e}")
             return []
@@ -189,96 +735,177 @@ class TicketDB:
         :param end_date: 结束日期 (YYYY-MM-DD)
         :return: list 车票信息列表
         """
-        try:
-            self.cursor.execute('''
+        lower, upper = date_range_bounds(start_date, end_date)
+
+        def load():
+            cursor = self.conn.cursor()
+            cursor.row_factory = ticket_row_factory(TICKET_COLUMNS)
+            cursor.execute('''
             SELECT * FROM tickets 
-            WHERE DATE(departure_time) BETWEEN ? AND ?
+            WHERE departure_time >= ? AND departure_time < ?
             ORDER BY departure_time DESC
-            ''', (start_date, end_date))
-            
-            tickets = self.cursor.fetchall()
-            
-            if not tickets:
-                return []
-            
-            result = []
-            for row in tickets:
-                ticket = {
-                    'order_id': row[0],
-                    'passenger_name': row[1],
-                    'departure_time': row[2],
-                    'departure_station': row[3],
-                    'arrival_station': row[4],
-                    'train_number': row[5],
-                    'carriage_number': row[6],
-                    'seat_number': row[7],
-                    'seat_type': row[8],
-                    'price': row[9],
-                    'is_waiting': bool(row[10]),
-                    'is_refunded': bool(row[11]),
-                    'is_changed': bool(row[12]),
-                    'service_fee': row[13],
-                    'created_at': row[14],
-                    'updated_at': row[15]
-                }
-                result.append(ticket)
-            
-            return result
-                
+            ''', (lower, upper))
+            return cursor.fetchall()
+
+        try:
+            return self._read_through(('date_range', lower, upper), load)
         except sqlite3.Error as e:
             print(f"获取车票信息失败: {e}")
             return []
 
+    def query_tickets(self, limit=None, cursor=None, fields=None, passenger_name=None,
+                      train_number=None, status=None, start_date=None, end_date=None):
+        """
+        按条件分页查询车票信息，按出发时间倒序，使用 CURSOR_COLUMNS 作为分页游标
+        :param limit: 每页数量，为None时返回全部
+        :param cursor: 上一页返回的 next_cursor
+        :param fields: 需要返回的字段列表，为None时返回全部字段
+        :param passenger_name: 乘客姓名
+        :param train_number: 车次
+        :param status: 车票状态 normal / waiting / refunded
+        :param start_date: 开始日期 (YYYY-MM-DD)
+        :param end_date: 结束日期 (YYYY-MM-DD)
+        :return: tuple (车票信息列表, 下一页游标)，没有下一页时游标为None
+        """
+        fields = list(fields) if fields else list(TICKET_COLUMNS)
+        factory = ticket_row_factory(fields)
+        conditions, params = build_ticket_filters(passenger_name, train_number, status, start_date, end_date)
+
+        # 游标字段始终查询，放在最后几列
+        columns = fields + list(CURSOR_COLUMNS)
+        if cursor:
+            # 先用 departure_time 缩小范围以便使用索引，再按完整排序键比较
+            key = decode_cursor(cursor)
+            conditions.append(f"departure_time <= ? AND ({', '.join(CURSOR_COLUMNS)}) < ({', '.join('?' * len(key))})")
+            params.append(key[0])
+            params.extend(key)
+
+        sql = f"SELECT {', '.join(columns)} FROM tickets"
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ', '.join(f'{column} DESC' for column in CURSOR_COLUMNS)
+        if limit is not None:
+            # 多取一条用于判断是否还有下一页
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+
+        def load():
+            self.cursor.execute(sql, params)
+            rows = self.cursor.fetchall()
+            next_cursor = None
+            if limit is not None and len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1][-len(CURSOR_COLUMNS):])
+            return [factory(self.cursor, row) for row in rows], next_cursor
+
+        try:
+            return self._read_through(('query', sql, tuple(params)), load)
+        except sqlite3.Error as e:
+            print(f"查询车票信息失败: {e}")
+            return [], None
+
+    def iter_tickets(self, fields=None, passenger_name=None, train_number=None, status=None,
+                     start_date=None, end_date=None, as_dict=True, batch_size=500):
+        """
+        按出发时间倒序逐批读取符合条件的车票，用 fetchmany 分批取数，内存占用与车票总数无关。
+        参数在调用时立即校验；返回的生成器使用单独的数据库连接，可以依次在不同线程中迭代，
+        迭代结束或生成器关闭时释放连接
+        :param fields: 需要返回的字段列表，为None时返回全部字段
+        :param passenger_name: 乘客姓名
+        :param train_number: 车次
+        :param status: 车票状态 normal / waiting / refunded
+        :param start_date: 开始日期 (YYYY-MM-DD)
+        :param end_date: 结束日期 (YYYY-MM-DD)
+        :param as_dict: 为True时每张车票为字典，否则为按 fields 顺序的原始元组
+        :param batch_size: 每批读取的车票数量
+        :return: generator 依次产出车票列表
+        """
+        fields = list(fields) if fields else list(TICKET_COLUMNS)
+        factory = ticket_row_factory(fields)
+        conditions, params = build_ticket_filters(passenger_name, train_number, status, start_date, end_date)
+        sql = f"SELECT {', '.join(fields)} FROM tickets"
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ', '.join(f'{column} DESC' for column in CURSOR_COLUMNS)
+        return self._iter_batches(self.db_path, sql, params, factory if as_dict else None, batch_size)
+
+    @staticmethod
+    def _iter_batches(db_path, sql, params, factory, batch_size):
+        conn = _open_connection(db_path, check_same_thread=False)
+        try:
+            cursor = conn.cursor()
+            cursor.row_factory = factory
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
     def get_statistics(self):
         """
-        获取统计信息
+        获取统计信息，直接读取触发器维护的汇总表
         :return: dict 统计信息
         """
         try:
-            # 总车票数（不包括退票）
-            self.cursor.execute('''
-            SELECT COUNT(*) FROM tickets WHERE is_refunded = 0
-            ''')
-            total_tickets = self.cursor.fetchone()[0]
-            
-            # 候补车票数
-            self.cursor.execute('''
-            SELECT COUNT(*) FROM tickets WHERE is_waiting = 1 AND is_refunded = 0
-            ''')
-            waiting_tickets = self.cursor.fetchone()[0]
-            
-            # 总金额（不包括退票）
-            self.cursor.execute('''
-            SELECT SUM(price) FROM tickets WHERE is_refunded = 0
-            ''')
-            total_amount = self.cursor.fetchone()[0] or 0
-            
-            # 退票次数
-            self.cursor.execute('''
-            SELECT COUNT(*) FROM tickets WHERE is_refunded = 1
-            ''')
-            refund_count = self.cursor.fetchone()[0]
-            
-            # 总手续费
-            self.cursor.execute('''
-            SELECT SUM(service_fee) FROM tickets
-            ''')
-            total_fees = self.cursor.fetchone()[0] or 0
-            
-            return {
-                'total_tickets': total_tickets,
-                'waiting_tickets': waiting_tickets,
-                'total_amount': total_amount,
-                'refund_count': refund_count,
-                'total_fees': total_fees,
-                'avg_price': total_amount / total_tickets if total_tickets > 0 else 0,
-                'waiting_percentage': (waiting_tickets / total_tickets * 100) if total_tickets > 0 else 0
-            }
-                
+            return self._read_through(('statistics',), self._load_statistics)
         except sqlite3.Error as e:
             print(f"获取统计信息失败: {e}")
             return {}
 
+    def _load_statistics(self):
+        self.cursor.execute('''
+        SELECT dimension, key, ticket_count, waiting_count, refund_count, total_amount, total_fees
+        FROM ticket_aggregates
+        WHERE ticket_count > 0 OR refund_count > 0 OR dimension = 'total'
+        ''')
+        rows = self.cursor.fetchall()
+
+        total = {'ticket_count': 0, 'waiting_count': 0, 'refund_count': 0, 'total_amount': 0, 'total_fees': 0}
+        breakdowns = {'train': [], 'seat_type': [], 'month': [], 'route': []}
+        train_routes = {}
+        for dimension, key, ticket_count, waiting_count, refund_count, total_amount, total_fees in rows:
+            item = {
+                'ticket_count': ticket_count,
+                'waiting_count': waiting_count,
+                'refund_count': refund_count,
+                'total_amount': round(total_amount, 2),
+                'total_fees': round(total_fees, 2),
+                'avg_price': round(total_amount / ticket_count, 2) if ticket_count > 0 else 0
+            }
+            if dimension == 'total':
+                total = item
+            elif dimension == 'train_route':
+                if ticket_count > 0:
+                    train_number, route = key.split('|', 1)
+                    train_routes.setdefault(train_number, []).append(route)
+            else:
+                item[dimension] = key
+                breakdowns[dimension].append(item)
+
+        for item in breakdowns['train']:
+            item['routes'] = sorted(train_routes.get(item['train'], []))
+        for dimension in ('train', 'seat_type', 'route'):
+            breakdowns[dimension].sort(key=lambda item: item['ticket_count'], reverse=True)
+        breakdowns['month'].sort(key=lambda item: item['month'])
+
+        total_tickets = total['ticket_count']
+        return {
+            'total_tickets': total_tickets,
+            'waiting_tickets': total['waiting_count'],
+            'total_amount': total['total_amount'],
+            'refund_count': total['refund_count'],
+            'total_fees': total['total_fees'],
+            'avg_price': total['total_amount'] / total_tickets if total_tickets > 0 else 0,
+            'waiting_percentage': (total['waiting_count'] / total_tickets * 100) if total_tickets > 0 else 0,
+            'by_train': breakdowns['train'],
+            'by_seat_type': breakdowns['seat_type'],
+            'by_month': breakdowns['month'],
+            'by_route': breakdowns['route']
+        }
+
     def print_all_tickets(self):
         """
         打印所有车票信息
@@ -310,9 +937,15 @@ class TicketDB:
             print("-" * 50)
     
     def close(self):
-        self.conn.close()
+        """
+        释放游标，连接由当前线程复用，不在这里关闭
+        """
+        self.cursor.close()
 
 if __name__ == "__main__":
     db = TicketDB()
-    db.print_all_tickets()
-    db.close() 
\ No newline at end of file
+    try:
+        db.print_all_tickets()
+    finally:
+        db.close()
+        close_connections()
@@ -4,124 +4,169 @@ import json
 from collections import Counter
 from datetime import datetime
 
+# 车票信息各字段的正则表达式，模块加载时编译一次。
+# 大部分字段以固定文字开头，正则引擎可以直接跳到候选位置；座位号写成 \d+[A-Z]?号，
+# 与 \d+[A-Z]号|\d+号 匹配结果相同，但不会在每段数字上反复回溯。
+TICKET_PATTERNS = {
+    'order_id': re.compile(r'订单号码([A-Z0-9]+)'),
+    'passenger_name': re.compile(r'车票信息如下:\d+\.([^,]+)'),
+    'departure_time': re.compile(r'(\d{4})年(\d{2})月(\d{2})日(\d{2}):(\d{2})开'),
+    'route': re.compile(r'开,([^-]+)-([^,]+),'),
+    'train_number': re.compile(r'([A-Z0-9]+次列车)'),
+    'carriage_number': re.compile(r'(\d+车)'),
+    'seat_number': re.compile(r'(\d+[A-Z]?号|无座)'),
+    'seat_type': re.compile(r'(无座|硬座|硬卧|软卧|二等座|一等座|二等卧)'),
+    'price': re.compile(r'票价(\d+\.?\d*)元'),
+}
+
+# 多乘客订单中每位乘客占一段，以"序号.姓名,"开头并紧跟乘车时间
+PASSENGER_ENTRY_PATTERN = re.compile(r'(?<=[:.,])\d+\.([^,]+),(?=\d{4}年\d{2}月\d{2}日\d{2}:\d{2}开)')
+
+# 退票信息各字段的正则表达式
+REFUND_PATTERNS = {
+    'order_id': TICKET_PATTERNS['order_id'],
+    'passenger_name': TICKET_PATTERNS['passenger_name'],
+    'price': TICKET_PATTERNS['price'],
+    'refund_amount': re.compile(r'应退票款(\d+\.?\d*)元'),
+}
+
 def parse_ticket_info(text):
     """
     解析车票信息
     :param text: 邮件内容文本
     :return: dict 解析后的车票信息
     """
-    # 定义正则表达式模式
-    patterns = {
-        'order_id': r'订单号码([A-Z0-9]+)',
-        'passenger_name': r'车票信息如下:\d+\.([^,]+)',
-        'departure_time': r'(\d{4}年\d{2}月\d{2}日\d{2}:\d{2})开',
-        'route': r'开,([^-]+)-([^,]+),',
-        'train_number': r'([A-Z0-9]+次列车)',
-        'carriage_number': r'(\d+车)',
-        'seat_number': r'(\d+[A-Z]号|\d+号|无座)',
-        'seat_type': r'(无座|硬座|硬卧|软卧|二等座|一等座|二等卧)',
-        'price': r'票价(\d+\.?\d*)元',
-    }
+    patterns = TICKET_PATTERNS
     
     # 解析结果
     result = {}
     
     # 提取订单号
-    order_match = re.search(patterns['order_id'], text)
+    order_match = patterns['order_id'].search(text)
     if order_match:
         result['order_id'] = order_match.group(1)
     
     # 提取姓名
-    name_match = re.search(patterns['passenger_name'], text)
+    name_match = patterns['passenger_name'].search(text)
     if name_match:
         result['passenger_name'] = name_match.group(1)
     
-    # 提取乘车时间
-    time_match = re.search(patterns['departure_time'], text)
+    # 提取乘车时间，直接用各分组构造datetime，省去strptime的格式解析
+    time_match = patterns['departure_time'].search(text)
     if time_match:
-        time_str = time_match.group(1)
-        # 将中文日期格式转换为datetime对象
-        result['departure_time'] = datetime.strptime(time_str, '%Y年%m月%d日%H:%M')
+        result['departure_time'] = datetime(*map(int, time_match.groups()))
     
     # 提取路线
-    route_match = re.search(patterns['route'], text)
+    route_match = patterns['route'].search(text)
     if route_match:
         result['departure_station'] = route_match.group(1)
         result['arrival_station'] = route_match.group(2)
     
     # 提取车次
-    train_match = re.search(patterns['train_number'], text)
+    train_match = patterns['train_number'].search(text)
     if train_match:
         result['train_number'] = train_match.group(1)
     
     # 提取车厢号
-    carriage_match = re.search(patterns['carriage_number'], text)
+    carriage_match = patterns['carriage_number'].search(text)
     if carriage_match:
         result['carriage_number'] = carriage_match.group(1)
     
     # 提取座位号
-    seat_match = re.search(patterns['seat_number'], text)
-    if seat_match:
-        result['seat_number'] = seat_match.group(1)
-    else:
-        result['seat_number'] = ''
+    seat_match = patterns['seat_number'].search(text)
+    result['seat_number'] = seat_match.group(1) if seat_match else ''
     
     # 提取座位类型
-    seat_type_match = re.search(patterns['seat_type'], text)
-    if seat_type_match:
-        result['seat_type'] = seat_type_match.group(1)
-    else:
-        result['seat_type'] = ''
+    seat_type_match = patterns['seat_type'].search(text)
+    result['seat_type'] = seat_type_match.group(1) if seat_type_match else ''
     
     # 提取票价
-    price_match = re.search(patterns['price'], text)
-    if price_match:
-        result['price'] = float(price_match.group(1))
-    else:
-        result['price'] = 0.0
+    price_match = patterns['price'].search(text)
+    result['price'] = float(price_match.group(1)) if price_match else 0.0
     
     return result
 
+def parse_ticket_infos(text):
+    """
+    解析车票信息，一个订单包含多位乘客时每位乘客返回一条记录
+    :param text: 邮件内容文本
+    :return: list 解析后的车票信息列表
+    """
+    entries = list(PASSENGER_ENTRY_PATTERN.finditer(text))
+    if len(entries) <= 1:
+        return [parse_ticket_info(text)]
+
+    # 订单号所有乘客共用，其余字段只在各自的乘客段内查找
+    common = {}
+    order_match = TICKET_PATTERNS['order_id'].search(text)
+    if order_match:
+        common['order_id'] = order_match.group(1)
+
+    results = []
+    ends = [entry.start() for entry in entries[1:]] + [len(text)]
+    for entry, end in zip(entries, ends):
+        ticket_info = dict(common)
+        ticket_info['passenger_name'] = entry.group(1)
+        ticket_info.update(parse_ticket_info(text[entry.start():end]))
+        results.append(ticket_info)
+    return results
+
 def parse_refund_info(text):
     """
     解析退票信息
     :param text: 邮件内容文本
     :return: dict 解析后的退票信息
     """
-    # 定义正则表达式模式
-    patterns = {
-        'order_id': r'订单号码([A-Z0-9]+)',
-        'price': r'票价(\d+\.?\d*)元',
-        'refund_amount': r'应退票款(\d+\.?\d*)元'
-    }
+    patterns = REFUND_PATTERNS
     
     # 解析结果
     result = {}
     
     # 提取订单号
-    order_match = re.search(patterns['order_id'], text)
+    order_match = patterns['order_id'].search(text)
     if order_match:
         result['order_id'] = order_match.group(1)
     
+    # 提取姓名，多乘客订单只退其中一位乘客时用于定位车票
+    name_match = patterns['passenger_name'].search(text)
+    if name_match:
+        result['passenger_name'] = name_match.group(1)
+    
     # 提取票价
-    price_match = re.search(patterns['price'], text)
-    if price_match:
-        result['price'] = float(price_match.group(1))
-    else:
-        result['price'] = 0.0
+    price_match = patterns['price'].search(text)
+    result['price'] = float(price_match.group(1)) if price_match else 0.0
     
     # 提取应退票款
-    refund_match = re.search(patterns['refund_amount'], text)
-    if refund_match:
-        result['refund_amount'] = float(refund_match.group(1))
-    else:
-        result['refund_amount'] = 0.0
+    refund_match = patterns['refund_amount'].search(text)
+    result['refund_amount'] = float(refund_match.group(1)) if refund_match else 0.0
     
     # 计算手续费（票价减去应退票款）
     result['service_fee'] = result['price'] - result['refund_amount']
     
     return result
 
+def parse_refund_infos(text):
+    """
+    解析退票信息，一封退票邮件包含多位乘客时每位乘客返回一条记录，各自带有乘客姓名和手续费
+    :param text: 邮件内容文本
+    :return: list 解析后的退票信息列表
+    """
+    entries = list(PASSENGER_ENTRY_PATTERN.finditer(text))
+    if len(entries) <= 1:
+        return [parse_refund_info(text)]
+
+    # 订单号所有乘客共用，票价和应退票款只在各自的乘客段内查找
+    order_match = REFUND_PATTERNS['order_id'].search(text)
+    results = []
+    ends = [entry.start() for entry in entries[1:]] + [len(text)]
+    for entry, end in zip(entries, ends):
+        refund_info = parse_refund_info(text[entry.start():end])
+        if order_match:
+            refund_info['order_id'] = order_match.group(1)
+        refund_info['passenger_name'] = entry.group(1)
+        results.append(refund_info)
+    return results
+
 def validate_ticket_info(ticket_info):
     """
     验证车票信息的完整性
@@ -140,43 +185,42 @@ def validate_ticket_info(ticket_info):
     
     return True
 
+# 邮件正文中在这些提示语之后的内容与车票无关
+UNWANTED_KEYWORDS = ("温馨提示", "为了确保", "按购票时所使用在线支付工具的有关规定")
+
+# 中文标点替换为英文标点，同时删除空格。
+# 对中文文本 str.translate 要逐字符查表，比几次 str.replace 慢一个数量级，因此保留 replace
+PUNCTUATION_REPLACEMENTS = (
+    ("，", ","),
+    ("：", ":"),
+    ("。", "."),
+    ("―", "-"),
+    (" ", ""),
+)
+
 def clean_text_content(text):
     """
     清理文本内容，去除多余字符
     :param text: 原始文本
     :return: str 清理后的文本
     """
-    # 删除不需要的部分
-    unwanted_keywords = [
-        "温馨提示", 
-        "为了确保", 
-        "按购票时所使用在线支付工具的有关规定"
-    ]
-    
-    for keyword in unwanted_keywords:
-        if keyword in text:
-            text = text.split(keyword)[0]
-    
-    # 截取从"订单号码"开始的部分
-    if "订单号码" in text:
-        text = "订单号码" + text.split("订单号码")[1]
+    # 删除不需要的部分，在最早出现的提示语处截断
+    cut = len(text)
+    for keyword in UNWANTED_KEYWORDS:
+        position = text.find(keyword, 0, cut)
+        if position != -1:
+            cut = position
+    
+    # 截取从第一个"订单号码"到下一个"订单号码"之间的部分
+    start = text.find("订单号码", 0, cut)
+    if start != -1:
+        end = text.find("订单号码", start + 4, cut)
+        text = text[start:end if end != -1 else cut]
+    else:
+        text = text[:cut]
 
-    # 替换中文标点为英文标点，并去除空格
-    replace_map = {
-        "，": ",",
-        "：": ":",
-        "。": ".",
-        "―": "-",
-    }
-    for old, new in replace_map.items():
+    # 替换中文标点为英文标点，并去除所有空格
+    # 乘客过滤在解析后按每位乘客进行，这里不再按姓名截取
+    for old, new in PUNCTUATION_REPLACEMENTS:
         text = text.replace(old, new)
-    
-    # 去除所有空格
-    text = text.replace(" ", "")
-
-    # 保留"温阳光"之前和之后到"票价"部分的内容
-    match = re.search(r"(.*温阳光.*?票价[\d\.]+元)", text)
-    if match:
-        text = match.group(0)
-
-    return text 
\ No newline at end of file
+    return text
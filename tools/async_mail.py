@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+多邮箱账号异步同步
+
+IMAP 读取和数据库写入都是阻塞操作，这里把每个账号的同步放到一个有界线程池中执行，
+事件循环只负责调度，因此同步期间 API 仍可正常响应。并发量同时受全局连接数
+(MAIL_CONFIG["max_connections"]) 和各服务商连接数 (EMAIL_PROVIDERS[...]["max_connections"]) 限制。
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from tools.mail import sync_account
+from config import EMAIL_ACCOUNTS, EMAIL_PROVIDERS, MAIL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+def get_provider(account):
+    """
+    获取账号所属的邮箱服务商
+    :param account: 邮箱账号配置
+    :return: str EMAIL_PROVIDERS 中的服务商名称，无法识别时返回 IMAP 服务器地址
+    """
+    if account.get("provider"):
+        return account["provider"]
+    for name, provider in EMAIL_PROVIDERS.items():
+        if provider["imap_host"] == account.get("imap_host"):
+            return name
+    return account.get("imap_host", "")
+
+class AsyncMailPool:
+    def __init__(self, max_connections=None):
+        """
+        初始化异步邮件同步池
+        :param max_connections: 同时打开的IMAP连接上限
+        """
+        self.max_connections = max_connections or MAIL_CONFIG.get("max_connections", 8)
+        self.executor = None
+        self.provider_semaphores = {}
+        self.start()
+
+    def start(self):
+        """
+        创建线程池并重置各服务商的信号量；close 之后再次调用可以重新使用，如应用在同一进程中再次启动。
+        asyncio.Semaphore 绑定首次使用它的事件循环，新的事件循环中需要新的信号量
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix="mail-sync")
+        self.provider_semaphores = {}
+
+    def get_provider_semaphore(self, provider):
+        """
+        获取服务商对应的并发限制信号量
+        :param provider: 服务商名称
+        :return: asyncio.Semaphore
+        """
+        if provider not in self.provider_semaphores:
+            limit = EMAIL_PROVIDERS.get(provider, {}).get("max_connections", self.max_connections)
+            self.provider_semaphores[provider] = asyncio.Semaphore(limit)
+        return self.provider_semaphores[provider]
+
+    async def sync_account(self, account):
+        """
+        异步同步单个邮箱账号
+        :param account: 邮箱账号配置
+        :return: dict 处理结果统计
+        """
+        provider = get_provider(account)
+        async with self.get_provider_semaphore(provider):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, sync_account, account)
+
+    async def sync_all(self, accounts=None):
+        """
+        并发同步多个邮箱账号
+        :param accounts: 邮箱账号配置列表，默认为 EMAIL_ACCOUNTS
+        :return: list 每个账号的同步结果，连接失败、有邮件获取失败或写入数据库失败时 status 为 error
+        """
+        accounts = accounts if accounts is not None else EMAIL_ACCOUNTS
+        results = await asyncio.gather(
+            *(self.sync_account(account) for account in accounts),
+            return_exceptions=True
+        )
+
+        summary = []
+        for account, result in zip(accounts, results):
+            if isinstance(result, Exception):
+                logger.error(f"同步邮箱 {account.get('email_user')} 失败: {result}")
+                summary.append({"account": account.get("email_user"), "status": "error", "error": str(result)})
+            elif result.get("failed_messages") or result.get("write_failures"):
+                # 部分邮件获取或写入失败时同步位置没有越过这些邮件，按失败处理以便调度器尽快重试
+                errors = []
+                if result.get("failed_messages"):
+                    errors.append(f"{result['failed_messages']} 封邮件获取失败")
+                if result.get("write_failures"):
+                    errors.append(f"{result['write_failures']} 条记录写入数据库失败")
+                error = "，".join(errors)
+                logger.error(f"同步邮箱 {account.get('email_user')} 未完成: {error}")
+                summary.append({"account": account.get("email_user"), "status": "error", "error": error, "stats": result})
+            else:
+                summary.append({"account": account.get("email_user"), "status": "success", "stats": result})
+        return summary
+
+    def close(self, wait=False):
+        """
+        关闭线程池
+        :param wait: 是否等待进行中的同步结束
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+历史邮件全量回填
+
+全量回填时邮件解码、HTML 清理和正则解析都是 CPU 密集操作，串行执行时 IMAP 连接大部分时间处于空闲。
+这里把回填拆成三段流水线：
+    读取线程 -- 按批次 UID FETCH 原始邮件字节
+    进程池   -- 解码、清理并解析车票信息 (parse_batch)
+    写入线程 -- 按批次写入数据库
+各阶段之间使用有界队列，下游处理不过来时上游自动阻塞，内存占用与邮件总数无关。
+
+用法:
+    python -m tools.backfill --workers 4
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from tools.mail import (
+    MailReader, message_fingerprint, parse_raw_message, extract_ticket_records, write_ticket_records, sync_high_water_mark
+)
+from ticket.models import TicketDB, close_connections
+from config import EMAIL_CONFIG, EMAIL_ACCOUNTS, MAIL_FETCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_DONE = object()
+# 队列读写的轮询间隔（秒），流水线停止后阻塞在队列上的线程在该时间内退出
+_POLL_INTERVAL = 0.1
+
+def parse_batch(raw_batch):
+    """
+    在子进程中解析一批原始邮件
+    :param raw_batch: list [(UID, 原始邮件字节, 邮件指纹), ...]
+    :return: dict 包含 tickets、refunds、processed、errors、decode_paths 和 messages，
+             messages 为 [(邮件指纹, 车票数, 退票数), ...]，解析失败的邮件指纹为None，见 write_ticket_records
+    """
+    result = {'tickets': [], 'refunds': [], 'processed': 0, 'errors': 0, 'decode_paths': Counter(), 'messages': []}
+    for _, raw_email, fingerprint in raw_batch:
+        try:
+            email_info = parse_raw_message(raw_email, result['decode_paths'])
+            if email_info is None:
+                result['errors'] += 1
+                continue
+            tickets, refunds, errors = extract_ticket_records(email_info)
+        except Exception as e:
+            logger.error(f"解析邮件失败: {e}")
+            result['errors'] += 1
+            continue
+        result['tickets'].extend(tickets)
+        result['refunds'].extend(refunds)
+        result['errors'] += errors
+        result['processed'] += 1
+        result['messages'].append((fingerprint if not errors else None, len(tickets), len(refunds)))
+    return result
+
+class BackfillPipeline:
+    def __init__(self, account=None, workers=None, batch_size=None, queue_size=None, db_name=None):
+        """
+        初始化回填流水线
+        :param account: 邮箱账号配置，格式同 EMAIL_CONFIG，默认为 EMAIL_CONFIG
+        :param workers: 解析进程数，默认为CPU核数
+        :param batch_size: 每次 UID FETCH 和每个解析任务的邮件数量
+        :param queue_size: 各阶段之间队列的最大批次数
+        :param db_name: 数据库文件路径
+        """
+        self.account = account or EMAIL_CONFIG
+        self.workers = workers or MAIL_FETCH_CONFIG.get("backfill_workers") or os.cpu_count() or 1
+        self.batch_size = batch_size or MAIL_FETCH_CONFIG.get("batch_size") or 200
+        self.queue_size = queue_size or MAIL_FETCH_CONFIG.get("backfill_queue_size", 8)
+        self.db_name = db_name
+        self.stats = {
+            'messages': 0,
+            'skipped_unchanged': 0,
+            'total_processed': 0,
+            'tickets_added': 0,
+            'refunds_processed': 0,
+            'errors': 0,
+            'write_failures': 0,
+            'decode_paths': Counter()
+        }
+        self.mail_reader = None
+        self.reader_error = None
+        self.writer_error = None
+        # 写入线程失败或主线程被中断时设置，各阶段不再等待队列，尽快退出
+        self.stop_event = threading.Event()
+
+    def _put(self, q, item):
+        """
+        放入队列，队列已满时等待，流水线停止后放弃
+        :return: bool 是否放入成功
+        """
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """
+        从队列取出，队列为空时等待，流水线停止后返回结束标记
+        """
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def read_stage(self, raw_queue):
+        """
+        读取阶段：搜索全部邮件并按批次把原始邮件放入队列
+        """
+        account = self.account
+        self.mail_reader = MailReader(
+            imap_host=account.get("imap_host"),
+            email_user=account.get("email_user"),
+            email_pwd=account.get("email_pwd"),
+            imap_port=account.get("imap_port")
+        )
+        mail_reader = self.mail_reader
+        folder_name = account.get("folder_name") or EMAIL_CONFIG["folder_name"]
+        db = TicketDB(self.db_name) if MAIL_FETCH_CONFIG.get("dedup", True) else None
+        try:
+            mail_reader.connect()
+            mail_reader.login()
+            uidvalidity = mail_reader.select_folder(folder_name)
+            email_ids = mail_reader.search_emails(fetch_all=True)
+            if MAIL_FETCH_CONFIG.get("header_prefilter", False):
+                ticket_ids = mail_reader.filter_ticket_emails(email_ids)
+            else:
+                ticket_ids = email_ids
+
+            for batch in mail_reader.fetch_raw_batches(ticket_ids, self.batch_size):
+                self.stats['messages'] += len(batch)
+                batch = [(uid, raw_email, message_fingerprint(raw_email)) for uid, raw_email in batch]
+                if db is not None:
+                    # 台账中内容未变化的邮件不再交给解析进程
+                    processed = db.get_processed_messages([item[2] for item in batch])
+                    if processed:
+                        self.stats['skipped_unchanged'] += sum(1 for item in batch if item[2] in processed)
+                        batch = [item for item in batch if item[2] not in processed]
+                if batch and not self._put(raw_queue, batch):
+                    return
+
+            if mail_reader.failed_ids:
+                logger.error(f"{len(mail_reader.failed_ids)} 封邮件获取失败，同步位置不会越过这些邮件")
+            if uidvalidity is not None and email_ids:
+                mail_reader.sync_state = {
+                    'folder': folder_name,
+                    'uidvalidity': uidvalidity,
+                    'last_uid': sync_high_water_mark(email_ids, mail_reader.failed_ids)
+                }
+        except Exception as e:
+            logger.error(f"回填读取邮件失败: {e}")
+            self.reader_error = e
+        finally:
+            self._put(raw_queue, _DONE)
+            if db is not None:
+                db.close()
+            try:
+                mail_reader.imap_client.logout()
+            except Exception:
+                pass
+
+    def write_stage(self, result_queue):
+        """
+        写入阶段：累积解析结果，按批次写入数据库
+        退票只在其之前的车票全部写入后执行，保证能找到对应的车票；有记录写入失败时设置 writer_error
+        """
+        db = TicketDB(self.db_name)
+        tickets = []
+        refunds = []
+        messages = []
+
+        def flush():
+            written, refunded, failed = write_ticket_records(db, tickets, refunds, messages, self.batch_size)
+            self.stats['tickets_added'] += written
+            self.stats['refunds_processed'] += refunded
+            self.stats['write_failures'] += failed
+            self.stats['errors'] += len(tickets) - written + len(refunds) - refunded
+            tickets.clear()
+            refunds.clear()
+            messages.clear()
+
+        try:
+            while True:
+                result = self._get(result_queue)
+                if result is _DONE:
+                    break
+                self.stats['total_processed'] += result['processed']
+                self.stats['errors'] += result['errors']
+                self.stats['decode_paths'].update(result['decode_paths'])
+                tickets.extend(result['tickets'])
+                refunds.extend(result['refunds'])
+                messages.extend(result['messages'])
+                if len(tickets) + len(refunds) + len(messages) >= self.batch_size:
+                    flush()
+            if messages:
+                flush()
+            if self.stats['write_failures']:
+                # 部分记录写入失败时继续写入其余批次，但按写入失败处理，不保存同步位置
+                self.writer_error = RuntimeError(f"{self.stats['write_failures']} 条记录写入数据库失败")
+                logger.error(f"回填写入数据库失败: {self.writer_error}")
+        except Exception as e:
+            # 写入失败时停止流水线，读取线程和主线程不再阻塞在队列上
+            logger.error(f"回填写入数据库失败: {e}")
+            self.writer_error = e
+            self.stop_event.set()
+        finally:
+            db.close()
+
+    def run(self):
+        """
+        执行回填
+        :return: dict 处理结果统计
+        """
+        raw_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue(maxsize=self.queue_size)
+        reader = threading.Thread(target=self.read_stage, args=(raw_queue,), name="backfill-reader", daemon=True)
+        writer = threading.Thread(target=self.write_stage, args=(result_queue,), name="backfill-writer", daemon=True)
+
+        start = time.perf_counter()
+        reader.start()
+        writer.start()
+        try:
+            # 读取和写入线程已经启动，fork 会把线程持有的锁复制到子进程，这里使用 spawn 启动解析进程；
+            # 子进程沿用主进程通过 logging.disable 设置的日志级别
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=logging.disable, initargs=(logging.root.manager.disable,)) as pool:
+                # 按提交顺序取回结果，保证退票在对应的购票之后写入；
+                # 进行中的任务数有上限，解析跟不上时读取线程会在 raw_queue 上阻塞
+                pending = deque()
+                while True:
+                    batch = self._get(raw_queue)
+                    if batch is _DONE:
+                        break
+                    pending.append((len(batch), pool.submit(parse_batch, batch)))
+                    while len(pending) >= self.workers * 2:
+                        self._collect(pending.popleft(), result_queue)
+                while pending and not self.stop_event.is_set():
+                    self._collect(pending.popleft(), result_queue)
+                for _, future in pending:
+                    future.cancel()
+        except BaseException:
+            # 包括 KeyboardInterrupt：通知读取和写入线程退出，避免 join 时互相等待
+            self.stop_event.set()
+            raise
+        finally:
+            self._put(result_queue, _DONE)
+            reader.join()
+            writer.join()
+
+        # 获取失败的邮件计入错误，统计在两个线程都结束后更新
+        self.stats['errors'] += len(self.mail_reader.failed_ids)
+        # 读取和写入都成功时才保存同步位置
+        if self.reader_error is None and self.writer_error is None:
+            db = TicketDB(self.db_name)
+            try:
+                self.mail_reader.commit_sync_state(db)
+            finally:
+                db.close()
+
+        elapsed = time.perf_counter() - start
+        stats = dict(self.stats, decode_paths=dict(self.stats['decode_paths']))
+        stats['elapsed'] = round(elapsed, 3)
+        stats['messages_per_second'] = round(stats['messages'] / elapsed, 1) if elapsed > 0 else 0
+        logger.info(f"{self.mail_reader.email_user} 回填完成 - 邮件: {stats['messages']}, 跳过已处理: {stats['skipped_unchanged']}, 新增车票: {stats['tickets_added']}, "
+                    f"退票处理: {stats['refunds_processed']}, 错误: {stats['errors']}, "
+                    f"耗时: {stats['elapsed']}s ({stats['messages_per_second']} 封/秒)")
+        return stats
+
+    def _collect(self, item, result_queue):
+        count, future = item
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"解析进程执行失败: {e}")
+            # 统计只由写入线程更新，失败的批次也通过队列交给写入线程计数
+            result = {'tickets': [], 'refunds': [], 'processed': 0, 'errors': count, 'decode_paths': Counter(),
+                      'messages': []}
+        self._put(result_queue, result)
+
+def backfill_account(account=None, workers=None, batch_size=None, queue_size=None, db_name=None):
+    """
+    全量回填单个邮箱账号
+    :return: dict 处理结果统计
+    """
+    return BackfillPipeline(account, workers, batch_size, queue_size, db_name).run()
+
+def main():
+    parser = argparse.ArgumentParser(description="全量回填历史车票邮件")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数，默认为CPU核数")
+    parser.add_argument("--batch-size", type=int, default=None, help="每批邮件数量")
+    parser.add_argument("--queue-size", type=int, default=None, help="各阶段之间队列的最大批次数")
+    args = parser.parse_args()
+
+    try:
+        for account in EMAIL_ACCOUNTS:
+            backfill_account(account, args.workers, args.batch_size, args.queue_size)
+    finally:
+        close_connections()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+离线邮件导入
+
+从本地 mbox 文件、Maildir 目录或 .eml 文件导入12306通知邮件，解析和写入与 IMAP 同步共用
+parse_raw_message -> process_ticket_emails 流程。适合不受服务商限速地回填多年的历史邮件，
+也可以在没有网络的环境中复现和测量整个导入流程。
+
+用法:
+    python -m tools.mail import ~/mail/12306.mbox ~/Maildir/12306 ./exported/*.eml
+"""
+
+import logging
+import mmap
+import os
+import time
+from collections import Counter
+from email.parser import BytesHeaderParser
+from itertools import islice
+from tools.mail import (
+    TICKET_SUBJECTS, decode_header_field, message_fingerprint, parse_raw_message, process_ticket_emails
+)
+from ticket.models import TicketDB
+from config import MAIL_FETCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# mbox 中每封邮件以行首的 "From " 分隔
+MBOX_SEPARATOR = b"\nFrom "
+
+def iter_mbox_messages(path):
+    """
+    逐封读取 mbox 文件，通过 mmap 按需分页读入，不需要把整个文件读进内存
+    :param path: mbox 文件路径
+    :return: generator 依次产出原始邮件字节
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0 if mm[:5] == b"From " else mm.find(MBOX_SEPARATOR)
+            while start != -1:
+                # 跳过 "From " 分隔行
+                body_start = mm.find(b"\n", start + 1)
+                if body_start == -1:
+                    return
+                end = mm.find(MBOX_SEPARATOR, body_start)
+                yield mm[body_start + 1:end if end != -1 else len(mm)]
+                start = end
+
+def iter_maildir_messages(path):
+    """
+    读取 Maildir 目录下 cur 和 new 中的邮件
+    :param path: Maildir 目录路径
+    :return: generator 依次产出原始邮件字节
+    """
+    for sub_dir in ("cur", "new"):
+        directory = os.path.join(path, sub_dir)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("."):
+                continue
+            with open(os.path.join(directory, name), "rb") as f:
+                yield f.read()
+
+def iter_eml_messages(path):
+    """
+    读取目录下的所有 .eml 文件，path 为文件时只读取该文件
+    :param path: .eml 文件或目录路径
+    :return: generator 依次产出原始邮件字节
+    """
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            yield f.read()
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".eml"):
+                with open(os.path.join(root, name), "rb") as f:
+                    yield f.read()
+
+def iter_raw_messages(paths):
+    """
+    根据路径类型选择读取方式：含 cur/new 的目录按 Maildir 读取，其他目录和 .eml 文件按 .eml 读取，
+    其余文件按 mbox 读取
+    :param paths: 路径列表
+    :return: generator 依次产出原始邮件字节
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            if os.path.isdir(os.path.join(path, "cur")) or os.path.isdir(os.path.join(path, "new")):
+                yield from iter_maildir_messages(path)
+            else:
+                yield from iter_eml_messages(path)
+        elif path.lower().endswith(".eml"):
+            yield from iter_eml_messages(path)
+        elif os.path.isfile(path):
+            yield from iter_mbox_messages(path)
+        else:
+            logger.warning(f"路径不存在: {path}")
+
+def import_messages(paths, db=None):
+    """
+    导入本地邮件中的车票信息，只完整解析主题为12306通知的邮件
+    :param paths: mbox 文件、Maildir 目录或 .eml 文件/目录的路径列表
+    :param db: 数据库对象，未传入时自动创建并在结束后关闭
+    :return: dict 处理结果统计，包含邮件数量、耗时和吞吐量
+    """
+    own_db = db is None
+    if own_db:
+        db = TicketDB()
+
+    header_parser = BytesHeaderParser()
+    decode_stats = Counter()
+    counts = {'messages': 0, 'ticket_messages': 0, 'skipped_unchanged': 0, 'bytes': 0}
+    dedup = MAIL_FETCH_CONFIG.get("dedup", True)
+    batch_size = MAIL_FETCH_CONFIG.get("batch_size") or 200
+
+    def ticket_emails():
+        raw_messages = iter_raw_messages(paths)
+        while True:
+            batch = list(islice(raw_messages, batch_size))
+            if not batch:
+                return
+            counts['messages'] += len(batch)
+            counts['bytes'] += sum(len(raw_email) for raw_email in batch)
+            fingerprints = [message_fingerprint(raw_email) for raw_email in batch]
+            # 台账中内容未变化的邮件直接跳过
+            processed = db.get_processed_messages(fingerprints) if dedup else set()
+            for raw_email, fingerprint in zip(batch, fingerprints):
+                if fingerprint in processed:
+                    counts['skipped_unchanged'] += 1
+                    continue
+                # 先只解析邮件头，非车票通知邮件不解码正文
+                subject = decode_header_field(header_parser.parsebytes(raw_email)["subject"])
+                if subject not in TICKET_SUBJECTS:
+                    continue
+                email_info = parse_raw_message(raw_email, decode_stats)
+                if email_info:
+                    email_info['fingerprint'] = fingerprint
+                    counts['ticket_messages'] += 1
+                    yield email_info
+
+    start = time.perf_counter()
+    try:
+        stats = process_ticket_emails(ticket_emails(), db)
+    finally:
+        if own_db:
+            db.close()
+    elapsed = time.perf_counter() - start
+
+    stats.update(counts)
+    stats['decode_paths'] = dict(decode_stats)
+    stats['elapsed'] = round(elapsed, 3)
+    stats['messages_per_second'] = round(counts['messages'] / elapsed, 1) if elapsed > 0 else 0
+    stats['mb_per_second'] = round(counts['bytes'] / 1024 / 1024 / elapsed, 2) if elapsed > 0 else 0
+    logger.info(f"导入完成 - 邮件: {counts['messages']}, 车票通知: {counts['ticket_messages']}, "
+                f"跳过已处理: {counts['skipped_unchanged']}, "
+                f"新增车票: {stats['tickets_added']}, 退票处理: {stats['refunds_processed']}, 错误: {stats['errors']}, "
+                f"耗时: {stats['elapsed']}s ({stats['messages_per_second']} 封/秒, {stats['mb_per_second']} MB/秒)")
+    return stats
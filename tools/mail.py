@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
+import argparse
 import email
+import hashlib
 import imaplib
 from email.header import decode_header
+from email.parser import BytesHeaderParser
 import chardet
 import re
 import json
-from bs4 import BeautifulSoup
 import logging
-from ticket.ticket_parser import parse_ticket_info, parse_refund_info, clean_text_content, validate_ticket_info
-from ticket.models import TicketDB
-from config import EMAIL_CONFIG, PASSENGER_FILTER, MAIL_CONFIG, MAIL_FETCH_CONFIG
+from collections import Counter
+from html.parser import HTMLParser
+from ticket.ticket_parser import parse_ticket_infos, parse_refund_infos, clean_text_content, validate_ticket_info
+from ticket.models import TicketDB, close_connections
+from config import EMAIL_CONFIG, EMAIL_ACCOUNTS, PASSENGER_FILTER, MAIL_CONFIG, MAIL_FETCH_CONFIG
+
+# 需要处理的12306通知邮件主题
+PAYMENT_SUBJECT = "网上购票系统-用户支付通知"
+WAITING_SUBJECT = "网上购票系统-候补订单兑现成功通知"
+REFUND_SUBJECT = "网上购票系统-用户退票通知"
+TICKET_SUBJECTS = frozenset([PAYMENT_SUBJECT, WAITING_SUBJECT, REFUND_SUBJECT])
 
 # 配置日志
 logging.basicConfig(
@@ -18,40 +28,272 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def remove_html_tags_and_whitespace(html_content):
+# BeautifulSoup 为可选依赖，仅在 MAIL_FETCH_CONFIG["html_extractor"] 为 "bs4" 时使用
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+class HTMLTextExtractor(HTMLParser):
+    """
+    基于 html.parser 的流式文本提取器，不构建文档树，跳过脚本、样式和模板内容
+    """
+    SKIP_TAGS = frozenset(['script', 'style', 'template'])
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def unknown_decl(self, data):
+        # 与 BeautifulSoup 一致，保留 CDATA 中的文本
+        if data.startswith('CDATA[') and not self.skip_depth:
+            self.parts.append(data[6:])
+
+def html_to_text(html_content):
+    """
+    提取HTML中的文本
+    :param html_content: HTML内容
+    :return: str 未处理空白的文本
+    """
+    extractor = HTMLTextExtractor()
+    extractor.feed(html_content)
+    extractor.close()
+    return ''.join(extractor.parts)
+
+def remove_html_tags_and_whitespace(html_content, extractor=None):
     """
     去除HTML标签和空白字符
     :param html_content: HTML内容
+    :param extractor: 文本提取方式 builtin 或 bs4，默认读取 MAIL_FETCH_CONFIG["html_extractor"]
     :return: str 清理后的文本
     """
-    # 使用 BeautifulSoup 去除 HTML 标签
-    soup = BeautifulSoup(html_content, 'html.parser')
-    text = soup.get_text()
+    extractor = extractor or MAIL_FETCH_CONFIG.get("html_extractor", "builtin")
+    if extractor == "bs4" and BeautifulSoup is not None:
+        text = BeautifulSoup(html_content, 'html.parser').get_text()
+    else:
+        text = html_to_text(html_content)
     
     # 去除所有空格、换行符和制表符
-    clean_text = re.sub(r'\s+', ' ', text).strip()
-    
-    return clean_text
+    return ' '.join(text.split())
+
+# 邮件未声明编码或声明的编码解码失败时依次尝试的编码，12306 邮件基本都是 UTF-8 或 GBK
+FALLBACK_CHARSETS = ('utf-8', 'gb18030')
+
+# gb2312/gbk 声明的邮件常含超出字符集的生僻字，统一按兼容的 gb18030 解码
+CHARSET_ALIASES = {
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+}
+
+def decode_payload(payload, charset=None, stats=None):
+    """
+    解码邮件正文：优先使用邮件声明的编码，其次尝试常见编码，最后才用 chardet 检测
+    :param payload: 邮件正文字节
+    :param charset: 邮件部分声明的编码，即 part.get_content_charset()
+    :param stats: Counter，记录各解码路径 (charset / fallback / chardet) 的使用次数
+    :return: str 解码后的文本
+    """
+    if not payload:
+        return ""
+    stats = stats if stats is not None else Counter()
+
+    if charset:
+        try:
+            text = payload.decode(CHARSET_ALIASES.get(charset.lower(), charset))
+            stats['charset'] += 1
+            return text
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    for encoding in FALLBACK_CHARSETS:
+        try:
+            text = payload.decode(encoding)
+            stats['fallback'] += 1
+            return text
+        except UnicodeDecodeError:
+            pass
+
+    stats['chardet'] += 1
+    detected_encoding = chardet.detect(payload)['encoding'] or 'utf-8'
+    return payload.decode(detected_encoding, errors='ignore')
+
+def build_message_set(email_ids):
+    """
+    将UID列表压缩为IMAP消息集，连续的UID合并为区间
+    :param email_ids: 邮件UID列表
+    :return: str 形如 "1:200,205,210:212" 的消息集
+    """
+    uids = sorted(int(uid) for uid in email_ids)
+    ranges = []
+    for uid in uids:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+def decode_header_field(header_value):
+    """
+    解码邮件头字段
+    :param header_value: 邮件头值
+    :return: str 解码后的值
+    """
+    if not header_value:
+        return ""
+    try:
+        decoded_value, encoding = decode_header(header_value)[0]
+        if isinstance(decoded_value, bytes):
+            return decoded_value.decode(encoding if encoding else 'utf-8')
+        return decoded_value
+    except Exception as e:
+        logger.error(f"解码邮件头失败: {e}")
+        return str(header_value)
+
+def parse_mail_message(msg, decode_stats=None):
+    """
+    解析邮件对象，提取主题、发件人、日期和清理后的正文
+    :param msg: email.message.Message 邮件对象
+    :param decode_stats: Counter，记录正文解码路径
+    :return: dict 解析后的邮件信息，失败时返回None
+    """
+    try:
+        subject = decode_header_field(msg["subject"])
+        sender = decode_header_field(msg["from"])
+        date = msg['date']
+
+        mail_content = ""
+        html_content = ""
+
+        # 非 multipart 邮件的 walk() 只返回邮件本身
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            if content_type == 'text/plain':
+                payload = part.get_payload(decode=True)
+                mail_content = decode_payload(payload, part.get_content_charset(), decode_stats)
+            elif content_type == 'text/html':
+                payload = part.get_payload(decode=True)
+                html_content = decode_payload(payload, part.get_content_charset(), decode_stats)
+
+        # 去掉 HTML 标签
+        final_content = remove_html_tags_and_whitespace(html_content) if html_content else mail_content
+
+        return {
+            'subject': subject,
+            'from': sender,
+            'date': date,
+            'content': clean_text_content(final_content)
+        }
+    except Exception as e:
+        logger.error(f"解析邮件失败: {e}")
+        return None
+
+def parse_raw_message(raw_email, decode_stats=None):
+    """
+    解析原始邮件字节，只依赖参数，可在子进程中执行
+    :param raw_email: RFC822 原始邮件字节
+    :param decode_stats: Counter，记录正文解码路径
+    :return: dict 解析后的邮件信息，失败时返回None
+    """
+    return parse_mail_message(email.message_from_bytes(raw_email), decode_stats)
+
+# 邮件头与正文之间的空行
+HEADER_END_PATTERN = re.compile(rb'\r?\n\r?\n')
+
+def message_fingerprint(raw_email):
+    """
+    计算邮件在已处理台账中的键，只解析邮件头，不解析正文
+    :param raw_email: 原始邮件字节
+    :return: tuple (Message-ID, 内容哈希)，邮件没有 Message-ID 时以内容哈希代替
+    """
+    content_hash = hashlib.blake2b(raw_email, digest_size=16).hexdigest()
+    match = HEADER_END_PATTERN.search(raw_email)
+    header_block = raw_email[:match.end()] if match else raw_email
+    message_id = BytesHeaderParser().parsebytes(header_block).get('Message-ID')
+    message_id = str(message_id).strip() if message_id else f"<{content_hash}>"
+    return message_id, content_hash
+
+FETCH_UID_PATTERN = re.compile(rb'UID (\d+)')
+
+def iter_fetch_response(msg_data):
+    """
+    拆分一次 FETCH 的多消息响应
+    :param msg_data: imaplib 返回的响应列表
+    :return: generator 依次产出 (UID, 原始邮件字节)
+    """
+    pending = None
+    for response_part in msg_data:
+        if isinstance(response_part, tuple):
+            if pending is not None and pending[0] is not None:
+                yield pending
+            match = FETCH_UID_PATTERN.search(response_part[0])
+            pending = (match.group(1) if match else None, response_part[1])
+        elif pending is not None:
+            # 部分服务器把 UID 放在邮件正文之后返回
+            if pending[0] is None and response_part:
+                match = FETCH_UID_PATTERN.search(response_part)
+                if match:
+                    pending = (match.group(1), pending[1])
+            if pending[0] is not None:
+                yield pending
+            pending = None
+    if pending is not None and pending[0] is not None:
+        yield pending
+
+def sync_high_water_mark(email_ids, failed_ids, last_uid=0):
+    """
+    计算可以保存的同步位置：获取失败的邮件之前的UID都已处理，同步位置不超过第一封失败的邮件
+    :param email_ids: 本次同步覆盖的邮件UID列表
+    :param failed_ids: 获取失败的邮件UID列表
+    :param last_uid: 上次保存的同步位置
+    :return: int 新的同步位置
+    """
+    uids = [int(uid) for uid in email_ids]
+    if failed_ids:
+        first_failed = min(int(uid) for uid in failed_ids)
+        uids = [uid for uid in uids if uid < first_failed]
+    return max([last_uid] + uids)
 
 class MailReader:
-    def __init__(self, imap_host=None, email_user=None, email_pwd=None):
+    def __init__(self, imap_host=None, email_user=None, email_pwd=None, imap_port=None):
         """
         初始化邮件读取器
         :param imap_host: IMAP服务器地址
         :param email_user: 邮箱账号
         :param email_pwd: 邮箱密码
+        :param imap_port: IMAP服务器端口
         """
         self.imap_host = imap_host or EMAIL_CONFIG["imap_host"]
+        self.imap_port = imap_port or EMAIL_CONFIG.get("imap_port", imaplib.IMAP4_PORT)
         self.email_user = email_user or EMAIL_CONFIG["email_user"]
         self.email_pwd = email_pwd or EMAIL_CONFIG["email_pwd"]
         self.imap_client = None
+        self.sync_state = None
+        # 正文解码路径统计，见 decode_payload
+        self.decode_stats = Counter()
+        # 已处理台账中内容未变化而跳过的邮件数
+        self.skipped_messages = 0
+        # FETCH 失败的邮件UID，同步位置不会越过这些邮件
+        self.failed_ids = []
 
     def connect(self):
         """
         连接到IMAP服务器
         """
         try:
-            self.imap_client = imaplib.IMAP4(self.imap_host)
+            self.imap_client = imaplib.IMAP4(self.imap_host, self.imap_port)
             logger.info(f"成功连接到 {self.imap_host}")
         except Exception as e:
             logger.error(f"连接IMAP服务器失败: {e}")
@@ -75,25 +317,36 @@ class MailReader:
         """
         选择邮件文件夹
         :param folder_name: 文件夹名称
+        :return: int 文件夹的UIDVALIDITY，服务器未返回时为None
         """
         folder_name = folder_name or EMAIL_CONFIG["folder_name"]
         try:
-            self.imap_client.select(folder_name)
+            status, _ = self.imap_client.select(folder_name)
+            if status != 'OK':
+                raise imaplib.IMAP4.error(f"SELECT {folder_name} 返回 {status}")
             logger.info(f"成功选择文件夹: {folder_name}")
         except Exception as e:
             logger.error(f"选择文件夹失败: {e}")
             raise
 
-    def search_emails(self, search_criteria="ALL"):
+        _, data = self.imap_client.response('UIDVALIDITY')
+        if data and data[0]:
+            return int(data[0])
+        return None
+
+    def search_emails(self, search_criteria="ALL", fetch_all=None):
         """
         搜索邮件
         :param search_criteria: 搜索条件
-        :return: list 邮件ID列表
+        :param fetch_all: 是否忽略 days_back 搜索全部邮件，默认读取 MAIL_FETCH_CONFIG["fetch_all"]
+        :return: list 邮件UID列表
         """
+        if fetch_all is None:
+            fetch_all = MAIL_FETCH_CONFIG.get("fetch_all", False)
         try:
             # 检查是否需要按时间范围搜索
             days_back = MAIL_FETCH_CONFIG.get("days_back")
-            if days_back and not MAIL_FETCH_CONFIG.get("fetch_all", False):
+            if days_back and not fetch_all:
                 from datetime import datetime, timedelta
                 # 计算日期范围
                 end_date = datetime.now()
@@ -105,22 +358,42 @@ class MailReader:
                 search_criteria = f'SINCE "{start_date_str}" BEFORE "{end_date_str}"'
                 logger.info(f"按时间范围搜索邮件: {start_date_str} 到 {end_date_str}")
             
-            status, messages = self.imap_client.search(None, search_criteria)
+            status, messages = self.imap_client.uid('SEARCH', None, search_criteria)
+            if status != 'OK':
+                raise imaplib.IMAP4.error(f"UID SEARCH 返回 {status}")
             email_ids = messages[0].split()
             logger.info(f"找到 {len(email_ids)} 封邮件")
             return email_ids
         except Exception as e:
             logger.error(f"搜索邮件失败: {e}")
-            return []
+            raise
+
+    def search_new_emails(self, last_uid):
+        """
+        搜索UID大于上次同步位置的新邮件
+        :param last_uid: 已处理的最大UID
+        :return: list 新邮件UID列表
+        """
+        try:
+            status, messages = self.imap_client.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+            if status != 'OK':
+                raise imaplib.IMAP4.error(f"UID SEARCH 返回 {status}")
+            # "n:*" 在没有新邮件时仍会返回当前最大UID，需要再过滤一次
+            email_ids = [uid for uid in messages[0].split() if int(uid) > last_uid]
+            logger.info(f"增量同步: UID {last_uid} 之后找到 {len(email_ids)} 封新邮件")
+            return email_ids
+        except Exception as e:
+            logger.error(f"搜索新邮件失败: {e}")
+            raise
 
     def fetch_email_data(self, email_id):
         """
         获取邮件数据
-        :param email_id: 邮件ID
+        :param email_id: 邮件UID
         :return: email.message.Message 邮件对象
         """
         try:
-            status, msg_data = self.imap_client.fetch(email_id, '(RFC822)')
+            status, msg_data = self.imap_client.uid('FETCH', email_id, '(RFC822)')
             for response_part in msg_data:
                 if isinstance(response_part, tuple):
                     msg = email.message_from_bytes(response_part[1])
@@ -130,22 +403,87 @@ class MailReader:
             logger.error(f"获取邮件数据失败: {e}")
             return None
 
+    def fetch_raw_batches(self, email_ids, batch_size=None):
+        """
+        按批次获取原始邮件，每批只发送一次 UID FETCH 请求
+        :param email_ids: 邮件UID列表
+        :param batch_size: 每批邮件数量
+        :return: generator 每批产出一个 [(UID, 原始邮件字节), ...] 列表
+        """
+        batch_size = batch_size or MAIL_FETCH_CONFIG.get("batch_size") or 1
+        for start in range(0, len(email_ids), batch_size):
+            chunk = email_ids[start:start + batch_size]
+            try:
+                status, msg_data = self.imap_client.uid('FETCH', build_message_set(chunk), '(UID RFC822)')
+                if status != 'OK':
+                    raise imaplib.IMAP4.error(f"UID FETCH 返回 {status}")
+            except Exception as e:
+                logger.error(f"批量获取邮件数据失败: {e}")
+                self.failed_ids.extend(chunk)
+                continue
+            batch = list(iter_fetch_response(msg_data))
+            self._record_missing(chunk, batch)
+            yield batch
+
+    def _record_missing(self, chunk, batch):
+        # 服务器没有返回的邮件同样视为获取失败
+        returned = {int(uid) for uid, _ in batch}
+        self.failed_ids.extend(uid for uid in chunk if int(uid) not in returned)
+
+    def fetch_emails_batch(self, email_ids, batch_size=None):
+        """
+        按批次获取邮件数据，每批只发送一次 UID FETCH 请求
+        :param email_ids: 邮件UID列表
+        :param batch_size: 每批邮件数量
+        :return: generator 依次产出 (UID, email.message.Message)
+        """
+        for batch in self.fetch_raw_batches(email_ids, batch_size):
+            for uid, raw_email in batch:
+                yield uid, email.message_from_bytes(raw_email)
+
+    def fetch_headers(self, email_ids, batch_size=None):
+        """
+        按批次只获取邮件的主题和日期头，不下载邮件正文
+        :param email_ids: 邮件UID列表
+        :param batch_size: 每批邮件数量
+        :return: generator 依次产出 (UID, 主题, 日期)
+        """
+        batch_size = batch_size or MAIL_FETCH_CONFIG.get("batch_size") or 1
+        for start in range(0, len(email_ids), batch_size):
+            chunk = email_ids[start:start + batch_size]
+            try:
+                status, msg_data = self.imap_client.uid(
+                    'FETCH', build_message_set(chunk), '(UID BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)])'
+                )
+                if status != 'OK':
+                    raise imaplib.IMAP4.error(f"UID FETCH 返回 {status}")
+            except Exception as e:
+                logger.error(f"批量获取邮件头失败: {e}")
+                self.failed_ids.extend(chunk)
+                continue
+            headers_batch = list(iter_fetch_response(msg_data))
+            self._record_missing(chunk, headers_batch)
+            for uid, raw_header in headers_batch:
+                headers = email.message_from_bytes(raw_header)
+                yield uid, self.decode_header_field(headers["subject"]), headers["date"]
+
+    def filter_ticket_emails(self, email_ids):
+        """
+        根据邮件主题预先筛选出需要处理的12306通知邮件
+        :param email_ids: 邮件UID列表
+        :return: list 主题属于 TICKET_SUBJECTS 的邮件UID列表
+        """
+        ticket_ids = [uid for uid, subject, _ in self.fetch_headers(email_ids) if subject in TICKET_SUBJECTS]
+        logger.info(f"邮件头预筛选: {len(email_ids)} 封邮件中有 {len(ticket_ids)} 封车票通知")
+        return ticket_ids
+
     def decode_header_field(self, header_value):
         """
         解码邮件头字段
         :param header_value: 邮件头值
         :return: str 解码后的值
         """
-        if not header_value:
-            return ""
-        try:
-            decoded_value, encoding = decode_header(header_value)[0]
-            if isinstance(decoded_value, bytes):
-                return decoded_value.decode(encoding if encoding else 'utf-8')
-            return decoded_value
-        except Exception as e:
-            logger.error(f"解码邮件头失败: {e}")
-            return str(header_value)
+        return decode_header_field(header_value)
 
     def parse_email(self, email_id):
         """
@@ -156,81 +494,110 @@ class MailReader:
         msg = self.fetch_email_data(email_id)
         if msg is None:
             return None
+        return self.parse_message(msg)
 
-        try:
-            subject = self.decode_header_field(msg["subject"])
-            sender = self.decode_header_field(msg["from"])
-            date = msg['date']
-
-            mail_content = ""
-            html_content = ""
-
-            if msg.is_multipart():
-                for part in msg.walk():
-                    content_type = part.get_content_type()
-                    if content_type == 'text/plain':
-                        payload = part.get_payload(decode=True)
-                        detected_encoding = chardet.detect(payload)['encoding']
-                        mail_content = payload.decode(detected_encoding, errors='ignore')
-                    elif content_type == 'text/html':
-                        payload = part.get_payload(decode=True)
-                        detected_encoding = chardet.detect(payload)['encoding']
-                        html_content = payload.decode(detected_encoding, errors='ignore')
-            else:
-                payload = msg.get_payload(decode=True)
-                if msg.get_content_type() == 'text/plain':
-                    detected_encoding = chardet.detect(payload)['encoding']
-                    mail_content = payload.decode(detected_encoding, errors='ignore')
-                elif msg.get_content_type() == 'text/html':
-                    detected_encoding = chardet.detect(payload)['encoding']
-                    html_content = payload.decode(detected_encoding, errors='ignore')
-
-            # 去掉 HTML 标签
-            final_content = remove_html_tags_and_whitespace(html_content) if html_content else mail_content
-
-            return {
-                'subject': subject,
-                'from': sender,
-                'date': date,
-                'content': clean_text_content(final_content)
-            }
-        except Exception as e:
-            logger.error(f"解析邮件失败: {e}")
-            return None
+    def parse_message(self, msg):
+        """
+        解析已获取的邮件对象
+        :param msg: email.message.Message 邮件对象
+        :return: dict 解析后的邮件信息
+        """
+        return parse_mail_message(msg, self.decode_stats)
 
-    def read_emails(self, folder_name=None, max_emails=None):
+    def read_emails(self, folder_name=None, max_emails=None, db=None):
         """
         读取邮件列表
         :param folder_name: 文件夹名称
         :param max_emails: 最大邮件数量
+        :param db: 数据库对象，传入且开启增量同步时只读取上次同步之后的新邮件
         :return: list 邮件信息列表
         """
+        return list(self.iter_emails(folder_name, max_emails, db))
+
+    def iter_emails(self, folder_name=None, max_emails=None, db=None):
+        """
+        逐封读取并解析邮件，每批 FETCH 的邮件解析后立即产出，内存占用与邮件总数无关
+        全部邮件读取完成后才设置 sync_state；某一批 FETCH 失败时，同步位置只推进到该批第一封邮件之前，
+        失败的UID记录在 failed_ids 中。连接、登录、选择文件夹和搜索失败时抛出异常
+        :param folder_name: 文件夹名称
+        :param max_emails: 最大邮件数量
+        :param db: 数据库对象，传入且开启增量同步时只读取上次同步之后的新邮件
+        :return: generator 依次产出邮件信息
+        """
+        folder_name = folder_name or EMAIL_CONFIG["folder_name"]
+        self.sync_state = None
+        self.skipped_messages = 0
+        self.failed_ids = []
         try:
             self.connect()
             self.login()
-            self.select_folder(folder_name)
+            uidvalidity = self.select_folder(folder_name)
 
-            email_ids = self.search_emails()
+            sync_state = None
+            if db is not None and MAIL_FETCH_CONFIG.get("incremental", False) and uidvalidity is not None:
+                sync_state = db.get_sync_state(self.email_user, folder_name)
+                if sync_state and sync_state['uidvalidity'] != uidvalidity:
+                    logger.info(f"文件夹 {folder_name} 的UIDVALIDITY已变化 "
+                                f"({sync_state['uidvalidity']} -> {uidvalidity})，执行全量同步")
+                    sync_state = None
+
+            if sync_state:
+                email_ids = self.search_new_emails(sync_state['last_uid'])
+            else:
+                email_ids = self.search_emails()
             
+            # 先只拉取邮件头，正文只下载主题能被处理的邮件
+            if MAIL_FETCH_CONFIG.get("header_prefilter", False):
+                ticket_ids = self.filter_ticket_emails(email_ids)
+            else:
+                ticket_ids = email_ids
+            synced_ids = email_ids
+
             # 优先使用MAIL_FETCH_CONFIG中的max_emails配置
             max_emails = max_emails or MAIL_FETCH_CONFIG.get("max_emails") or MAIL_CONFIG["max_emails_per_fetch"]
             
             # 限制处理的邮件数量
-            if max_emails and len(email_ids) > max_emails:
-                email_ids = email_ids[-max_emails:]  # 取最新的邮件
+            if max_emails and len(ticket_ids) > max_emails:
+                if sync_state:
+                    # 增量同步时先处理较早的邮件，剩余的留给下一次同步
+                    ticket_ids = ticket_ids[:max_emails]
+                    synced_ids = ticket_ids
+                else:
+                    ticket_ids = ticket_ids[-max_emails:]  # 取最新的邮件
                 logger.info(f"限制处理邮件数量为: {max_emails}")
             
-            email_info_list = []
-            for email_id in email_ids:
-                email_info = self.parse_email(email_id)
-                if email_info:
-                    email_info_list.append(email_info)
+            parsed = 0
+            dedup = db is not None and MAIL_FETCH_CONFIG.get("dedup", True)
+            for batch in self.fetch_raw_batches(ticket_ids):
+                fingerprints = [message_fingerprint(raw_email) for _, raw_email in batch]
+                # 台账中内容未变化的邮件直接跳过，不再解析
+                processed = db.get_processed_messages(fingerprints) if dedup else set()
+                for (_, raw_email), fingerprint in zip(batch, fingerprints):
+                    if fingerprint in processed:
+                        self.skipped_messages += 1
+                        continue
+                    email_info = self.parse_message(email.message_from_bytes(raw_email))
+                    if email_info:
+                        email_info['fingerprint'] = fingerprint
+                        parsed += 1
+                        yield email_info
+
+            if self.failed_ids:
+                logger.error(f"{len(self.failed_ids)} 封邮件获取失败，同步位置不会越过这些邮件")
+            if uidvalidity is not None:
+                last_uid = sync_state['last_uid'] if sync_state else 0
+                last_uid = sync_high_water_mark(synced_ids, self.failed_ids, last_uid)
+                self.sync_state = {
+                    'folder': folder_name,
+                    'uidvalidity': uidvalidity,
+                    'last_uid': last_uid
+                }
             
-            logger.info(f"成功解析 {len(email_info_list)} 封邮件")
-            return email_info_list
+            logger.info(f"成功解析 {parsed} 封邮件，跳过已处理邮件 {self.skipped_messages} 封")
         except Exception as e:
+            # 连接、登录、选择文件夹或搜索失败时不设置 sync_state，由调用方决定是否重试
             logger.error(f"读取邮件失败: {e}")
-            return []
+            raise
         finally:
             if self.imap_client:
                 try:
@@ -238,120 +605,244 @@ class MailReader:
                 except:
                     pass
 
-def process_ticket_emails(emails, db):
+    def commit_sync_state(self, db):
+        """
+        邮件处理完成后保存同步位置，下次同步从该位置之后开始
+        :param db: 数据库对象
+        """
+        if not self.sync_state or not MAIL_FETCH_CONFIG.get("incremental", False):
+            return
+        db.save_sync_state(
+            self.email_user,
+            self.sync_state['folder'],
+            self.sync_state['uidvalidity'],
+            self.sync_state['last_uid']
+        )
+        logger.info(f"保存同步位置: {self.sync_state['folder']} UIDVALIDITY={self.sync_state['uidvalidity']} "
+                    f"UID={self.sync_state['last_uid']}")
+
+def extract_ticket_records(email_info):
+    """
+    从一封已解析的邮件中提取车票和退票记录，只依赖参数，可在子进程中执行
+    :param email_info: parse_mail_message 返回的邮件信息
+    :return: tuple (车票信息列表, 退票信息列表, 解析失败数)
+    """
+    tickets = []
+    refunds = []
+    errors = 0
+    subject = email_info['subject']
+    content = email_info['content']
+    
+    logger.info(f"处理邮件: {subject}")
+    
+    if subject in (PAYMENT_SUBJECT, WAITING_SUBJECT):
+        # 处理购票和候补订单信息，一个订单包含多位乘客时逐位处理
+        is_waiting = subject == WAITING_SUBJECT
+        label = '候补' if is_waiting else '购票'
+        for ticket_info in parse_ticket_infos(content):
+            if not validate_ticket_info(ticket_info):
+                logger.warning(f"{'候补' if is_waiting else ''}车票信息验证失败: {ticket_info}")
+                errors += 1
+                continue
+
+            # 检查乘客姓名过滤
+            if PASSENGER_FILTER and ticket_info.get('passenger_name') != PASSENGER_FILTER:
+                logger.info(f"跳过非目标乘客: {ticket_info.get('passenger_name')}")
+                continue
+
+            if is_waiting:
+                ticket_info['is_waiting'] = True
+            tickets.append(ticket_info)
+            logger.info(f"{label}: {ticket_info['order_id']} {ticket_info['passenger_name']} {ticket_info['departure_time']} {ticket_info['departure_station']}-{ticket_info['arrival_station']} {ticket_info['train_number']} {ticket_info['carriage_number']} {ticket_info['seat_number']} {ticket_info['seat_type']} {ticket_info['price']}元")
+
+    elif subject == REFUND_SUBJECT:
+        # 处理退票信息，一封邮件退多位乘客时按乘客逐条退票，各自使用自己的手续费
+        for refund_info in parse_refund_infos(content):
+            # 与购票使用同一乘客过滤，非目标乘客的车票没有写入，退票也无从匹配
+            if PASSENGER_FILTER and refund_info.get('passenger_name') not in (None, PASSENGER_FILTER):
+                logger.info(f"跳过非目标乘客的退票: {refund_info.get('passenger_name')}")
+                continue
+            if refund_info.get('order_id'):
+                refunds.append(refund_info)
+                logger.info(f"退票: {refund_info['order_id']} {refund_info.get('passenger_name', '')} 票价:{refund_info['price']}元 应退:{refund_info['refund_amount']}元 手续费:{refund_info['service_fee']}元")
+            else:
+                logger.warning(f"退票信息解析失败: {refund_info}")
+                errors += 1
+
+    return tickets, refunds, errors
+
+def write_ticket_records(db, tickets, refunds, messages, batch_size):
     """
-    处理车票相关邮件
-    :param emails: 邮件列表
+    写入一批车票和退票记录，并把记录全部写入成功的邮件逐封记入已处理台账
+    车票先于退票写入，保证同一批次中的退票能找到对应的车票
     :param db: 数据库对象
-    :return: dict 处理结果统计
+    :param tickets: 车票信息列表
+    :param refunds: 退票信息列表
+    :param messages: list [(邮件指纹, 车票数, 退票数), ...]，顺序与 tickets、refunds 中记录的顺序一致；
+                     解析失败等不应记入台账的邮件指纹为None
+    :param batch_size: 每个退票事务更新的记录数
+    :return: tuple (写入的车票数, 匹配到车票的退票记录数, 数据库写入失败的记录数)
+    """
+    # 车票在一个事务中写入，要么全部成功要么全部失败
+    written = db.bulk_upsert_tickets(tickets, batch_size=len(tickets) or 1)
+    matched = db.refund_tickets(refunds, batch_size=batch_size)
+
+    # 某封邮件的车票写入失败或退票没有找到车票时，只有这封邮件不记入台账，下次同步时重新处理
+    fingerprints = []
+    offset = 0
+    for fingerprint, ticket_count, refund_count in messages:
+        refunded = all(matched[offset:offset + refund_count])
+        offset += refund_count
+        if fingerprint and refunded and (not ticket_count or written == len(tickets)):
+            fingerprints.append(fingerprint)
+    if fingerprints:
+        db.mark_messages_processed(fingerprints, batch_size=batch_size)
+    # 没有找到车票的退票不算写入失败，只有事务失败的记录才算
+    failed = len(tickets) - written + sum(1 for result in matched if result is None)
+    return written, sum(1 for result in matched if result), failed
+
+def process_ticket_emails(emails, db, batch_size=None):
+    """
+    处理车票相关邮件，边读取边分批写入数据库
+    :param emails: 可迭代的邮件信息，可以是 MailReader.iter_emails 返回的生成器
+    :param db: 数据库对象
+    :param batch_size: 累积多少条车票或退票记录写入一次，默认读取 MAIL_FETCH_CONFIG["batch_size"]
+    :return: dict 处理结果统计，write_failures 为数据库写入失败的记录数
     """
+    batch_size = batch_size or MAIL_FETCH_CONFIG.get("batch_size") or 200
     stats = {
         'total_processed': 0,
         'tickets_added': 0,
         'refunds_processed': 0,
-        'errors': 0
+        'errors': 0,
+        'write_failures': 0
     }
-    
-    for email_info in emails:
-        try:
-            subject = email_info['subject']
-            content = email_info['content']
-            
-            logger.info(f"处理邮件: {subject}")
-            
-            if subject == "网上购票系统-用户支付通知":
-                # 处理购票信息
-                ticket_info = parse_ticket_info(content)
-                if validate_ticket_info(ticket_info):
-                    # 检查乘客姓名过滤
-                    if PASSENGER_FILTER and ticket_info.get('passenger_name') != PASSENGER_FILTER:
-                        logger.info(f"跳过非目标乘客: {ticket_info.get('passenger_name')}")
-                        continue
-                    
-                    result = db.add_ticket(ticket_info)
-                    if result:
-                        stats['tickets_added'] += 1
-                        logger.info(f"购票: {ticket_info['order_id']} {ticket_info['passenger_name']} {ticket_info['departure_time']} {ticket_info['departure_station']}-{ticket_info['arrival_station']} {ticket_info['train_number']} {ticket_info['carriage_number']} {ticket_info['seat_number']} {ticket_info['seat_type']} {ticket_info['price']}元")
-                    else:
-                        stats['errors'] += 1
-                else:
-                    logger.warning(f"车票信息验证失败: {ticket_info}")
-                    stats['errors'] += 1
-
-            elif subject == "网上购票系统-候补订单兑现成功通知":
-                # 处理候补订单信息
-                ticket_info = parse_ticket_info(content)
-                if validate_ticket_info(ticket_info):
-                    # 检查乘客姓名过滤
-                    if PASSENGER_FILTER and ticket_info.get('passenger_name') != PASSENGER_FILTER:
-                        logger.info(f"跳过非目标乘客: {ticket_info.get('passenger_name')}")
-                        continue
-                    
-                    ticket_info['is_waiting'] = True
-                    result = db.add_ticket(ticket_info)
-                    if result:
-                        stats['tickets_added'] += 1
-                        logger.info(f"候补: {ticket_info['order_id']} {ticket_info['passenger_name']} {ticket_info['departure_time']} {ticket_info['departure_station']}-{ticket_info['arrival_station']} {ticket_info['train_number']} {ticket_info['carriage_number']} {ticket_info['seat_number']} {ticket_info['seat_type']} {ticket_info['price']}元")
-                    else:
-                        stats['errors'] += 1
-                else:
-                    logger.warning(f"候补车票信息验证失败: {ticket_info}")
-                    stats['errors'] += 1
-
-            elif subject == "网上购票系统-用户退票通知":
-                # 处理退票信息
-                refund_info = parse_refund_info(content)
-                if refund_info.get('order_id'):
-                    result = db.refund_ticket(
-                        order_id=refund_info['order_id'],
-                        service_fee=refund_info['service_fee']
-                    )
-                    if result:
-                        stats['refunds_processed'] += 1
-                        logger.info(f"退票: {refund_info['order_id']} 票价:{refund_info['price']}元 应退:{refund_info['refund_amount']}元 手续费:{refund_info['service_fee']}元")
-                    else:
-                        stats['errors'] += 1
-                else:
-                    logger.warning(f"退票信息解析失败: {refund_info}")
-                    stats['errors'] += 1
-            
+    tickets = []
+    refunds = []
+    messages = []
+
+    def flush():
+        written, refunded, failed = write_ticket_records(db, tickets, refunds, messages, batch_size)
+        stats['tickets_added'] += written
+        stats['refunds_processed'] += refunded
+        stats['write_failures'] += failed
+        stats['errors'] += len(tickets) - written + len(refunds) - refunded
+        tickets.clear()
+        refunds.clear()
+        messages.clear()
+
+    try:
+        for email_info in emails:
+            try:
+                email_tickets, email_refunds, errors = extract_ticket_records(email_info)
+            except Exception as e:
+                logger.error(f"处理邮件失败: {e}")
+                stats['errors'] += 1
+                continue
+            tickets.extend(email_tickets)
+            refunds.extend(email_refunds)
+            stats['errors'] += errors
             stats['total_processed'] += 1
-            
-        except Exception as e:
-            logger.error(f"处理邮件失败: {e}")
-            stats['errors'] += 1
-    
+            # 解析失败的邮件不记入台账，解析规则修正后可以重新处理
+            fingerprint = email_info.get('fingerprint') if not errors else None
+            messages.append((fingerprint, len(email_tickets), len(email_refunds)))
+            if len(tickets) + len(refunds) + len(messages) >= batch_size:
+                flush()
+    finally:
+        # 读取邮件中途失败时，已解析的记录仍然写入
+        flush()
     return stats
 
-def main():
+def sync_account(account=None, db=None):
     """
-    主函数：读取邮件并处理车票信息
+    同步单个邮箱账号：读取邮件、处理车票信息并保存同步位置
+    连接、登录、选择文件夹或搜索邮件失败时抛出异常；部分邮件获取失败时正常返回，failed_messages 为失败数量；
+    有记录写入数据库失败时不保存同步位置，write_failures 为失败的记录数
+    :param account: 邮箱账号配置，格式同 EMAIL_CONFIG，默认为 EMAIL_CONFIG
+    :param db: 数据库对象，未传入时自动创建并在结束后关闭
+    :return: dict 处理结果统计
     """
-    try:
-        logger.info("开始处理车票邮件...")
-        
-        # 创建数据库连接
+    account = account or EMAIL_CONFIG
+    own_db = db is None
+    if own_db:
         db = TicketDB()
-        
+
+    try:
         # 创建邮件读取器并读取邮件
-        mail_reader = MailReader()
-        emails = mail_reader.read_emails()
-        
-        if not emails:
-            logger.info("没有找到邮件")
-            return
-        
-        # 处理车票邮件
+        mail_reader = MailReader(
+            imap_host=account.get("imap_host"),
+            email_user=account.get("email_user"),
+            email_pwd=account.get("email_pwd"),
+            imap_port=account.get("imap_port")
+        )
+        emails = mail_reader.iter_emails(folder_name=account.get("folder_name"), db=db)
+
+        # 边读取边处理车票邮件，生成器耗尽后 sync_state 才会被设置
         stats = process_ticket_emails(emails, db)
-        
+        if not stats['total_processed'] and not mail_reader.skipped_messages and not mail_reader.failed_ids:
+            logger.info(f"{mail_reader.email_user} 没有找到邮件")
+        if stats['write_failures']:
+            # 写入失败的邮件还没有记入台账，不保存同步位置，下次同步时重新获取；已写入的邮件由台账跳过
+            logger.error(f"{mail_reader.email_user} 有 {stats['write_failures']} 条记录写入数据库失败，不保存同步位置")
+        else:
+            mail_reader.commit_sync_state(db)
+        stats['decode_paths'] = dict(mail_reader.decode_stats)
+        stats['skipped_unchanged'] = mail_reader.skipped_messages
+        # 获取失败的邮件计入错误，下次同步时重新获取
+        stats['failed_messages'] = len(mail_reader.failed_ids)
+        stats['errors'] += stats['failed_messages']
+
         # 输出统计信息
-        logger.info(f"处理完成 - 总计: {stats['total_processed']}, 新增车票: {stats['tickets_added']}, 退票处理: {stats['refunds_processed']}, 错误: {stats['errors']}")
+        logger.info(f"{mail_reader.email_user} 处理完成 - 总计: {stats['total_processed']}, 跳过已处理: {stats['skipped_unchanged']}, 新增车票: {stats['tickets_added']}, 退票处理: {stats['refunds_processed']}, 错误: {stats['errors']}, 解码路径: {stats['decode_paths']}")
+        return stats
+    finally:
+        if own_db:
+            db.close()
+
+def main(argv=None):
+    """
+    主函数：读取所有邮箱账号的邮件并处理车票信息，或从本地邮件文件导入
+    """
+    parser = argparse.ArgumentParser(description="读取12306通知邮件并保存车票信息")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("sync", help="通过IMAP同步所有邮箱账号（默认）")
+    import_parser = subparsers.add_parser("import", help="从 mbox 文件、Maildir 目录或 .eml 文件导入")
+    import_parser.add_argument("paths", nargs="+", help="mbox 文件、Maildir 目录、.eml 文件或包含 .eml 的目录")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "import":
+            from tools.importer import import_messages
+            logger.info("开始导入本地邮件...")
+            import_messages(args.paths)
+            return
+
+        logger.info("开始处理车票邮件...")
         
-        db.close()
+        # 创建数据库连接
+        db = TicketDB()
+        failed = []
+        try:
+            for account in EMAIL_ACCOUNTS:
+                # 一个账号失败时继续同步其他账号，全部结束后再报告失败
+                try:
+                    stats = sync_account(account, db)
+                    # 部分邮件获取或写入失败时同步位置没有越过这些邮件，同样报告失败
+                    if stats['failed_messages'] or stats['write_failures']:
+                        failed.append(account.get('email_user'))
+                except Exception as e:
+                    logger.error(f"同步邮箱 {account.get('email_user')} 失败: {e}")
+                    failed.append(account.get('email_user'))
+        finally:
+            db.close()
+        if failed:
+            raise RuntimeError(f"以下邮箱同步失败: {', '.join(str(account) for account in failed)}")
         
     except Exception as e:
         logger.error(f"处理失败: {e}")
         raise
+    finally:
+        close_connections()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
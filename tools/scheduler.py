@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+后台邮件同步调度器
+
+按 MAIL_CONFIG["auto_refresh_interval"] 定期同步邮箱，手动触发和定时触发共用同一个任务队列：
+同一时刻最多只有一个任务在运行、一个任务在排队，重复的触发会合并到排队中的任务。
+同步失败时按指数退避重试，每次等待都带有随机抖动，避免多个实例同时访问邮箱服务器。
+"""
+
+import asyncio
+import logging
+import random
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from config import MAIL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 保留的历史任务数量
+MAX_JOB_HISTORY = 100
+
+class IngestionScheduler:
+    def __init__(self, mail_pool, interval=None, jitter=None, retry_base_delay=None):
+        """
+        初始化调度器
+        :param mail_pool: AsyncMailPool 邮件同步池
+        :param interval: 定时同步间隔（秒），为0或None时只响应手动触发
+        :param jitter: 随机抖动占等待时间的比例
+        :param retry_base_delay: 失败重试的初始等待时间（秒）
+        """
+        self.mail_pool = mail_pool
+        self.interval = interval if interval is not None else MAIL_CONFIG.get("auto_refresh_interval")
+        self.jitter = jitter if jitter is not None else MAIL_CONFIG.get("auto_refresh_jitter", 0.1)
+        self.retry_base_delay = retry_base_delay or MAIL_CONFIG.get("retry_base_delay", 60)
+        self.jobs = OrderedDict()
+        self.pending_job = None
+        self.running_job = None
+        self.failures = 0
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        """
+        启动调度循环，需在事件循环中调用
+        """
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"邮件同步调度器已启动，同步间隔: {self.interval} 秒")
+
+    async def stop(self):
+        """
+        停止调度循环
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info("邮件同步调度器已停止")
+
+    def trigger(self, reason="manual"):
+        """
+        提交一次同步任务，已有排队中的任务时直接复用该任务
+        :param reason: 触发原因，manual 或 schedule
+        :return: dict 任务信息
+        """
+        if self.pending_job is not None:
+            logger.info(f"同步任务 {self.pending_job['job_id']} 已在排队，合并本次触发")
+            return self.pending_job
+
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "trigger": reason,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+        self.jobs[job["job_id"]] = job
+        while len(self.jobs) > MAX_JOB_HISTORY:
+            self.jobs.popitem(last=False)
+
+        self.pending_job = job
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def get_job(self, job_id):
+        """
+        查询任务状态
+        :param job_id: 任务ID
+        :return: dict 任务信息，不存在时返回None
+        """
+        return self.jobs.get(job_id)
+
+    def next_delay(self):
+        """
+        计算距离下一次定时同步的等待时间
+        :return: float 等待秒数，不需要定时同步时返回None
+        """
+        if self.failures:
+            delay = self.retry_base_delay * 2 ** (self.failures - 1)
+            if self.interval:
+                delay = min(delay, self.interval)
+        elif self.interval:
+            delay = self.interval
+        else:
+            return None
+        return delay + random.uniform(0, delay * self.jitter)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.next_delay())
+            except asyncio.TimeoutError:
+                self.trigger("schedule")
+            self._wakeup.clear()
+
+            job, self.pending_job = self.pending_job, None
+            if job is None:
+                continue
+            await self._execute(job)
+
+    async def _execute(self, job):
+        self.running_job = job
+        job["status"] = "running"
+        job["started_at"] = datetime.now().isoformat()
+        logger.info(f"开始同步任务 {job['job_id']}（{job['trigger']}）")
+        try:
+            results = await self.mail_pool.sync_all()
+            job["result"] = results
+            failed = [result["account"] for result in results if result["status"] != "success"]
+            if failed:
+                raise RuntimeError(f"以下邮箱同步失败: {', '.join(str(account) for account in failed)}")
+            job["status"] = "success"
+            self.failures = 0
+            logger.info(f"同步任务 {job['job_id']} 完成")
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            self.failures += 1
+            logger.error(f"同步任务 {job['job_id']} 失败（连续失败 {self.failures} 次）: {e}")
+        finally:
+            job["finished_at"] = datetime.now().isoformat()
+            self.running_job = None